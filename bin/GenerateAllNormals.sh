@@ -1,58 +1,10 @@
 #!/bin/bash
 
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database BethuneWeatherReport --table LilleLesquinDayWeatherConditions 1991 2020
-mv StatsNormals_1991_2020.json StatsNormals_LIlleLesquin_1991_2020.json
+# Each station table is read once: WC_GenNormalsStats.py batch mode writes
+# StatsNormals_<station>_<year_start>_<year_end>.json for every period
 
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database BethuneWeatherReport --table LilleLesquinDayWeatherConditions 1981 2010
-mv StatsNormals_1981_2010.json StatsNormals_LIlleLesquin_1981_2010.json
+python3 ../src/WC_GenNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database BethuneWeatherReport --table LilleLesquinDayWeatherConditions --station LIlleLesquin --sliding 1951 2020 10
 
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database BethuneWeatherReport --table LilleLesquinDayWeatherConditions 1971 2000
-mv StatsNormals_1971_2000.json StatsNormals_LIlleLesquin_1971_2000.json
+python3 ../src/WC_GenNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions --station ParisMontsouris --periods 1873-1900 1881-1910 1891-1920 1901-1930 1911-1940 1921-1950 1931-1960 1941-1970 1951-1980 1961-1990 1971-2000 1981-2010 1991-2020
 
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database BethuneWeatherReport --table LilleLesquinDayWeatherConditions 1961 1990
-mv StatsNormals_1961_1990.json StatsNormals_LIlleLesquin_1961_1990.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database BethuneWeatherReport --table LilleLesquinDayWeatherConditions 1951 1980
-mv StatsNormals_1951_1980.json StatsNormals_LIlleLesquin_1951_1980.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1873 1900
-mv StatsNormals_1873_1900.json StatsNormals_ParisMontsouris_1873_1900.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1881 1910
-mv StatsNormals_1881_1910.json StatsNormals_ParisMontsouris_1881_1910.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1891 1920
-mv StatsNormals_1891_1920.json StatsNormals_ParisMontsouris_1891_1920.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1901 1930
-mv StatsNormals_1901_1930.json StatsNormals_ParisMontsouris_1901_1930.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1911 1940
-mv StatsNormals_1911_1940.json StatsNormals_ParisMontsouris_1911_1940.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1921 1950
-mv StatsNormals_1921_1950.json StatsNormals_ParisMontsouris_1921_1950.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1931 1960
-mv StatsNormals_1931_1960.json StatsNormals_ParisMontsouris_1931_1960.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1941 1970
-mv StatsNormals_1941_1970.json StatsNormals_ParisMontsouris_1941_1970.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1951 1980
-mv StatsNormals_1951_1980.json StatsNormals_ParisMontsouris_1951_1980.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1961 1990
-mv StatsNormals_1961_1990.json StatsNormals_ParisMontsouris_1961_1990.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1971 2000
-mv StatsNormals_1971_2000.json StatsNormals_ParisMontsouris_1971_2000.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1981 2010
-mv StatsNormals_1981_2010.json StatsNormals_ParisMontsouris_1981_2010.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table ParisMontsourisDayWeatherConditions 1991 2020
-mv StatsNormals_1991_2020.json StatsNormals_ParisMontsouris_1991_2020.json
-
-python3 ../src/GenerateNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table DayWeatherConditions 2016 2023
-mv StatsNormals_2016_2023.json StatsNormals_VillebonSurYvette_2016_2023.json
+python3 ../src/WC_GenNormalsStats.py --host 192.168.17.10 --user admin --password 'Z0uZ0u0!' --database VillebonWeatherReport --table DayWeatherConditions --station VillebonSurYvette --periods 2016-2023
@@ -1,5 +1,4 @@
 import json
-from tabulate import tabulate
 import sys
 
 def flatten_dict(d, parent_key='', sep='_'):
@@ -30,6 +29,9 @@ def display_stats(stats):
     Parameters:
     - stats (dict): Dictionary containing climate statistics.
     """
+    # Imported here: flatten_dict is also used by WC_NormalsStore, which does not need tabulate
+    from tabulate import tabulate
+
     flat_stats = flatten_dict(stats)
     
     data = []
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""Load the Météo-France daily climatological data of stations into DayWeatherConditions.
+
+Replaces CollectMFallData.sh / CollectMFweatherData.sh: the departmental file
+of "Données climatologiques de base - quotidiennes" (meteo.data.gouv.fr),
+plain or gzipped, is read once as a stream, the rows of each selected station
+(NOM_USUEL) within the year range are converted and bulk upserted into the
+DayWeatherConditions table of a station of the JSON configuration file:
+
+    MV_CollectMFData.py -i Q_59_previous-1950-2022_RR-T-Vent.csv.gz -y 1950 -e 2022 -c config.json \\
+                        -m LILLE-LESQUIN=db3 -m DUNKERQUE=db4
+
+Each station has its own writer thread fed through a bounded queue: the
+file is read once whatever the number of stations, the database writes run
+in parallel, and a station whose database fails does not stop the others.
+
+Fields are found by the names of the header line (see CollectMFweatherData.txt):
+- TM missing is the average of TN and TX,
+- the pressure high is derived from PMERM and PMERMIN (2 * PMERM - PMERMIN),
+- the wind speeds (FXY, FXI) are converted from m/s to km/h.
+"""
+import argparse
+import gzip
+import heapq
+import io
+import mmap
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal, ROUND_HALF_UP
+
+from WC_DbWriter import DEFAULT_CHUNK_SIZE
+
+# DayWeatherConditions columns written, in the order of the rows
+MF_COLUMNS = ['WC_Date', 'WC_TempAvg', 'WC_TempHigh', 'WC_TempLow',
+              'WC_HumidityAvg', 'WC_HumidityHigh', 'WC_HumidityLow',
+              'WC_PressureAvg', 'WC_PressureHigh', 'WC_PressureLow',
+              'WC_WindSpeedMax', 'WC_GustSpeedMax', 'WC_PrecipitationSum']
+
+# Météo-France fields used
+MF_FIELDS = ['AAAAMMJJ', 'NOM_USUEL', 'TN', 'TX', 'TM', 'UM', 'UX', 'UN', 'PMERM', 'PMERMIN', 'FXY', 'FXI', 'RR']
+
+# Position of the fields in the projected rows of the parallel parse
+PROJECTED_INDEX = {name: position for position, name in enumerate(MF_FIELDS)}
+
+KMH_PER_MS = Decimal('3.6')
+TENTH = Decimal('0.1')
+
+# Size of the parts of an uncompressed file parsed by the worker processes
+CHUNK_BYTES = 32 * 1024 * 1024
+
+
+def open_mf_file(path, encoding='utf-8'):
+    """Text stream of a Météo-France file, '-' for stdin, gunzipped when compressed."""
+    binary = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    binary = io.BufferedReader(binary) if not hasattr(binary, 'peek') else binary
+    if binary.peek(2)[:2] == b'\x1f\x8b':
+        binary = gzip.GzipFile(fileobj=binary)
+    return io.TextIOWrapper(binary, encoding=encoding, newline='')
+
+
+def mf_header(line):
+    """Position of each field of the header line (first occurrence: merged files repeat NUM_POSTE...)."""
+    index = {}
+    for position, name in enumerate(line.lstrip('\ufeff').rstrip('\r\n').split(';')):
+        index.setdefault(name.strip().strip('"'), position)
+    missing = [name for name in MF_FIELDS if name not in index]
+    if missing:
+        raise ValueError(f"Fields {', '.join(missing)} not found in the Météo-France file header")
+    return index
+
+
+def _value(text):
+    return Decimal(text) if text else None
+
+
+def _round(value):
+    return None if value is None else value.quantize(TENTH, rounding=ROUND_HALF_UP)
+
+
+def mf_rows(lines, stations, start_year, end_year):
+    """Fields of the rows of the stations (NOM_USUEL names) within the years.
+
+    Yields (index, fields), index being the header positions and fields the
+    list of strings of the row. Only the leading fields up to NOM_USUEL are
+    split for the rows of the other stations.
+    """
+    index = mf_header(next(lines))
+    name, day = index['NOM_USUEL'], index['AAAAMMJJ']
+    stations = set(stations)
+    start, end = str(start_year), str(end_year)
+    for line in lines:
+        parts = line.split(';', name + 1)
+        if len(parts) <= name or parts[name] not in stations:
+            continue
+        fields = line.rstrip('\r\n').split(';')
+        if start <= fields[day][:4] <= end:
+            yield index, fields
+
+
+def DayWeatherConditionsRow(index, fields):
+    """DayWeatherConditions values (MF_COLUMNS) of a Météo-France row."""
+    get = lambda name: _value(fields[index[name]])
+    tn, tx, tm = get('TN'), get('TX'), get('TM')
+    if tm is None and tn is not None and tx is not None:
+        tm = _round((tn + tx) / 2)
+    pmerm, pmermin = get('PMERM'), get('PMERMIN')
+    pressure_high = 2 * pmerm - pmermin if pmerm is not None and pmermin is not None else None
+    fxy, fxi = get('FXY'), get('FXI')
+
+    day = fields[index['AAAAMMJJ']]
+    return (f"{day[:4]}-{day[4:6]}-{day[6:8]}", tm, tx, tn,
+            get('UM'), get('UX'), get('UN'),
+            pmerm, pressure_high, pmermin,
+            _round(fxy * KMH_PER_MS) if fxy is not None else None,
+            _round(fxi * KMH_PER_MS) if fxi is not None else None,
+            get('RR'))
+
+
+class StationWriter(threading.Thread):
+    """Writer thread upserting the batches of rows of one station."""
+
+    def __init__(self, name, db_config, batch_size=DEFAULT_CHUNK_SIZE, noexecute=False, queue_size=8):
+        super().__init__(name=f"writer-{name}", daemon=True)
+        self.station = name
+        self.db_config = db_config
+        self.batch_size = batch_size
+        self.noexecute = noexecute
+        self.counts = {'written': 0, 'affected': 0}
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+
+    def put(self, rows):
+        """Queue a batch of rows, waiting while the writer is queue_size batches behind."""
+        self._queue.put(rows)
+
+    def finish(self):
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        from WC_DbPool import get_pool
+        from WC_DbWriter import check_fields, upsert_rows
+
+        try:
+            pool = get_pool(self.db_config['host'], self.db_config['username'],
+                            self.db_config['password'], self.db_config['database'])
+            table = self.db_config['tabledwc']
+            with pool.connection() as connection:
+                check_fields(MF_COLUMNS, pool.table_columns(table, connection))
+                while True:
+                    rows = self._queue.get()
+                    if rows is None:
+                        return
+                    for key, count in upsert_rows(connection, table, 'WC_Date', MF_COLUMNS, rows,
+                                                  chunk_size=self.batch_size, noexecute=self.noexecute).items():
+                        self.counts[key] += count
+        except Exception as e:
+            print(f"Station {self.station} failed: {e!r}")
+            self.error = e
+            # The reader goes on with the other stations: batches of this one are dropped
+            while self._queue.get() is not None:
+                pass
+
+
+def _stream_rows(path, stations, start_year, end_year, encoding):
+    # (NOM_USUEL, row) of a file read as a text stream (gzipped or stdin)
+    with open_mf_file(path, encoding) as lines:
+        for index, fields in mf_rows(lines, stations, start_year, end_year):
+            yield fields[index['NOM_USUEL']], DayWeatherConditionsRow(index, fields)
+
+
+def mf_chunks(mapped, chunk_bytes=CHUNK_BYTES):
+    """Header line and (start, end) byte ranges of the data of a mapped file, aligned to line ends."""
+    data = mapped.find(b'\n') + 1
+    header = mapped[:data]
+    ranges = []
+    start = data
+    while start < len(mapped):
+        end = mapped.find(b'\n', min(start + chunk_bytes, len(mapped)) - 1)
+        end = len(mapped) if end < 0 else end + 1
+        ranges.append((start, end))
+        start = end
+    return header, ranges
+
+
+def _parse_chunk(path, start, end, positions, stations, start_year, end_year, encoding):
+    """Projected rows of a byte range of the file, as {NOM_USUEL: rows in date order}.
+
+    Run in a worker process: the file is mapped again there and the lines of
+    the range are split only up to the last field used.
+    """
+    name, day = positions['NOM_USUEL'], positions['AAAAMMJJ']
+    projection = [positions[field] for field in MF_FIELDS]
+    last = max(projection)
+    selected = {station.encode(encoding): station for station in stations}
+    first, final = str(start_year).encode(), str(end_year).encode()
+    rows = {}
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for line in mapped[start:end].split(b'\n'):
+            parts = line.split(b';', name + 1)
+            if len(parts) <= name or parts[name] not in selected:
+                continue
+            parts = line.rstrip(b'\r').split(b';', last + 1)
+            if not first <= parts[day][:4] <= final:
+                continue
+            fields = [parts[position].decode(encoding) for position in projection]
+            rows.setdefault(selected[parts[name]], []).append(DayWeatherConditionsRow(PROJECTED_INDEX, fields))
+    for station_rows in rows.values():
+        station_rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def _parallel_rows(path, stations, start_year, end_year, encoding, workers):
+    # (NOM_USUEL, row) of an uncompressed file parsed by chunks in a process pool. The rows of each
+    # chunk are yielded as soon as it is parsed, merged by date across the stations, so that the
+    # writers of all the stations start while the rest of the file is parsed
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header, ranges = mf_chunks(mapped)
+    positions = mf_header(header.decode(encoding))
+
+    # Workers are started from a fork server: the writer threads are already running
+    context = multiprocessing.get_context('forkserver') if 'forkserver' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(_parse_chunk, path, start, end, positions, list(stations),
+                                   start_year, end_year, encoding) for start, end in ranges]
+        for future in as_completed(futures):
+            parsed = future.result()
+            yield from heapq.merge(*([(station, row) for row in rows] for station, rows in parsed.items()),
+                                   key=lambda entry: entry[1][0])
+
+
+def _is_mappable(path):
+    # Uncompressed regular file
+    if path == '-' or not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, 'rb') as file:
+        return file.read(2) != b'\x1f\x8b'
+
+
+def LoadMFFile(path, targets, start_year, end_year, batch_size=DEFAULT_CHUNK_SIZE,
+               encoding='utf-8', noexecute=False, workers=None):
+    """Upsert the days of the stations into their DayWeatherConditions tables, in one read of the file.
+
+    An uncompressed file is memory-mapped and parsed by chunks in workers
+    processes (default one per CPU, 1 to read it as a stream); gzipped files
+    and stdin are read as a stream.
+
+    :param targets: {NOM_USUEL: db_config} of the stations to load.
+    :return: {NOM_USUEL: StationWriter}, with the counts and error of each station.
+    """
+    writers = {name: StationWriter(name, db_config, batch_size, noexecute) for name, db_config in targets.items()}
+    for writer in writers.values():
+        writer.start()
+    pending = {name: [] for name in targets}
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and _is_mappable(path):
+        station_rows = _parallel_rows(path, targets, start_year, end_year, encoding, workers)
+    else:
+        station_rows = _stream_rows(path, targets, start_year, end_year, encoding)
+
+    try:
+        for station, row in station_rows:
+            rows = pending[station]
+            rows.append(row)
+            if len(rows) == batch_size:
+                writers[station].put(rows)
+                pending[station] = []
+    finally:
+        for name, writer in writers.items():
+            if pending[name]:
+                writer.put(pending[name])
+            writer.finish()
+
+    return writers
+
+
+# ------------------------------------------------------------------------------
+# Arguments management
+# ------------------------------------------------------------------------------
+def getArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='''\
+            Load the Météo-France daily data of a station (NOM_USUEL)
+            into the MYSQL DB DayWeatherConditions table.
+            --------------------------------------------------------
+            Files of "Données climatologiques de base - quotidiennes"
+            from meteo.data.gouv.fr, plain or gzipped.
+        ''',
+        epilog='''--------------------------------------------------------------'''
+    )
+
+    parser.add_argument('-i', '--infile', required=True,
+                        help="Météo-France csv file (.csv or .csv.gz), '-' for stdin")
+    parser.add_argument('-m', '--map', dest='mappings', action='append', default=[], metavar='NOM_USUEL=KEY',
+                        help='Météo-France station name and key of its destination station in the configuration file, '
+                             'ex: PARIS-MONTSOURIS=db3 (repeatable)')
+    parser.add_argument('-n', '--name',
+                        help='Météo-France station name (NOM_USUEL), with -s, for a single station')
+    parser.add_argument('-y', '--startyear', type=int, required=True, help='First year loaded')
+    parser.add_argument('-e', '--endyear', type=int, required=True, help='Last year loaded')
+
+    # Chemin vers le fichier JSON de configuration et station de destination
+    parser.add_argument('-c', '--config', dest='config_path', required=True,
+                        help='Path to the JSON configuration file')
+    parser.add_argument('-s', '--station',
+                        help='Key of the destination station in the configuration file, with -n')
+
+    parser.add_argument('--encoding', default='utf-8', help='Encoding of the csv file (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes parsing an uncompressed file (default one per CPU, 1 to read it as a stream)')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Number of days sent per INSERT ... ON DUPLICATE KEY UPDATE statement (default {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--noexecute', action='store_true',
+                        help="If set, no SQL command will be executed, only printed for debugging.")
+    parser.add_argument('--version', action='version', version='[%(prog)20s] 2.0')
+
+    return parser.parse_args(argv)
+
+
+# ------------------------------------------------------------------------------
+# Main script
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = getArgs()
+
+    from WC_StationConfig import load_station_configs, select_stations
+
+    # NOM_USUEL -> station key of the configuration file
+    mappings = dict(mapping.split('=', 1) for mapping in args.mappings)
+    if args.name or args.station:
+        if not (args.name and args.station):
+            sys.exit("-n and -s go together")
+        mappings[args.name] = args.station
+    if not mappings:
+        sys.exit("No station to load: give -m NOM_USUEL=KEY or -n NOM_USUEL -s KEY")
+    configs = select_stations(load_station_configs(args.config_path), list(dict.fromkeys(mappings.values())))
+    targets = {name: configs[key] for name, key in mappings.items()}
+
+    print(f"Loading {', '.join(targets)} {args.startyear}-{args.endyear} from {args.infile}...")
+    started = time.monotonic()
+    writers = LoadMFFile(args.infile, targets, args.startyear, args.endyear,
+                         batch_size=args.batch_size, encoding=args.encoding, noexecute=args.noexecute,
+                         workers=args.workers)
+    print(f"Done in {time.monotonic() - started:.1f}s")
+    for name, writer in writers.items():
+        counts = writer.counts
+        print(f"{name} -> {targets[name]['tabledwc']}: "
+              + (f"FAILED ({writer.error!r})" if writer.error else
+                 f"{counts['written']} day(s) written, {counts['affected']} affected row(s)"))
+    if any(writer.error for writer in writers.values()):
+        sys.exit(1)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
+import codecs
 import csv
 import pandas as pd
+from fractions import Fraction
 from dateutil.parser import *
 import datetime
 
@@ -18,6 +20,49 @@ import argparse
 inputfile = ''
 outputfile = ''
 
+# ------------------------------------------------------------------------------
+# In French
+#Non., temps, température ambiante, humidité intérieure, température extérieure,
+#humidité extérieure, moyenne du vent, rafales de vent, Point de rosée,
+#refroidissement éolien, direction du vent, pression absolue, pression relative,
+#intensité de précipitation, pluies journalières, pluies semaine ,
+#pluies mensuelles, pluies année, solaire, indice de chaleur, UVI
+# ------------------------------------------------------------------------------
+# In English
+#"No."   "Time"  "Indoor Temperature (°C)"       "Indoor Humidity (%)"   "Outdoor Temperature (°C)"
+# "Outdoor Humidity (%)"  "Wind (km/h)"   "Gust (km/h)"   "Dew Point (°C)"
+#"Wind Chill (°C)"       "Wind Direction (°)"    "ABS Barometer (hpa)"   "REL Barometer (hpa)"
+#"Rain Rate (mm/h)"      "Daily Rain (mm)"       "Weekly Rain (mm)"
+#"Monthly Rain (mm)"     "Yearly Rain (mm)"      "Solar Rad. (w/㎡)"     "Heat index (°C)"       "UV (uW/c㎡)"   "UVI"
+#
+#No.	Time	Indoor temperature	Indoor humidity	Outdoor temperature	Outdoor humidity	Average speed	Gust speed	Dewpoint	Wind chill	Wind direction	Absolute Pressure	Relative pressure	Rainfall intensity	Daily rainfall	Weekly rainfallMonthly rainfall	Yearly rainfall	Solar	Heat Index	UVI
+#1	2019-09-01 00:00	25.9	48	19.5	71	0.0	0.0	14.1	19.5	158	1006.5	1012.9	0.0	0.0	0.0	0.0	408.9	0.0	--	0
+#2	2019-09-01 00:04	25.9	48	19.5	71	0.0	0.0	14.1	19.5	159	1006.6	1013.0	0.0	0.0	0.0	0.0	408.9	0.0	--	0
+# ------------------------------------------------------------------------------
+
+
+# Weather Date list
+# Field names are:No., Time, Indoor temperature, Indoor humidity, Outdoor temperature,
+# Outdoor humidity, Average speed, Gust speed, Dewpoint, Wind chill, Wind direction,
+# Absolute Pressure, Relative pressure, Rainfall intensity, Daily rainfall, Weekly rainfall,
+# Monthly rainfall, Yearly rainfall, Solar, Heat Index, UVI,
+colnames = ['No','Time','IndoorTemperature','IndoorHumidity','OutdoorTemperature','OutdoorHumidity','Wind','Gust','DewPoint','WindChill','WindDirection','ABSBarometer','RELBarometer','RainRate','DailyRain','WeeklyRain','MonthlyRain','YearlyRain',	'Solar, Rad','Heatindex','UV','UVI']
+
+# Values meaning "no measure" in the export
+MISSING_MARKERS = ['--.-', '--']
+
+# Columns of the daily statistics, read as numbers
+STAT_COLUMNS = ['OutdoorTemperature','OutdoorHumidity','Wind','DewPoint','RELBarometer','DailyRain']
+
+# Format of the Time column, other layouts are parsed one by one
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+NAN = float('nan')
+
+# Number of samples read at once (~35 days of 5-minute samples)
+CHUNK_SIZE = 10000
+
+
 # ------------------------------------------------------------------------------
 # Arguments management
 # ------------------------------------------------------------------------------
@@ -44,6 +89,20 @@ def getArgs(argv=None):
         default=sys.stdin, help="csv file pathname to tranform")
     parser.add_argument('--outfile', "-o", nargs='?', type=argparse.FileType('w'),
         default=sys.stdout, help="transformed csv file pathname")
+    parser.add_argument('--stream', action='store_true',
+        help="streaming mode: constant memory, each day written as soon as it is complete")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE,
+        help="number of samples read at once (default %(default)s)")
+    parser.add_argument('--db', action='store_true',
+        help="load the daily statistics into the DayWeatherConditions table instead of writing a csv file")
+    parser.add_argument('-c', '--config', dest='config_path',
+        help="JSON configuration file of the stations (with --db)")
+    parser.add_argument('-s', '--station', dest='station',
+        help="key of the station in the configuration file (with --db)")
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=500,
+        help="number of days written per statement with --db (default %(default)s)")
+    parser.add_argument('--noexecute', action='store_true',
+        help="with --db, only print the SQL statements")
     parser.add_argument('--version', action='version', version='[%(prog)20s] 2.0')
 
     return parser.parse_args(argv)
@@ -64,60 +123,285 @@ def DateDDMMYY(Date):
     return(NewDate)
 
 # ------------------------------------------------------------------------------
-# initializing the titles and rows list
+# Days DD/MM/YYYY of a Time column: one vectorized parse with the export format,
+# dateutil only for the few irregular "<time> <date>" samples
 # ------------------------------------------------------------------------------
-def DayStat(Data):
-
-    DataList=[]
-
-    # Statistic of the day's outdoor temperatures
-    DayMaxOutdoorTemp=max(Data.get('OutdoorTemperature'))
-    DayMinOutdoorTemp=min(Data.get('OutdoorTemperature'))
-    DayAvgOutdoorTemp=round(Average(Data.get('OutdoorTemperature')),1)
+def DaysDDMMYY(Times):
 
-    # Statistic of the day Dewpoint
-    DayMaxOutdoorHum=max(Data['OutdoorHumidity'])
-    DayMinOutdoorHum=min(Data['OutdoorHumidity'])
-    DayAvgOutdoorHum=round(Average(Data['OutdoorHumidity']),1)
+    Dates = pd.to_datetime(Times, format=TIME_FORMAT, errors='coerce')
+    Days = Dates.dt.strftime("%d/%m/%Y")
+    Irregular = Dates.isna()
+    if Irregular.any():
+        Days[Irregular] = [DateDDMMYY(Time) for Time in Times[Irregular]]
 
-    # Statistic of the day Dewpoint
-    DayMaxDewPoint=max(Data['DewPoint'])
-    DayMinDewPoint=min(Data['DewPoint'])
-    DayAvgDewPoint=round(Average(Data['DewPoint']),1)
+    return Days
 
-    # Statistic of the day's Pressure
-    DayMaxPressure=max(Data.get('Pressure'))
-    DayMinPressure=min(Data.get('Pressure'))
+# ------------------------------------------------------------------------------
+# Statistics of every day of a chunk of samples, with a single groupby
+# ------------------------------------------------------------------------------
+def Average1(Values):
+    # statistics.mean keeps the exact (correctly rounded) average of the row by row version
+    return round(Average(Values.dropna().tolist()),1)
+
+def DailyStats(Data, Days):
+
+    # Consecutive samples of the same day form a group, as in the row by row version
+    Run = (Days != Days.shift()).cumsum()
+
+    Gust = Data['Gust'].where(~Data['Gust'].isin(MISSING_MARKERS))
+    Data = Data.assign(Day=Days, Run=Run, Gust=Gust, GustValue=pd.to_numeric(Gust, errors='coerce'))
+
+    return Data.groupby('Run', sort=False).agg(
+        Day=('Day', 'first'),
+        DayMaxOutdoorTemp=('OutdoorTemperature', 'max'),
+        DayAvgOutdoorTemp=('OutdoorTemperature', Average1),
+        DayMinOutdoorTemp=('OutdoorTemperature', 'min'),
+        DayMaxOutdoorHum=('OutdoorHumidity', 'max'),
+        DayAvgOutdoorHum=('OutdoorHumidity', Average1),
+        DayMinOutdoorHum=('OutdoorHumidity', 'min'),
+        DayMaxDewPoint=('DewPoint', 'max'),
+        DayAvgDewPoint=('DewPoint', Average1),
+        DayMinDewPoint=('DewPoint', 'min'),
+        DayMaxPressure=('RELBarometer', 'max'),
+        DayMinPressure=('RELBarometer', 'min'),
+        DayMaxWindSpeed=('Wind', 'max'),
+        DayAvgWindSpeed=('Wind', Average1),
+        DayMaxGustSpeed=('GustValue', 'max'),
+        DayMaxGustText=('Gust', lambda Values: max(Values.dropna().tolist())),
+        DayMaxDailyRain=('DailyRain', 'max'),
+    )
 
-    # Statistic of the day's WindSpeed
-    DayMaxWindSpeed=max(Data.get('Wind'))
-    DayAvgWindSpeed=round(Average(Data.get('Wind')),1)
+# ------------------------------------------------------------------------------
+# Read the export by chunks and return the list of daily statistics
+# ------------------------------------------------------------------------------
+def TransformFile(inputfile, chunksize=CHUNK_SIZE):
+
+    DailyRows = []
+    GustKind = 'int'        # Type pandas would infer for the whole Gust column: int, float or str
+    Pending = None          # Samples of the last day of a chunk, completed by the next chunk
+
+    # Missing markers are NaN from the start, except for Gust kept as text (see GustKind)
+    # Only the used columns are read (colnames has one name more than the export columns)
+    Columns = sorted(['Time'] + STAT_COLUMNS + ['Gust'], key=colnames.index)
+    Reader = pd.read_csv(inputfile, names=Columns, encoding='utf-16', sep='\t', skiprows=1,
+                         usecols=[colnames.index(column) for column in Columns], dtype={'Gust': str},
+                         na_values={column: MISSING_MARKERS for column in STAT_COLUMNS},
+                         chunksize=chunksize)
+
+    for Chunk in Reader:
+        Gusts = Chunk['Gust']
+        if Gusts.isin(MISSING_MARKERS).any():
+            GustKind = 'str'
+        elif GustKind != 'str' and (Gusts.isna().any() or not Gusts.dropna().str.fullmatch(r'[+-]?\d+').all()):
+            GustKind = 'float'
+
+        if Pending is not None:
+            Chunk = pd.concat([Pending, Chunk], ignore_index=True)
+        Days = DaysDDMMYY(Chunk['Time'])
+
+        # The last day may go on in the next chunk
+        Last = (Days == Days.iloc[-1])[::-1].cummin()[::-1]
+        Pending = Chunk[Last]
+        if (~Last).any():
+            DailyRows.append(DailyStats(Chunk[~Last], Days[~Last]))
+
+    # Last Day
+    if Pending is not None and len(Pending):
+        DailyRows.append(DailyStats(Pending, DaysDDMMYY(Pending['Time'])))
+
+    Stats = pd.concat(DailyRows, ignore_index=True) if DailyRows else None
+    return Stats, GustKind
 
-    # Statistic of the day's GustSpeed
-    DayMaxGustSpeed=max(Data.get('Gust'))
+# ------------------------------------------------------------------------------
+# Row of a day, in the order of the output file
+# ------------------------------------------------------------------------------
+def DayStat(Day, GustKind):
+
+    DataList=[Day.Day]
+    for Field in ['DayMaxOutdoorTemp', 'DayAvgOutdoorTemp', 'DayMinOutdoorTemp',
+                  'DayMaxOutdoorHum', 'DayAvgOutdoorHum', 'DayMinOutdoorHum',
+                  'DayMaxDewPoint', 'DayAvgDewPoint', 'DayMinDewPoint',
+                  'DayMaxPressure', 'DayMinPressure', 'DayMaxWindSpeed', 'DayAvgWindSpeed']:
+        DataList.append(float(getattr(Day, Field)))
+
+    # Gust values are compared as pandas typed the whole column: as text when it has missing markers
+    if GustKind == 'str':
+        DataList.append(Day.DayMaxGustText)
+    elif GustKind == 'int':
+        DataList.append(int(Day.DayMaxGustSpeed))
+    else:
+        DataList.append(float(Day.DayMaxGustSpeed))
 
     # Statistic of the day's Precipitations in CM/M²
-    DayMaxPrecipitationCum=round(max(Data.get('DailyRain'))/10,2)
-
-    DataList.append(Data['Time'][0])
-    DataList.append(DayMaxOutdoorTemp)
-    DataList.append(DayAvgOutdoorTemp)
-    DataList.append(DayMinOutdoorTemp)
-    DataList.append(DayMaxOutdoorHum)
-    DataList.append(DayAvgOutdoorHum)
-    DataList.append(DayMinOutdoorHum)
-    DataList.append(DayMaxDewPoint)
-    DataList.append(DayAvgDewPoint)
-    DataList.append(DayMinDewPoint)
-    DataList.append(DayMaxPressure)
-    DataList.append(DayMinPressure)
-    DataList.append(DayMaxWindSpeed)
-    DataList.append(DayAvgWindSpeed)
-    DataList.append(DayMaxGustSpeed)
-    DataList.append(DayMaxPrecipitationCum)
+    DataList.append(round(float(Day.DayMaxDailyRain)/10,2))
 
     return DataList
 
+# ------------------------------------------------------------------------------
+# Streaming mode: running statistics of the current day only, in constant memory
+# ------------------------------------------------------------------------------
+class DayAccumulator:
+
+    # Columns with maximum, minimum and average
+    AVERAGED = ['OutdoorTemperature', 'OutdoorHumidity', 'DewPoint', 'Wind']
+
+    def __init__(self, Day):
+        self.Day = Day
+        self.Max = {}
+        self.Min = {}
+        # Exact sums, so that the average is the one of statistics.mean
+        self.Sum = {Column: Fraction(0) for Column in self.AVERAGED}
+        self.Count = {Column: 0 for Column in self.AVERAGED}
+        self.GustText = None
+
+    def add(self, Column, Value):
+        if Column not in self.Max or Value > self.Max[Column]:
+            self.Max[Column] = Value
+        if Column not in self.Min or Value < self.Min[Column]:
+            self.Min[Column] = Value
+        if Column in self.Sum:
+            self.Sum[Column] += Fraction(Value)
+            self.Count[Column] += 1
+
+    def Average(self, Column):
+        return round(float(self.Sum[Column] / self.Count[Column]),1) if self.Count[Column] else NAN
+
+    def DayStat(self):
+        Max = lambda Column: self.Max.get(Column, NAN)
+        Min = lambda Column: self.Min.get(Column, NAN)
+        return [self.Day,
+                Max('OutdoorTemperature'), self.Average('OutdoorTemperature'), Min('OutdoorTemperature'),
+                Max('OutdoorHumidity'), self.Average('OutdoorHumidity'), Min('OutdoorHumidity'),
+                Max('DewPoint'), self.Average('DewPoint'), Min('DewPoint'),
+                Max('RELBarometer'), Min('RELBarometer'),
+                Max('Wind'), self.Average('Wind'),
+                # Integer gusts are kept as integers, as pandas types such a column
+                self.GustText if self.GustText is not None else NAN,
+                round(Max('DailyRain')/10,2)]
+
+def StreamDays(binary_input, blocksize=65536):
+
+    # UTF-16 decoded block by block, the BOM giving the byte order
+    Decoder = codecs.getincrementaldecoder('utf-16')()
+    Positions = {Column: colnames.index(Column) for Column in ['Time', 'Gust'] + STAT_COLUMNS}
+    Current = None
+    Header = True
+    Pending = ''
+
+    def Lines():
+        nonlocal Pending
+        while True:
+            Block = binary_input.read(blocksize)
+            Text = Pending + Decoder.decode(Block, final=not Block)
+            Lines = Text.split('\n')
+            Pending = Lines.pop()
+            yield from Lines
+            if not Block:
+                if Pending:
+                    yield Pending
+                return
+
+    for Line in Lines():
+        Line = Line.rstrip('\r')
+        if Header:
+            # First line holds the column titles
+            Header = False
+            continue
+        if not Line:
+            continue
+        Fields = Line.split('\t')
+
+        # Fast path for "YYYY-MM-DD HH:MM", dateutil for the other layouts
+        Time = Fields[Positions['Time']]
+        if len(Time) >= 10 and Time[4] == '-' and Time[7] == '-':
+            Day = f"{Time[8:10]}/{Time[5:7]}/{Time[0:4]}"
+        else:
+            Day = DateDDMMYY(Time)
+
+        if Current is None or Day != Current.Day:
+            if Current is not None:
+                # The day is over: handed over at once
+                yield Current.DayStat()
+            Current = DayAccumulator(Day)
+
+        for Column in STAT_COLUMNS:
+            Value = Fields[Positions[Column]] if Positions[Column] < len(Fields) else ''
+            if Value and Value not in MISSING_MARKERS:
+                Current.add(Column, float(Value))
+        Gust = Fields[Positions['Gust']]
+        if Gust and Gust not in MISSING_MARKERS:
+            Value = float(Gust)
+            if 'Gust' not in Current.Max or Value > Current.Max['Gust']:
+                Current.Max['Gust'] = Value
+                Current.GustText = int(Gust) if Gust.lstrip('+-').isdigit() else Value
+
+    # Last Day
+    if Current is not None:
+        yield Current.DayStat()
+
+# ------------------------------------------------------------------------------
+# Direct load of the daily statistics into DayWeatherConditions
+# ------------------------------------------------------------------------------
+# DayWeatherConditions column of each DayStat value (DayAvgWindSpeed has none), and its rounding
+DB_COLUMNS = [('WC_Date', None), ('WC_TempHigh', None), ('WC_TempAvg', 1), ('WC_TempLow', None),
+              ('WC_HumidityHigh', None), ('WC_HumidityAvg', 0), ('WC_HumidityLow', None),
+              ('WC_DewPointHigh', None), ('WC_DewPointAvg', 1), ('WC_DewPointLow', None),
+              ('WC_PressureHigh', 1), ('WC_PressureLow', 1),
+              ('WC_WindSpeedMax', None), (None, None),
+              ('WC_GustSpeedMax', None), ('WC_PrecipitationSum', 1)]
+
+def DayWeatherConditionsRow(DataList):
+
+    Row = []
+    for (Column, Digits), Value in zip(DB_COLUMNS, DataList):
+        if Column is None:
+            continue
+        if Column == 'WC_Date':
+            # DD/MM/YYYY -> YYYY-MM-DD
+            Value = datetime.datetime.strptime(Value, "%d/%m/%Y").strftime("%Y-%m-%d")
+        else:
+            Value = float(Value)
+            if Column == 'WC_PrecipitationSum':
+                # The csv gives centimeters, the table millimeters as the WU collector
+                Value = Value * 10
+            if Value != Value:
+                # NaN: no measure of the day
+                Value = None
+            elif Digits is not None:
+                Value = round(Value, Digits)
+        Row.append(Value)
+
+    return tuple(Row)
+
+def LoadDB(Days, db_config, batch_size, noexecute=False):
+
+    # Database modules only needed by this output
+    from WC_DbPool import get_pool
+    from WC_DbWriter import check_fields, upsert_rows
+
+    Columns = [Column for Column, Digits in DB_COLUMNS if Column is not None]
+    pool = get_pool(db_config['host'], db_config['username'], db_config['password'], db_config['database'])
+    table = db_config['tabledwc']
+    counts = {'written': 0, 'affected': 0}
+
+    with pool.connection() as connection:
+        check_fields(Columns, pool.table_columns(table, connection))
+
+        # Existing days keep WC_SolarRadiationAvg and WC_PressureAvg, the export has none
+        Rows = []
+        for DataList in Days:
+            Rows.append(DayWeatherConditionsRow(DataList))
+            if len(Rows) == batch_size:
+                for key, count in upsert_rows(connection, table, 'WC_Date', Columns, Rows,
+                                              chunk_size=batch_size, noexecute=noexecute).items():
+                    counts[key] += count
+                Rows = []
+        for key, count in upsert_rows(connection, table, 'WC_Date', Columns, Rows,
+                                      chunk_size=batch_size, noexecute=noexecute).items():
+            counts[key] += count
+
+    return counts
+
 # ------------------------------------------------------------------------------
 # initializing the titles and rows list
 # ------------------------------------------------------------------------------
@@ -136,11 +420,8 @@ def ConvertList(list):
 
 
 # ------------------------------------------------------------------------------
-# initializing the titles and rows list
+# Main script
 # ------------------------------------------------------------------------------
-fields = []
-rows = []
-
 if __name__ == "__main__":
 
     argvals = None             # init argv in case not testing
@@ -150,148 +431,54 @@ if __name__ == "__main__":
 
     args = getArgs(argvals)
 
-    #answer = args.x**args.y
-
-    # if args.quiet:
-    #    print (answer)
-    # elif args.verbose:
-    #    print ("{} to the power {} equals {}".format(args.x, args.y, answer))
-    # else:
-    #    print ("{}^{} == {}".format(args.x, args.y, answer))
-
-
-print ('Input file is ', args.infile.name)
-print ('Output file is ', args.outfile.name)
-
-
-inputfile=args.infile.name
-outputfile=args.outfile.name
-
-if inputfile == '<stdin>':
-    inputfile=sys.stdin
-
-# ------------------------------------------------------------------------------
-# In French
-#Non., temps, température ambiante, humidité intérieure, température extérieure,
-#humidité extérieure, moyenne du vent, rafales de vent, Point de rosée,
-#refroidissement éolien, direction du vent, pression absolue, pression relative,
-#intensité de précipitation, pluies journalières, pluies semaine ,
-#pluies mensuelles, pluies année, solaire, indice de chaleur, UVI
-# ------------------------------------------------------------------------------
-# In English
-#"No."   "Time"  "Indoor Temperature (°C)"       "Indoor Humidity (%)"   "Outdoor Temperature (°C)"
-# "Outdoor Humidity (%)"  "Wind (km/h)"   "Gust (km/h)"   "Dew Point (°C)"
-#"Wind Chill (°C)"       "Wind Direction (°)"    "ABS Barometer (hpa)"   "REL Barometer (hpa)"
-#"Rain Rate (mm/h)"      "Daily Rain (mm)"       "Weekly Rain (mm)"
-#"Monthly Rain (mm)"     "Yearly Rain (mm)"      "Solar Rad. (w/㎡)"     "Heat index (°C)"       "UV (uW/c㎡)"   "UVI"
-#
-#No.	Time	Indoor temperature	Indoor humidity	Outdoor temperature	Outdoor humidity	Average speed	Gust speed	Dewpoint	Wind chill	Wind direction	Absolute Pressure	Relative pressure	Rainfall intensity	Daily rainfall	Weekly rainfallMonthly rainfall	Yearly rainfall	Solar	Heat Index	UVI
-#1	2019-09-01 00:00	25.9	48	19.5	71	0.0	0.0	14.1	19.5	158	1006.5	1012.9	0.0	0.0	0.0	0.0	408.9	0.0	--	0
-#2	2019-09-01 00:04	25.9	48	19.5	71	0.0	0.0	14.1	19.5	159	1006.6	1013.0	0.0	0.0	0.0	0.0	408.9	0.0	--	0
-# ------------------------------------------------------------------------------
-
-
-# initializing the titles and rows list
-i=0
-IndexDay=0
-
-WeatherDataDay =    { 'Time' : [],
-                      'OutdoorTemperature' : [],
-                      'OutdoorHumidity' : [],
-                      'Wind' : [],
-                      'Gust' : [],
-                      'DewPoint' : [],
-                      'Pressure' : [],
-                      'DailyRain' : []
-                    }
-
-
-# Weather Date list
-# Field names are:No., Time, Indoor temperature, Indoor humidity, Outdoor temperature,
-# Outdoor humidity, Average speed, Gust speed, Dewpoint, Wind chill, Wind direction,
-# Absolute Pressure, Relative pressure, Rainfall intensity, Daily rainfall, Weekly rainfall,
-# Monthly rainfall, Yearly rainfall, Solar, Heat Index, UVI,
-colnames = ['No','Time','IndoorTemperature','IndoorHumidity','OutdoorTemperature','OutdoorHumidity','Wind','Gust','DewPoint','WindChill','WindDirection','ABSBarometer','RELBarometer','RainRate','DailyRain','WeeklyRain','MonthlyRain','YearlyRain',	'Solar, Rad','Heatindex','UV','UVI']
-
-# Read Transformed Meteo csv file
-# from Ambient weather software export the meteo csv file is exported through
-# the History menu for a given period
-data = pd.read_csv(inputfile, names=colnames, encoding='utf-16',sep='\t',skiprows=1)
-
-print("--------------------------------")
-print (data.Time)
-
-
-
-# open a file for writing
-if outputfile != '<stdout>':
-    weather_data = open(outputfile, 'w')
-else:
-    weather_data = sys.stdout
-
-csvwriter = csv.writer(weather_data)
-
-# Create lists, one per type of weather data
-Dates = data.Time.tolist()
-OutdoorTemps = data.OutdoorTemperature.tolist()
-OutdoorHums = data.OutdoorHumidity.tolist()
-Winds = data.Wind.tolist()
-Gusts = data.Gust.tolist()
-DewPoints = data.DewPoint.tolist()
-RELBarometers = data.RELBarometer.tolist()
-DailyRains = data.DailyRain.tolist()
-
-# At start the "Previous Date "
-PreviousDate=DateDDMMYY(Dates[0])
-
-for DateTime in Dates:
-
-    # List of Daily stats initialized to empty
-    ListOfDailyStat=[]
-
-    # Validate dates Time and correct some fields with "<time> <date>" to "<date> <time>"
-    DayDate=DateDDMMYY(DateTime)
-
-    if DayDate != PreviousDate :
-        #print  (WeatherDataDay)
-        ListOfDailyStat=DayStat(WeatherDataDay)
-
-        row=ConvertList(ListOfDailyStat)
-        weather_data.write("%s\n" % row)
-
-        WeatherDataDay['Time'].clear()
-        WeatherDataDay['OutdoorTemperature'].clear()
-        WeatherDataDay['OutdoorHumidity'].clear()
-        WeatherDataDay['Wind'].clear()
-        WeatherDataDay['Gust'].clear()
-        WeatherDataDay['DewPoint'].clear()
-        WeatherDataDay['Pressure'].clear()
-        WeatherDataDay['DailyRain'].clear()
-
-    WeatherDataDay['Time'].append(DayDate)
-    if OutdoorTemps[i] != "--.-" and OutdoorTemps[i] != "--":
-        WeatherDataDay['OutdoorTemperature'].append(float(OutdoorTemps[i]))
-    if OutdoorHums[i] != "--.-" and OutdoorHums[i] != "--":
-        WeatherDataDay['OutdoorHumidity'].append(float(OutdoorHums[i]))
-    if Winds[i] != "--.-" and Winds[i] != "--":
-        WeatherDataDay['Wind'].append(float(Winds[i]))
-    if Gusts[i] != "--.-" and Gusts[i] != "--":
-        WeatherDataDay['Gust'].append(Gusts[i])
-    if DewPoints[i] != "--.-" and DewPoints[i] != "--":
-        WeatherDataDay['DewPoint'].append(float(DewPoints[i]))
-    if RELBarometers[i] != "--.-" and RELBarometers[i] != "--":
-                WeatherDataDay['Pressure'].append(float(RELBarometers[i]))
-    if DailyRains[i] != "--.-" and DailyRains[i] != "--":
-        WeatherDataDay['DailyRain'].append(DailyRains[i])
-
-    PreviousDate = DayDate
-
-    # Increment Loop index
-    i+=1
-
-# Last Day
-ListOfDailyStat=DayStat(WeatherDataDay)
-row=ConvertList(ListOfDailyStat)
-weather_data.write("%s\n" % row)
-
-weather_data.close()
+    if args.db and not (args.config_path and args.station):
+        print ('--db needs the configuration file (-c) and the station key (-s)', file=sys.stderr)
+        sys.exit(2)
+
+    # Messages go to stderr when the transformed file is written to stdout
+    log = sys.stderr if args.outfile.name == '<stdout>' and args.stream and not args.db else sys.stdout
+    print ('Input file is ', args.infile.name, file=log)
+    if not args.db:
+        print ('Output file is ', args.outfile.name, file=log)
+
+    inputfile=args.infile.name
+    outputfile=args.outfile.name
+
+    if args.stream:
+        # Bytes are read as they come: the UTF-16 decoding is done by StreamDays
+        binary_input = sys.stdin.buffer if inputfile == '<stdin>' else open(inputfile, 'rb')
+        Days = StreamDays(binary_input)
+    else:
+        if inputfile == '<stdin>':
+            inputfile=sys.stdin
+
+        # Read Transformed Meteo csv file
+        # from Ambient weather software export the meteo csv file is exported through
+        # the History menu for a given period
+        Stats, GustKind = TransformFile(inputfile, args.chunksize)
+        if args.db:
+            # The text maximum only keeps the csv output identical: the table gets the numeric one
+            GustKind = 'float'
+        Days = (DayStat(Day, GustKind) for Day in Stats.itertuples(index=False)) if Stats is not None else []
+
+    if args.db:
+        # No text round-trip: the rows go straight to the station database
+        from WC_StationConfig import load_station_configs, select_stations
+        db_config = select_stations(load_station_configs(args.config_path), [args.station])[args.station]
+        counts = LoadDB(Days, db_config, args.batch_size, noexecute=args.noexecute)
+        print (f"{counts['written']} day(s) loaded into {db_config['tabledwc']}: {counts['affected']} affected row(s)")
+        sys.exit(0)
+
+    # open a file for writing
+    if outputfile != '<stdout>':
+        weather_data = open(outputfile, 'w')
+    else:
+        weather_data = sys.stdout
+
+    for Day in Days:
+        weather_data.write("%s\n" % ConvertList(Day))
+        if args.stream:
+            # Each day is available downstream as soon as it is complete
+            weather_data.flush()
+
+    weather_data.close()
@@ -1,17 +1,34 @@
 #!/usr/bin/env python3
 
 from __future__ import print_function
+import asyncio
 import json
+import signal
 import sys
+import time
 
 import urllib.request, urllib.error
 # https://pypi.org/project/easydict/ Access easily to Dictionnary values
 from easydict import EasyDict as edict
 
 import pymysql.cursors
-# from datetime import date, timedelta, datetime
+from WC_DailyAccumulator import DailyAccumulators, compare_conditions
+from WC_DbPool import close_pools, get_pool
+from WC_DbWriter import upsert_rows
+from WC_Spool import DEFAULT_SPOOL_FILE, ObservationSpool
+from WC_StationConfig import BETHUNE_KEY, VILLEBON_KEY, load_station_configs, run_stations, select_stations
+from WC_WuCache import DEFAULT_CACHE_DIR, ResponseCache
+from WC_WuClient import HttpSession, fetch_cached_json
+from datetime import datetime, timedelta
 import argparse
 
+# Lifetime in seconds of the cached current observations
+CURRENT_TTL = 60
+
+# Seconds before retrying a failed drain, doubled after each failure up to the maximum
+DRAIN_RETRY_MIN = 5
+DRAIN_RETRY_MAX = 300
+
 # Class WeatherConditions
 class WeatherConditions:
     """This class is describing the WeatherConditions in WeatherUnderground
@@ -49,18 +66,67 @@ class WeatherConditions:
         }
         """
  
-    def __init__(self, stationID, mysqlHost, mysqlDBname,user,dbpassword):
+    def __init__(self, stationID, mysqlHost, mysqlDBname,user,dbpassword,tablewc='WeatherConditions'):
         self.stationID = stationID
         self.mysqlHost = mysqlHost
         self.mysqlDBname = mysqlDBname
         self.user = user
         self.dbpassword = dbpassword
+        self.tablewc = tablewc
+        self.day = None             # DayWeatherConditions of the station, kept live when set
+        self.accumulators = None    # DailyAccumulators of the live DayWeatherConditions
+
+    @classmethod
+    def from_config(cls, config):
+        # Station entry of the dbConfigs JSON configuration file
+        wc = cls(config['weatherStation'], config['host'], config['database'],
+                 config['username'], config['password'], config.get('tablewc', 'WeatherConditions'))
+        if 'tabledwc' in config:
+            # Imported here: astral and pytz are only needed for the live daily aggregates
+            from MV_UpdateDailyStatDB import DayWeatherConditions
+            wc.day = DayWeatherConditions(config)
+        return wc
+
+    def SolarWindow(self, DateDash):
+        # Local sunrise and sunset of the day, as WC_Datetime strings
+        sunrise_local, sunset_local = self.day.GetSunriseSunset(DateDash)
+        return sunrise_local.strftime("%Y-%m-%d %H:%M:%S"), sunset_local.strftime("%Y-%m-%d %H:%M:%S")
+
+    def SpoolRows(self, spool, rows):
+        # Observations are spooled first, written to MySQL by the drainer
+        spool.append(self.stationID, rows)
+
+    def GetDayRows(self, DateDash):
+        # WeatherConditions rows already stored for the day, in time order, to seed its accumulator
+        pool = get_pool(self.mysqlHost, self.user, self.dbpassword, self.mysqlDBname)
+        next_day = (datetime.strptime(DateDash, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        with pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(f"""SELECT {', '.join(self.WC_COLUMNS)} FROM `{self.tablewc}`
+                                   WHERE WC_Datetime >= %s AND WC_Datetime < %s
+                                   ORDER BY WC_Datetime""", (DateDash, next_day))
+                return [tuple(row[column] for column in self.WC_COLUMNS) for row in cursor.fetchall()]
+
+    def WriteRows(self, rows):
+        # WeatherConditions rows, then the DayWeatherConditions of their days from the accumulators.
+        # Rows are accumulated once stored: a day seen for the first time is seeded with all its
+        # stored rows, so that the upsert never replaces a complete day with a partial one
+        self.InsertDBRows(self.user, self.dbpassword, rows)
+        if self.day is not None and self.accumulators is not None:
+            self.accumulators.add(self.stationID, self.WC_COLUMNS, rows, self.SolarWindow, seed=self.GetDayRows)
+            # Every day changed and not written yet, those of a previously failed upsert included
+            dirty = self.accumulators.dirty_days(self.stationID)
+            days = {}
+            for DateDash in dirty:
+                conditions = self.accumulators.day_conditions(self.stationID, DateDash)
+                if conditions is not None:
+                    days[DateDash] = conditions
+            self.day.UpsertDayWeatherConditions(days)
+            self.accumulators.clean(self.stationID, dirty)
 
-    def GetWeatherConditions(self):
+    def GetWeatherConditions(self, cache=None, ttl=CURRENT_TTL, session=None):
         # ----------------------------------------------------------------
         # Build URL to access to current daily observations of ILEDEFRA131
-        mystr_dict = {}
-        mystr = ""
 
         # Wunderground API Key Expires: Sun, 04 Dec 2022 15:00:52 GMT
         # https://www.wunderground.covgm/member/api-keyscd 
@@ -72,103 +138,45 @@ class WeatherConditions:
         FEATURE_URL = BASE_URL + f"?stationId={self.stationID}&format=json&units=m&numericPrecision=decimal&apiKey={key}"
 
         print (FEATURE_URL) 
-        # Execute the HTTPS request to get JSON Result
-        try:
-            fp = urllib.request.urlopen(FEATURE_URL)
-        except urllib.error.HTTPError as e:
-            # Return code error (e.g. 404, 501, ...)
-            # ...
-            print('HTTPError: {}'.format(e.code))
-        except urllib.error.URLError as e:
-            # Not an HTTP-specific error (e.g. connection refused)
-            # ...
-            print('URLError: {}'.format(e.reason))
-        else:
-            # 200
-            # ...
-            print('good')
-            mybytes = fp.read()
-            # -*- decoding: utf-8 -*-
-            mystr = mybytes.decode("utf8")
-            print ("[",mystr,"]",sep="")
-            fp.close()
-            if mystr:
-                # used edict ==> Very useful when exploiting parsed JSON content !
-                mystr_dict = edict(json.loads(mystr))
-            else:
-                mystr_dict = {}
-                print ("FALSE")
-        return(mystr_dict)
+        # Execute the HTTPS request to get JSON Result, served from the cache while still fresh
+        return fetch_cached_json(FEATURE_URL, cache=cache, key=(self.stationID, BASE_URL, 'current'), ttl=ttl, session=session)
    
     def ChckWeatherConditions(self):
         return 
 
-    def InsertDBWeatherCondtions(self,user,dbpassword,wc):
-        
-        # Connect to the database
-        connection = pymysql.connect(host=self.mysqlHost,
-                            user=user,
-                            password=dbpassword,
-                            db=self.mysqlDBname,
-                            charset='utf8mb4',
-                            cursorclass=pymysql.cursors.DictCursor,
-                            autocommit=True)
-        try:
-            with connection.cursor() as cursor:
+    # Columns of the WeatherConditions rows, keyed by the observation local time
+    WC_COLUMNS = ['WC_Datetime', 'WC_temp', 'WC_humidity', 'WC_precipRate', 'WC_precipTotal',
+                  'WC_pressure', 'WC_heatIndex', 'WC_windSpeed', 'WC_windGust', 'WC_windChill',
+                  'WC_winddir', 'WC_dewpt', 'WC_elev', 'WC_solarRadiation', 'WC_uv']
 
-                # Read a single record
-                sql = "SELECT * FROM `WeatherConditions` WHERE `WC_Datetime`=%s"
-                cursor.execute(sql, (wc['observations'][0].obsTimeLocal))
-                result = cursor.fetchone()
-
-                if result is None:
-                    # Insert a new record
-                    sql = """INSERT INTO WeatherConditions (
-                        WC_Datetime,
-                        WC_temp, 
-                        WC_humidity,
-                        WC_precipRate,
-                        WC_precipTotal,
-                        WC_pressure,
-                        WC_heatIndex,
-                        WC_windSpeed,
-                        WC_windGust,
-                        WC_windChill,
-                        WC_winddir,
-                        WC_dewpt,
-                        WC_elev,
-                        WC_solarRadiation,
-                        WC_uv) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-                    
-                    cursor.execute(sql,
-                        (
-                            wc['observations'][0].obsTimeLocal,
-                            wc['observations'][0].metric.temp,
-                            wc['observations'][0].humidity,
-                            wc['observations'][0].metric.precipRate,
-                            wc['observations'][0].metric.precipTotal,
-                            wc['observations'][0].metric.pressure,
-                            wc['observations'][0].metric.heatIndex,
-                            wc['observations'][0].metric.windSpeed*1.5,
-                            wc['observations'][0].metric.windGust*1.5,
-                            wc['observations'][0].metric.windChill,
-                            wc['observations'][0].winddir,
-                            wc['observations'][0].metric.dewpt,
-                            wc['observations'][0].metric.elev,
-                            wc['observations'][0].solarRadiation,
-                            wc['observations'][0].uv))
-            
-                    # connection is not autocommit by default. So you must commit to save
-                    # your changes.
-                    connection.commit()
-                    print(cursor.rowcount, "record(s) affected") 
-
-
-        finally:
-
-            connection.close()
+    def WeatherConditionsRow(self,wc):
+        observation = wc['observations'][0]
+        return (observation.obsTimeLocal,
+                observation.metric.temp,
+                observation.humidity,
+                observation.metric.precipRate,
+                observation.metric.precipTotal,
+                observation.metric.pressure,
+                observation.metric.heatIndex,
+                observation.metric.windSpeed*1.5,
+                observation.metric.windGust*1.5,
+                observation.metric.windChill,
+                observation.winddir,
+                observation.metric.dewpt,
+                observation.metric.elev,
+                observation.solarRadiation,
+                observation.uv)
 
-        return
+    def InsertDBWeatherCondtions(self,user,dbpassword,wc):
+        return self.InsertDBRows(user,dbpassword,[self.WeatherConditionsRow(wc)])
+
+    def InsertDBRows(self,user,dbpassword,rows):
+        # Borrow a connection from the database pool, kept open between observations
+        pool = get_pool(self.mysqlHost, user, dbpassword, self.mysqlDBname)
+        with pool.connection() as connection:
+            # An observation already recorded is left untouched (nothing to update)
+            return upsert_rows(connection, self.tablewc, 'WC_Datetime', self.WC_COLUMNS,
+                               rows, update_columns=[])
 
     def DisplayWeatherConditions(self,wc):    
         print("-----------------------------------------")
@@ -199,6 +207,100 @@ class WeatherConditions:
         print("-----------------------------------------")
         return
 
+# ------------------------------------------------------------------------------
+# Daemon mode: the stations are polled on a schedule from one asyncio loop,
+# keeping the HTTP and MySQL connections open. Observations are appended to
+# the local spool first, and a single drainer replays the spool to MySQL in
+# micro-batches, so that a slow or stopped database never delays the polls
+# ------------------------------------------------------------------------------
+async def PollStation(wc, spool, spooled, interval, session, cache, ttl, stop):
+    while not stop.is_set():
+        polled = time.monotonic()
+        try:
+            wcID = await asyncio.to_thread(wc.GetWeatherConditions, cache=cache, ttl=ttl, session=session)
+            if wcID and wcID.get('observations'):
+                await asyncio.to_thread(wc.SpoolRows, spool, [wc.WeatherConditionsRow(wcID)])
+                spooled.set()
+            else:
+                print(f"{wc.stationID}: no current observation")
+        except Exception as e:
+            # A failed poll must not stop the daemon: the next one is tried at the next tick
+            print(f"{wc.stationID}: poll failed: {e!r}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=max(0, interval - (time.monotonic() - polled)))
+        except asyncio.TimeoutError:
+            pass
+
+def DrainSpool(spool, stations, batch_size=1000, failed=None):
+    # One upsert per station database and batch, then the spool-to-commit latency of each observation
+    writers = {wc.stationID: wc.WriteRows for wc in stations}
+    drained = spool.drain(writers, batch_size, failed)
+    committed = time.time()
+    for station, spooled in drained.items():
+        latencies = [committed - spooled_time for spooled_time in spooled]
+        print(f"{station}: {len(spooled)} observation(s) committed, spool-to-commit latency "
+              f"min {min(latencies):.2f}s avg {sum(latencies) / len(latencies):.2f}s max {max(latencies):.2f}s")
+    return drained
+
+async def DrainObservations(spool, stations, spooled, batch_size, flush_interval, stop):
+    pending = spool.count()
+    deadline = time.monotonic() + flush_interval
+    # After a failed drain (database down), the next one waits for an exponential backoff
+    retry_delay, retry_at = DRAIN_RETRY_MIN, 0
+    while not stop.is_set():
+        try:
+            # Short waits, so that the stop is noticed quickly
+            await asyncio.wait_for(spooled.wait(), timeout=min(1, max(0.01, deadline - time.monotonic())))
+            spooled.clear()
+            pending += 1
+        except asyncio.TimeoutError:
+            pass
+        if (pending >= batch_size or time.monotonic() >= deadline) and time.monotonic() >= retry_at:
+            if pending:
+                failed = set()
+                await asyncio.to_thread(DrainSpool, spool, stations, batch_size, failed)
+                pending = spool.count()
+                if failed:
+                    print(f"Next drain in {retry_delay}s")
+                    retry_at = time.monotonic() + retry_delay
+                    retry_delay = min(retry_delay * 2, DRAIN_RETRY_MAX)
+                else:
+                    retry_delay, retry_at = DRAIN_RETRY_MIN, 0
+            deadline = time.monotonic() + flush_interval
+
+    # Last observations, spooled when the pollers stopped
+    await asyncio.to_thread(DrainSpool, spool, stations, batch_size)
+
+async def RunDaemon(stations, interval, batch_size, flush_interval, spool, cache=None, ttl=CURRENT_TTL):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    spooled = asyncio.Event()
+    session = HttpSession()
+    polls_done = asyncio.Event()
+    drainer = asyncio.create_task(DrainObservations(spool, stations, spooled, batch_size, flush_interval, polls_done))
+    try:
+        await asyncio.gather(*(PollStation(wc, spool, spooled, interval, session, cache, ttl, stop) for wc in stations))
+    finally:
+        # The drainer replays what the pollers left before the connections are closed
+        polls_done.set()
+        await drainer
+        session.close()
+        close_pools()
+
+# ------------------------------------------------------------
+# Check if the format of the date given in Arguments is valid
+# ------------------------------------------------------------
+def valid_day_type(arg_date_str):
+    """custom argparse type for YYYY-MM-DD days, kept as strings"""
+    try:
+        return datetime.strptime(arg_date_str, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        msg = "Given Date ({0}) not valid! Expected format, YYYY-MM-DD !".format(arg_date_str)
+        raise argparse.ArgumentTypeError(msg)
+
 # ------------------------------------------------------------------------------
 # Arguments management
 # ------------------------------------------------------------------------------
@@ -220,16 +322,60 @@ def getArgs(argv=None):
     parser.add_argument('-p', '--password',
                         dest='dbpassword',
                         default=None,
-                        required=True,
-                        help='Mysql admin user password')   
+                        help='Mysql admin user password (-B/-V stations)')   
+
+    # Stations of the JSON configuration file, all polled by the same process
+    parser.add_argument('-c', '--config',
+                        dest='config_path',
+                        help='Path to the JSON configuration file of the stations (dbConfigs)')
+    parser.add_argument('-s', '--station', dest='stations', action='append',
+                        help='Key of a station of the configuration file (repeatable). Default all the stations.')
 
-    group = parser.add_mutually_exclusive_group(required=True)
+    group = parser.add_mutually_exclusive_group()
     group.add_argument("-B", "--Bethune", action="store_true", required=False, help="Bethune WeatherUnderground station")
     group.add_argument("-V", "--Villebon", action="store_true", required=False, help="Villebon WeatherUnderground station")
 
+    # Daemon mode, polling the selected station (default both) until stopped
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and poll the stations every --interval seconds')
+    parser.add_argument('--interval', type=float, default=300,
+                        help='Seconds between two polls of a station in --daemon mode (default 300)')
+    parser.add_argument('--flush-interval', dest='flush_interval', type=float, default=60,
+                        help='Maximal seconds an observation is buffered before being written (default 60)')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=50,
+                        help='Number of buffered observations triggering a write (default 50)')
+
+    # Local write-ahead spool of the observations
+    parser.add_argument('--spool', dest='spool_file', default=DEFAULT_SPOOL_FILE,
+                        help=f'SQLite spool file where observations are stored before MySQL (default {DEFAULT_SPOOL_FILE})')
+    parser.add_argument('--drain', action='store_true',
+                        help='Only replay the spooled observations to MySQL')
+
+    # Live DayWeatherConditions checks
+    parser.add_argument('--reconcile', action='append', type=valid_day_type, metavar='YYYY-MM-DD',
+                        help='Compare the live daily aggregates of the day with a full recompute (repeatable)')
+    parser.add_argument('--repair', action='store_true',
+                        help='With --reconcile, write the recomputed DayWeatherConditions')
+
+    # Local cache of the WU answers
+    parser.add_argument('--cache-dir', dest='cache_dir', default=DEFAULT_CACHE_DIR,
+                        help=f'Directory of the WU response cache (default {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-ttl', dest='cache_ttl', type=int, default=CURRENT_TTL,
+                        help=f'Seconds during which cached current conditions are reused (default {CURRENT_TTL})')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='Always download the current conditions')
+
     parser.add_argument('--version', action='version', version='[%(prog)20s] 2.0')
    
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    if args.config_path is None:
+        if not (args.Bethune or args.Villebon or args.daemon or args.drain or args.reconcile):
+            parser.error("one of the arguments -B/--Bethune -V/--Villebon -c/--config is required")
+        if args.dbpassword is None:
+            parser.error("the argument -p/--password is required without -c/--config")
+    elif args.stations and (args.Bethune or args.Villebon):
+        parser.error("-s/--station cannot be combined with -B/--Bethune or -V/--Villebon")
+    return args
 
 if __name__ == "__main__":
 
@@ -240,24 +386,80 @@ if __name__ == "__main__":
     print ('display is ',args.display)
     print ('Bethune is ',args.Bethune)
     print ('Villebon is ',args.Villebon)
-    print ('dbpassword is ',args.dbpassword)
 
-    # Create new WeatherConditions instance for WU weather station given in parameter
+    # Create new WeatherConditions instances for the WU weather stations given in parameter
     # --------------------------------------------------------------------------------
-    if args.Bethune:
-        wc=WeatherConditions('IBTHUN1', '192.168.17.10', 'BethuneWeatherReport','admin',args.dbpassword)
-    if args.Villebon:
-        wc=WeatherConditions('IVILLE402', '192.168.17.10', 'VillebonWeatherReport','admin',args.dbpassword)
-    
-    # Get cuurent conditions from Weather Underground site
-    wcID=wc.GetWeatherConditions()
-
-    # if -d parameter set Display only
-    if args.display:
-        wc.DisplayWeatherConditions(wcID)
-    # else Insert in Database
+    if args.config_path:
+        station_keys = list(args.stations or [])
+        if args.Villebon:
+            station_keys.append(VILLEBON_KEY)
+        if args.Bethune:
+            station_keys.append(BETHUNE_KEY)
+        configs = select_stations(load_station_configs(args.config_path), station_keys)
+        stations = {key: WeatherConditions.from_config(config) for key, config in configs.items()}
     else:
-        wc.InsertDBWeatherCondtions('admin',args.dbpassword,wcID)
+        stations = {}
+        if args.Bethune or not args.Villebon:
+            stations[BETHUNE_KEY] = WeatherConditions('IBTHUN1', '192.168.17.10', 'BethuneWeatherReport','admin',args.dbpassword)
+        if args.Villebon or not args.Bethune:
+            stations[VILLEBON_KEY] = WeatherConditions('IVILLE402', '192.168.17.10', 'VillebonWeatherReport','admin',args.dbpassword)
+
+    cache = None if args.no_cache else ResponseCache(args.cache_dir)
+
+    spool = ObservationSpool(args.spool_file)
+
+    # Running daily aggregates, kept with the spool, for the stations having a DayWeatherConditions table
+    accumulators = DailyAccumulators(args.spool_file)
+    for wc in stations.values():
+        wc.accumulators = accumulators
+
+    if args.reconcile:
+        # Live aggregates against a full recompute from the WeatherConditions rows
+        differences = 0
+        for wc in stations.values():
+            if wc.day is None:
+                print(f"{wc.stationID}: no DayWeatherConditions table configured")
+                continue
+            for DateDash in args.reconcile:
+                live = accumulators.day_conditions(wc.stationID, DateDash)
+                recomputed = wc.day.GetDayWCFromDB(DateDash)
+                for field, (live_value, full_value) in compare_conditions(live, recomputed).items():
+                    print(f"{wc.stationID} {DateDash} {field}: live {live_value} recomputed {full_value}")
+                    differences += 1
+                if args.repair and recomputed is not None:
+                    wc.day.UpsertDayWeatherConditions({DateDash: recomputed})
+        print(differences, "difference(s) found")
+        sys.exit(1 if differences and not args.repair else 0)
+
+    if args.drain:
+        DrainSpool(spool, list(stations.values()))
+        left = spool.count()
+        print(left, "observation(s) left in the spool")
+        sys.exit(1 if left else 0)
+
+    if args.daemon:
+        asyncio.run(RunDaemon(list(stations.values()), args.interval, args.batch_size, args.flush_interval, spool,
+                              cache=cache, ttl=args.cache_ttl))
+        sys.exit(0)
+
+    def PollAndInsert(key, config):
+        wc = stations[key]
+        # Get current conditions from Weather Underground site
+        wcID=wc.GetWeatherConditions(cache=cache, ttl=args.cache_ttl)
+        if not wcID:
+            raise ValueError(f"no current observation for {wc.stationID}")
+
+        # if -d parameter set Display only
+        if args.display:
+            wc.DisplayWeatherConditions(wcID)
+        # else spool the observation, then replay the spool of the station to the Database
+        # (kept in the spool for the next run if the Database is not available)
+        else:
+            wc.SpoolRows(spool, [wc.WeatherConditionsRow(wcID)])
+            DrainSpool(spool, [wc])
 
-    print (wcID)
+        print (wcID)
 
+    # Every station polled in its own thread: a failing station does not stop the others
+    failed = run_stations(PollAndInsert, {key: {'weatherStation': wc.stationID} for key, wc in stations.items()})
+    sys.exit(1 if failed else 0)
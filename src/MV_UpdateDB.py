@@ -9,6 +9,10 @@ from easydict import EasyDict as edict
 
 import urllib.request, urllib.error
 import pymysql.cursors
+from WC_DbPool import get_pool
+from WC_DbWriter import DEFAULT_CHUNK_SIZE, check_fields, upsert_rows
+from WC_WuCache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, ResponseCache
+from WC_WuClient import TokenBucket, fetch_all, fetch_cached_json
 from datetime import date, timedelta, datetime
 import argparse
 
@@ -55,6 +59,29 @@ def getArgs(argv=None):
                         help='Mysql admin user password')
 
 
+    parser.add_argument("-f", "--fields", type=str, help="Restrictive list of database fields to be updated, separated by commas, ex: TemperatureAvgC,PrecipitationSumCM. Default all fields.")
+
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Number of days written per INSERT ... ON DUPLICATE KEY UPDATE statement (default {DEFAULT_CHUNK_SIZE})')
+
+    # Concurrent fetch of the WU history
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of concurrent WU requests (default 4)')
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help='Maximal number of WU requests per second (default 2)')
+    parser.add_argument('--queue-size', dest='queue_size', type=int, default=64,
+                        help='Number of fetched days waiting for the database writer (default 64)')
+    parser.add_argument('--wu-url', dest='wu_url', default=WU_HISTORY_URL,
+                        help='WU daily history endpoint, e.g. a local stand-in for testing')
+
+    # Local cache of the WU answers
+    parser.add_argument('--cache-dir', dest='cache_dir', default=DEFAULT_CACHE_DIR,
+                        help=f'Directory of the WU response cache (default {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help='Maximal size of the WU response cache in MB')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='Always download the WU answers')
+
     parser.add_argument('--version', action='version', version='[%(prog)20s] 2.0')
 
     return parser.parse_args(argv)
@@ -87,132 +114,46 @@ def UpdateDB(DateDash,WeatherRecord,dbpassword):
     # GustSpeedMaxKMH 	    int(3) 		 Oui 	NULL
     # PrecipitationSumCM 	decimal(3,2) Oui 	NULL
 
-    # Connect to the database
-    connection = pymysql.connect(host='192.168.17.10',
-                                user='admin',
-                                password=dbpassword,
-                                db='meteovillebon',
-                                charset='utf8mb4',
-                                cursorclass=pymysql.cursors.DictCursor,
-                                autocommit=True)
-
-    try:
-
-        with connection.cursor() as cursor:
-
-        # Read a single record
-            sql = "SELECT * FROM `RelevesMeteo` WHERE `Date`=%s"
-            cursor.execute(sql, (DateDash))
-            result = cursor.fetchone()
-
-            if result is not None:
-                # Update existing record
-                sql = """UPDATE RelevesMeteo SET 
-                Date = %s,
-                TemperatureHighC = %s,
-                TemperatureAvgC = %s,
-                TemperatureLowC = %s,
-                DewpointHighC = %s,
-                DewpointAvgC = %s,
-                DewpointLowC = %s,
-                HumidityHigh = %s,
-                HumidityAvg = %s,
-                HumidityLow = %s,
-                PressureMaxhPa = %s,
-                PressureMinhPa = %s,
-                WindSpeedMaxKMH = %s,
-                WindSpeedAvgKMH = %s,
-                GustSpeedMaxKMH = %s,
-                PrecipitationSumCM = %s
-                WHERE Date = %s"""
-
-                cursor.execute(sql,
-                (DateDash,
-                WeatherRecord['observations'][0].metric.tempHigh,
-                WeatherRecord['observations'][0].metric.tempAvg,
-                WeatherRecord['observations'][0].metric.tempLow,
-                WeatherRecord['observations'][0].metric.dewptHigh,
-                WeatherRecord['observations'][0].metric.dewptAvg,
-                WeatherRecord['observations'][0].metric.dewptLow,
-                WeatherRecord['observations'][0].humidityHigh,
-                WeatherRecord['observations'][0].humidityAvg,
-                WeatherRecord['observations'][0].humidityLow,
-                WeatherRecord['observations'][0].metric.pressureMax,
-                WeatherRecord['observations'][0].metric.pressureMin,
-                WeatherRecord['observations'][0].metric.windspeedHigh,
-                WeatherRecord['observations'][0].metric.windspeedAvg,
-                WeatherRecord['observations'][0].metric.windgustHigh,
-                WeatherRecord['observations'][0].metric.precipTotal,
-                DateDash ))
-
-            else:
-                # Insert a new record
-                sql = """INSERT INTO RelevesMeteo (Date,
-                    TemperatureHighC, 
-                    TemperatureAvgC,
-                    TemperatureLowC,
-                    DewpointHighC,
-                    DewpointAvgC,
-                    DewpointLowC,
-                    HumidityHigh,
-                    HumidityAvg,
-                    HumidityLow,
-                    PressureMaxhPa,
-                    PressureMinhPa,
-                    WindSpeedMaxKMH,
-                    WindSpeedAvgKMH,
-                    GustSpeedMaxKMH,
-                    PrecipitationSumCM) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-                print (sql,(DateDash,
-                    WeatherRecord['observations'][0].metric.tempHigh,
-                    WeatherRecord['observations'][0].metric.tempAvg,
-                    WeatherRecord['observations'][0].metric.tempLow,
-                    WeatherRecord['observations'][0].metric.dewptHigh,
-                    WeatherRecord['observations'][0].metric.dewptAvg,
-                    WeatherRecord['observations'][0].metric.dewptLow,
-                    WeatherRecord['observations'][0].humidityHigh,
-                    WeatherRecord['observations'][0].humidityAvg,
-                    WeatherRecord['observations'][0].humidityLow,
-                    WeatherRecord['observations'][0].metric.pressureMax,
-                    WeatherRecord['observations'][0].metric.pressureMin,
-                    WeatherRecord['observations'][0].metric.windspeedHigh,
-                    WeatherRecord['observations'][0].metric.windspeedAvg,
-                    WeatherRecord['observations'][0].metric.windgustHigh,
-                    WeatherRecord['observations'][0].metric.precipTotal))
-                cursor.execute(sql,
-                    (DateDash,
-                    WeatherRecord['observations'][0].metric.tempHigh,
-                    WeatherRecord['observations'][0].metric.tempAvg,
-                    WeatherRecord['observations'][0].metric.tempLow,
-                    WeatherRecord['observations'][0].metric.dewptHigh,
-                    WeatherRecord['observations'][0].metric.dewptAvg,
-                    WeatherRecord['observations'][0].metric.dewptLow,
-                    WeatherRecord['observations'][0].humidityHigh,
-                    WeatherRecord['observations'][0].humidityAvg,
-                    WeatherRecord['observations'][0].humidityLow,
-                    WeatherRecord['observations'][0].metric.pressureMax,
-                    WeatherRecord['observations'][0].metric.pressureMin,
-                    WeatherRecord['observations'][0].metric.windspeedHigh,
-                    WeatherRecord['observations'][0].metric.windspeedAvg,
-                    WeatherRecord['observations'][0].metric.windgustHigh,
-                    WeatherRecord['observations'][0].metric.precipTotal))
-
-                # sql = "UPDATE customers SET address = 'Canyon 123' WHERE address = 'Valley 345'"
-                # prepare query and data
-                # query = """ UPDATE books
-                # SET title = %s
-                # WHERE id = %s """
-
-            
-        # connection is not autocommit by default. So you must commit to save
-        # your changes.
-            connection.commit()
-            print(cursor.rowcount, "record(s) affected") 
-
-
-    finally:
-
-        connection.close()
+    # Single day written through the bulk upsert path
+    if WeatherRecord:
+        UpdateDBRows([RelevesMeteoRow(DateDash, WeatherRecord)], dbpassword)
+
+# Columns of the RelevesMeteo rows, keyed by Date
+RELEVES_COLUMNS = ['Date', 'TemperatureHighC', 'TemperatureAvgC', 'TemperatureLowC',
+                   'DewpointHighC', 'DewpointAvgC', 'DewpointLowC',
+                   'HumidityHigh', 'HumidityAvg', 'HumidityLow',
+                   'PressureMaxhPa', 'PressureMinhPa',
+                   'WindSpeedMaxKMH', 'WindSpeedAvgKMH', 'GustSpeedMaxKMH', 'PrecipitationSumCM']
+
+def RelevesMeteoRow(DateDash,WeatherRecord):
+    # Values of a WU daily history record, in RELEVES_COLUMNS order
+    observation = WeatherRecord['observations'][0]
+    return (DateDash,
+            observation.metric.tempHigh,
+            observation.metric.tempAvg,
+            observation.metric.tempLow,
+            observation.metric.dewptHigh,
+            observation.metric.dewptAvg,
+            observation.metric.dewptLow,
+            observation.humidityHigh,
+            observation.humidityAvg,
+            observation.humidityLow,
+            observation.metric.pressureMax,
+            observation.metric.pressureMin,
+            observation.metric.windspeedHigh,
+            observation.metric.windspeedAvg,
+            observation.metric.windgustHigh,
+            observation.metric.precipTotal)
+
+def UpdateDBRows(rows,dbpassword,fields=None,chunk_size=DEFAULT_CHUNK_SIZE):
+    # Insert new days and update existing ones with INSERT ... ON DUPLICATE KEY UPDATE,
+    # chunk_size days per round-trip. Existing days only get the given fields (default all).
+    pool = get_pool('192.168.17.10', 'admin', dbpassword, 'meteovillebon')
+    with pool.connection() as connection:
+        if fields:
+            check_fields(fields, pool.table_columns('RelevesMeteo', connection))
+        return upsert_rows(connection, 'RelevesMeteo', 'Date', RELEVES_COLUMNS, rows,
+                           update_columns=fields, chunk_size=chunk_size)
 
 # ------------------------------------------------------------
 # https://gist.github.com/monkut/e60eea811ef085a6540f
@@ -245,50 +186,78 @@ def DateYYYYMMDD(Date):
 
 # ----------------------------------------------------------------
 # Build URL to access to current daily observations of ILEDEFRA131
-def GetWeatherData(DateYYYYMMDD):
 
-    mystr_dict = {}
-    mystr = ""
+# Expires: Sat, 14 Aug 2021 17:48:33 GMT.
+# https://www.wunderground.com/member/api-keys
+# key = 'e1641bfe316344f8a41bfe3163e4f8ae'
+WU_KEY = '93f1717ea6714de3b1717ea671ade338'
+WU_HISTORY_URL = 'https://api.weather.com/v2/pws/history/daily'
 
-    # Expires: Sat, 14 Aug 2021 17:48:33 GMT.
-    # https://www.wunderground.com/member/api-keys
-    # key = 'e1641bfe316344f8a41bfe3163e4f8ae'
-    key = '93f1717ea6714de3b1717ea671ade338'
-    BASE_URL = 'https://api.weather.com/v2/pws/history/daily?stationId=ILEDEFRA131&format=json&units=m'
-    FEATURE_URL = BASE_URL + f"&date={DateYYYYMMDD}&apiKey={key}&numericPrecision=decimal"
+WU_STATION = 'ILEDEFRA131'
+# Lifetime of the cached history of the current day, still changing
+TODAY_TTL = 600
+
+def GetWeatherData(DateYYYYMMDD, limiter=None, base_url=WU_HISTORY_URL, cache=None):
+
+    FEATURE_URL = base_url + f"?stationId={WU_STATION}&format=json&units=m&date={DateYYYYMMDD}&apiKey={WU_KEY}&numericPrecision=decimal"
+
+    # The history of a past day never changes: its cache entry does not expire
+    ttl = None if DateYYYYMMDD < date.today().strftime("%Y%m%d") else TODAY_TTL
 
     print (FEATURE_URL)
-    # Execute the HTTPS request to get JSON Result
-    try:
-        fp = urllib.request.urlopen(FEATURE_URL)
-    except urllib.error.HTTPError as e:
-        # Return code error (e.g. 404, 501, ...)
-        # ...
-        print('HTTPError: {}'.format(e.code))
-    except urllib.error.URLError as e:
-        # Not an HTTP-specific error (e.g. connection refused)
-        # ...
-        print('URLError: {}'.format(e.reason))
-    else:
-        # 200
-        # ...
-        print('good')
-        mybytes = fp.read()
-
-        # -*- decoding: utf-8 -*-
-        mystr = mybytes.decode("utf8")
-        print ("[",mystr,"]",sep="")
-        fp.close()
-
-        if mystr:
-            # used edict ==> Very useful when exploiting parsed JSON content !
-            print ("TRUE")
-            mystr_dict = edict(json.loads(mystr))
-        else:
-            mystr_dict = {}
-            print ("FALSE")
-
-    return(mystr_dict)
+    # Execute the HTTPS request to get JSON Result, retried on 429/5xx answers
+    return fetch_cached_json(FEATURE_URL, cache=cache, key=(WU_STATION, base_url, DateYYYYMMDD), ttl=ttl, limiter=limiter)
+
+def DisplayWeatherData(DateDash, Weather_Dict):
+    print("-----------------------------")
+    print("Date               :",DateDash)
+    print("Température Moyenne: ",Weather_Dict['observations'][0].metric.tempAvg,"°",sep="")
+    print("Température Maxi   : ",Weather_Dict['observations'][0].metric.tempHigh,"°",sep="")
+    print("Température Mini   : ",Weather_Dict['observations'][0].metric.tempLow,"°",sep="")
+    print("DewPoint High      : ",Weather_Dict['observations'][0].metric.dewptHigh,"°",sep="")
+    print("Dewpoint Moy       : ",Weather_Dict['observations'][0].metric.dewptLow,"°",sep="")
+    print("Dewpoint Mini      : ",Weather_Dict['observations'][0].metric.dewptAvg,"°",sep="")
+    print("Humidité Maxi      : ",Weather_Dict['observations'][0].humidityHigh,"%",sep="")
+    print("Humidité Moy.      : ",Weather_Dict['observations'][0].humidityAvg,"%",sep="")
+    print("Humidité Mini      : ",Weather_Dict['observations'][0].humidityLow,"%",sep="")
+    print("Pression Max       : ",Weather_Dict['observations'][0].metric.pressureMax,"Hpa",sep="")
+    print("Pression Mini      : ",Weather_Dict['observations'][0].metric.pressureMin,"Hpa",sep="")
+    print("Vent Max           : ",Weather_Dict['observations'][0].metric.windspeedHigh,"Km/h",sep="")
+    print("Vent Moyen         : ",Weather_Dict['observations'][0].metric.windspeedAvg,"Km/h",sep="")
+    print("Rafale VentMax     : ",Weather_Dict['observations'][0].metric.windgustHigh,"Km/h",sep="")
+    print("Précipitation      : ",Weather_Dict['observations'][0].metric.precipTotal,"mm",sep="")
+
+# ----------------------------------------------------------------
+# Backfill of a date range: the WU history days are fetched by worker
+# threads, under a shared rate limit, and written by a single batched writer
+def BackfillDB(start_date, end_date, dbpassword, fields=None, batch_size=DEFAULT_CHUNK_SIZE,
+               workers=4, rate=2.0, queue_size=64, display=False, base_url=WU_HISTORY_URL, cache=None):
+    limiter = TokenBucket(rate, capacity=workers)
+    days = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+
+    def fetch(day):
+        return GetWeatherData(day.strftime("%Y%m%d"), limiter=limiter, base_url=base_url, cache=cache)
+
+    rows = []
+    missing = []
+    for day, Weather_Dict in fetch_all(days, fetch, workers=workers, queue_size=queue_size):
+        DateDash = day.strftime("%Y-%m-%d")
+        if not Weather_Dict or not Weather_Dict.get('observations'):
+            missing.append(DateDash)
+            continue
+        if display:
+            DisplayWeatherData(DateDash, Weather_Dict)
+            continue
+
+        rows.append(RelevesMeteoRow(DateDash,Weather_Dict))
+        if len(rows) >= batch_size:
+            UpdateDBRows(rows,dbpassword,fields,batch_size)
+            rows = []
+
+    if rows:
+        UpdateDBRows(rows,dbpassword,fields,batch_size)
+    if missing:
+        print("No WU data for:", ", ".join(sorted(missing)))
 
 # ------------------------------------------------------------------------------
 # initializing the titles and rows list
@@ -335,38 +304,9 @@ if __name__ == "__main__":
     end_date = args.enddate
     dbpassword = args.dbpassword
     delta = timedelta(days=1)
-    
-
-    while start_date <= end_date:
-
-        WeatherDict = {}
-    
-        DateDash=start_date.strftime("%Y-%m-%d")
-        DateYYYYMMDD=start_date.strftime("%Y%m%d")
-
-        Weather_Dict=GetWeatherData(DateYYYYMMDD)
-        if Weather_Dict:
-            print("-----------------------------")
-            print("Date               :",DateDash)
-            print("Température Moyenne: ",Weather_Dict['observations'][0].metric.tempAvg,"°",sep="")
-            print("Température Maxi   : ",Weather_Dict['observations'][0].metric.tempHigh,"°",sep="")
-            print("Température Mini   : ",Weather_Dict['observations'][0].metric.tempLow,"°",sep="")
-            print("DewPoint High      : ",Weather_Dict['observations'][0].metric.dewptHigh,"°",sep="")
-            print("Dewpoint Moy       : ",Weather_Dict['observations'][0].metric.dewptLow,"°",sep="")
-            print("Dewpoint Mini      : ",Weather_Dict['observations'][0].metric.dewptAvg,"°",sep="")
-            print("Humidité Maxi      : ",Weather_Dict['observations'][0].humidityHigh,"%",sep="")
-            print("Humidité Moy.      : ",Weather_Dict['observations'][0].humidityAvg,"%",sep="")
-            print("Humidité Mini      : ",Weather_Dict['observations'][0].humidityLow,"%",sep="")
-            print("Pression Max       : ",Weather_Dict['observations'][0].metric.pressureMax,"Hpa",sep="")
-            print("Pression Mini      : ",Weather_Dict['observations'][0].metric.pressureMin,"Hpa",sep="")
-            print("Vent Max           : ",Weather_Dict['observations'][0].metric.windspeedHigh,"Km/h",sep="")
-            print("Vent Moyen         : ",Weather_Dict['observations'][0].metric.windspeedAvg,"Km/h",sep="")
-            print("Rafale VentMax     : ",Weather_Dict['observations'][0].metric.windgustHigh,"Km/h",sep="")
-            print("Précipitation      : ",Weather_Dict['observations'][0].metric.precipTotal,"mm",sep="")
-
-        UpdateDB(DateDash,Weather_Dict,dbpassword)
-        print ('enddate is ', enddate)
-        print ('update is ',args.update)
-        print ('insert is ',args.update)
-
-        start_date += delta
+    fields_to_update = args.fields.split(',') if args.fields else None
+
+    BackfillDB(start_date, end_date, dbpassword, fields=fields_to_update, batch_size=args.batch_size,
+               workers=args.workers, rate=args.rate, queue_size=args.queue_size,
+               display=args.display, base_url=args.wu_url,
+               cache=None if args.no_cache else ResponseCache(args.cache_dir, args.cache_size * 1024 * 1024))
@@ -13,6 +13,9 @@ import urllib.request, urllib.error
 from easydict import EasyDict as edict
 
 import pymysql.cursors
+from WC_DbPool import get_pool
+from WC_DbWriter import DEFAULT_CHUNK_SIZE, check_fields, upsert_rows
+from WC_StationConfig import BETHUNE_KEY, VILLEBON_KEY, load_station_configs, run_stations, select_stations
 # from datetime import date, timedelta, datetime
 import argparse
 
@@ -67,38 +70,50 @@ class DayWeatherConditions:
         self.timezone = config['timezone']
         self.tabledwc = config['tabledwc']
         self.tablewc = config['tablewc']
+        self.pool = get_pool(self.mysqlHost, self.user, self.dbpassword, self.mysqlDBname)
 
-    def GetDayWCFromDB(self, DateDash):
-        # Access the instance variables like self.user, self.dbpassword, etc.
-        # Use self.mysqlHost, self.mysqlDBname, self.user, self.dbpassword to interact with DB
-        connection = pymysql.connect(host=self.mysqlHost,
-                                     user=self.user,
-                                     password=self.dbpassword,
-                                     db=self.mysqlDBname,
-                                     charset='utf8mb4',
-                                     cursorclass=pymysql.cursors.DictCursor,
-                                     autocommit=True)
-        try:
-            with connection.cursor() as cursor:
+    # Aggregates of the WeatherConditions rows of a day, as DayWeatherConditions fields
+    DAY_AGGREGATES = """ROUND(AVG(WC_temp),1) as WC_TempAvg, 
+                        MAX(WC_temp) as WC_TempHigh, 
+                        MIN(WC_temp) as WC_TempLow,
+                        ROUND(AVG(WC_dewpt),1) as WC_DewPointAvg,
+                        MAX(WC_dewpt) as WC_DewPointHigh,
+                        MIN(WC_dewpt) as WC_DewPointLow,
+                        ROUND(AVG(WC_humidity),0) as WC_HumidityAvg,
+                        MAX(WC_humidity) as WC_HumidityHigh,
+                        MIN(WC_humidity) as WC_HumidityLow,
+                        ROUND(AVG(WC_pressure),1) as WC_PressureAvg,
+                        ROUND(MAX(WC_pressure),1) as WC_PressureHigh,
+                        ROUND(MIN(WC_pressure),1) as WC_PressureLow,
+                        MAX(WC_windSpeed) as WC_WindSpeedMax,
+                        MAX(WC_windGust) as WC_GustSpeedMax,
+                        ROUND(MAX(WC_precipTotal),1) as WC_PrecipitationSum"""
+
+    # Method to compute the local sunrise and sunset times of a day
+    def GetSunriseSunset(self, DateDash):
+        # Create a LocationInfo object with the city's name and country
+        # Example: classastral.LocationInfo(name: str = 'Greenwich', region: str = 'England', timezone: str = 'Europe/London', latitude: float = 51.4733, longitude: float = -0.0008333)
+        city = LocationInfo(name=self.stationID, region="France", timezone=self.timezone, latitude=self.latitude, longitude=self.longitude)
 
-                # Create a LocationInfo object with the city's name and country
-                # Example: classastral.LocationInfo(name: str = 'Greenwich', region: str = 'England', timezone: str = 'Europe/London', latitude: float = 51.4733, longitude: float = -0.0008333)
-                city = LocationInfo(name=self.stationID, region="France", timezone=self.timezone, latitude=self.latitude, longitude=self.longitude)
+        # Get the current date (replace Date with the appropriate variable)
+        current_date = datetime.strptime(DateDash, "%Y-%m-%d")
 
-                # Get the current date (replace Date with the appropriate variable)
-                current_date = datetime.strptime(DateDash, "%Y-%m-%d")
+        # Calculate sunrise and sunset times for the given date
+        s = sun(city.observer, date=current_date)
 
-                # Calculate sunrise and sunset times for the given date
-                s = sun(city.observer, date=current_date)
+        # Extract sunrise and sunset times (these are in UTC) and convert them to the station timezone
+        tz = pytz.timezone(self.timezone)
+        return s['sunrise'].astimezone(tz), s['sunset'].astimezone(tz)
 
-                # Extract sunrise and sunset times (these are in UTC)
-                sunrise_utc = s['sunrise']
-                sunset_utc = s['sunset']
+    def GetDayWCFromDB(self, DateDash):
+        # Access the instance variables like self.user, self.dbpassword, etc.
+        # Use self.mysqlHost, self.mysqlDBname, self.user, self.dbpassword to interact with DB
+        # Borrow a connection from the station database pool
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
 
-                # Convert to timezone (if required)
-                tz = pytz.timezone(self.timezone)
-                sunrise_local = sunrise_utc.astimezone(tz)
-                sunset_local = sunset_utc.astimezone(tz)
+                # Sunrise and sunset times of the day, in local time
+                sunrise_local, sunset_local = self.GetSunriseSunset(DateDash)
 
                 # Convert local sunrise and sunset times to string format for SQL query
                 sunrise_str = sunrise_local.strftime("%Y-%m-%d %H:%M:%S")
@@ -118,21 +133,7 @@ class DayWeatherConditions:
 
                 # Query for all-day weather data
                 sql_all_day = f"""SELECT 
-                        ROUND(AVG(WC_temp),1) as WC_TempAvg, 
-                        MAX(WC_temp) as WC_TempHigh, 
-                        MIN(WC_temp) as WC_TempLow,
-                        ROUND(AVG(WC_dewpt),1) as WC_DewPointAvg,
-                        MAX(WC_dewpt) as WC_DewPointHigh,
-                        MIN(WC_dewpt) as WC_DewPointLow,
-                        ROUND(AVG(WC_humidity),0) as WC_HumidityAvg,
-                        MAX(WC_humidity) as WC_HumidityHigh,
-                        MIN(WC_humidity) as WC_HumidityLow,
-                        ROUND(AVG(WC_pressure),1) as WC_PressureAvg,
-                        ROUND(MAX(WC_pressure),1) as WC_PressureHigh,
-                        ROUND(MIN(WC_pressure),1) as WC_PressureLow,
-                        MAX(WC_windSpeed) as WC_WindSpeedMax,
-                        MAX(WC_windGust) as WC_GustSpeedMax,
-                        ROUND(MAX(WC_precipTotal),1) as WC_PrecipitationSum
+                        {self.DAY_AGGREGATES}
                         FROM `{self.tablewc}`
                         WHERE DATE(WC_Datetime) = '{DateDash}'"""
 
@@ -155,89 +156,82 @@ class DayWeatherConditions:
                 else:
                     result_all_day['WC_SolarRadiationAvg'] = None
 
-        finally:
-            connection.close()
-
         return result_all_day
         
+    # Method to compute the weather conditions of every day of a date range at once
+    def GetRangeWCFromDB(self, start_date, end_date):
+        """Return {DateDash: wc} for the days from start_date to end_date (included)
+        having WeatherConditions rows, with one grouped query for the daily
+        aggregates and one query for the solar radiation averages, each day
+        being joined to its sunrise-sunset window."""
+        # Borrow a connection from the station database pool
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                # Query for all-day weather data, grouped by day over an index friendly datetime range
+                sql_range = f"""SELECT DATE(WC_Datetime) as WC_Date,
+                        {self.DAY_AGGREGATES}
+                        FROM `{self.tablewc}`
+                        WHERE WC_Datetime >= %s AND WC_Datetime < %s
+                        GROUP BY DATE(WC_Datetime)
+                        ORDER BY WC_Date"""
+
+                cursor.execute(sql_range, (start_date.strftime("%Y-%m-%d"), (end_date + timedelta(days=1)).strftime("%Y-%m-%d")))
+                results = {row.pop('WC_Date').strftime("%Y-%m-%d"): row for row in cursor.fetchall()}
+
+                if results:
+                    # Sunrise-sunset window of each day, as a derived table joined on WC_Datetime
+                    windows = []
+                    for DateDash in results:
+                        sunrise_local, sunset_local = self.GetSunriseSunset(DateDash)
+                        windows += [DateDash, sunrise_local.strftime("%Y-%m-%d %H:%M:%S"), sunset_local.strftime("%Y-%m-%d %H:%M:%S")]
+                    sql_windows = " UNION ALL ".join(["SELECT %s AS Day, %s AS Sunrise, %s AS Sunset"] * len(results))
+
+                    # Query for solar radiation data
+                    sql_solar_radiation = f"""SELECT w.Day,
+                            ROUND(AVG(wc.WC_SolarRadiation),1) as WC_SolarRadiationAvg
+                            FROM ({sql_windows}) AS w
+                            LEFT JOIN `{self.tablewc}` AS wc ON wc.WC_Datetime BETWEEN w.Sunrise AND w.Sunset
+                            GROUP BY w.Day"""
+
+                    cursor.execute(sql_solar_radiation, windows)
+                    solar = {row['Day']: row['WC_SolarRadiationAvg'] for row in cursor.fetchall()}
+
+                    # Merge results
+                    for DateDash, wc in results.items():
+                        wc['WC_SolarRadiationAvg'] = solar.get(DateDash)
+
+        return results
+
     # Method to fetch the columns of the table dynamically based on self.tabledwc
     def GetTableColumns(self, connection):
-        with connection.cursor() as cursor:
-            # Use the table name from the instance variable self.tabledwc
-            sql = f"DESCRIBE `{self.tabledwc}`"
-            cursor.execute(sql)
-            # Extract the column names from the DESCRIBE query result
-            columns = [row['Field'] for row in cursor.fetchall()]
-        return columns
+        # DESCRIBE is run once, then served from the pool schema cache
+        return self.pool.table_columns(self.tabledwc, connection)
 
     # Method to insert or update weather conditions
     def InsertDayWeatherConditions(self, wc, date, fields=None, noexecute=False):
-        # Connect to the MySQL database
-        connection = pymysql.connect(host=self.mysqlHost,
-                                     user=self.user,
-                                     password=self.dbpassword,
-                                     db=self.mysqlDBname,
-                                     charset='utf8mb4',
-                                     cursorclass=pymysql.cursors.DictCursor,
-                                     autocommit=True)
-        try:
-            # Retrieve all valid column names from the table
-            valid_columns = self.GetTableColumns(connection)
-
+        # Single day written through the bulk upsert path
+        return self.UpsertDayWeatherConditions({date: wc}, fields=fields, noexecute=noexecute)
+
+    # Method to insert or update the weather conditions of many days at once
+    def UpsertDayWeatherConditions(self, days, fields=None, noexecute=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Write all the {DateDash: wc} days with bulk INSERT ... ON DUPLICATE KEY UPDATE.
+        New days get every field, existing days only the given fields (default all).
+        Returns the written/affected row counts."""
+        if not days:
+            return None
+
+        # Borrow a connection from the station database pool
+        with self.pool.connection() as connection:
             # Validate the provided fields against the valid column names
             if fields:
-                invalid_fields = [field for field in fields if f"{field}" not in valid_columns]
-                if invalid_fields:
-                    raise ValueError(f"Invalid fields: {', '.join(invalid_fields)}")
+                check_fields(fields, self.GetTableColumns(connection))
 
-            with connection.cursor() as cursor:
-                # Check if a record already exists for the given date
-                sql = f"SELECT * FROM `{self.tabledwc}` WHERE `WC_Date`=%s"
-                cursor.execute(sql, (date,))
-                result = cursor.fetchone()
-              
-                if result is None:
-                    # Ensure that WC_Date is included in the columns and values for the INSERT statement
-                    columns = ["WC_Date"] + [f"{key}" for key in wc.keys()]
-                    values = [date] + [wc[key] for key in wc.keys()]
-
-                    # Construct the SQL query for inserting a new record
-                    sql = f"""INSERT INTO `{self.tabledwc}` ({', '.join(columns)}) 
-                            VALUES ({', '.join(['%s'] * len(values))})"""
-                    
-                    if noexecute:
-                        # Debug mode: Print the SQL query and values instead of executing it
-                        print("[DEBUG] SQL for INSERT:", sql)
-                        print("[DEBUG] Values:", tuple(values))
-                    else:
-                        # Execute the SQL query with the provided values
-                        cursor.execute(sql, tuple(values))
-                else:
-                    # Generate the SQL for UPDATE
-                    if fields:
-                        columns = [f"{field}" for field in fields]
-                        values = [wc[field] for field in fields]
-                    else:
-                        # If no fields are specified, update all fields in `wc`
-                        columns = [f"{key}" for key in wc.keys()]
-                        values = [wc[key] for key in wc.keys()]
-                    set_clause = ", ".join([f"{col} = %s" for col in columns])
-                    sql = f"""UPDATE `{self.tabledwc}` SET {set_clause} WHERE WC_Date = %s"""
-                    if noexecute:
-                        print("[DEBUG] SQL for UPDATE:", sql)
-                        print("[DEBUG] Values:", tuple(values + [date]))
-                    else:
-                        cursor.execute(sql, tuple(values + [date]))
-
-                # Commit the changes if not in noexecute mode
-                if not noexecute:
-                    connection.commit()
-                    print(cursor.rowcount, "record(s) affected")
-        finally:
-            # Close the database connection
-            connection.close()
-
-        return
+            keys = list(next(iter(days.values())).keys())
+            columns = ["WC_Date"] + keys
+            values = [tuple([date] + [wc[key] for key in keys]) for date, wc in days.items()]
+            return upsert_rows(connection, self.tabledwc, "WC_Date", columns, values,
+                               update_columns=fields if fields else keys,
+                               chunk_size=chunk_size, noexecute=noexecute)
 
     def DisplayWeatherConditions(self,wc,date):    
         print("-----------------------------------------")
@@ -309,10 +303,12 @@ def getArgs(argv=None):
                         required=True,
                         help='Path to the JSON configuration file')
 
-    # Station sélectionnée (Bethune ou Villebon)
-    group = parser.add_mutually_exclusive_group(required=True)
+    # Station sélectionnée (Bethune ou Villebon), par défaut toutes les stations du fichier
+    group = parser.add_mutually_exclusive_group()
     group.add_argument("-B", "--Bethune", action="store_true", help="Bethune WeatherUnderground station")
     group.add_argument("-V", "--Villebon", action="store_true", help="Villebon WeatherUnderground station")
+    parser.add_argument('-s', '--station', dest='stations', action='append',
+                        help='Key of a station of the configuration file (repeatable). Default all the stations.')
 
     # Argument for the fields to be updated (optional), separated by commas
     parser.add_argument("-f", "--fields", type=str, help="Restrictive list of database fields to be updated, separated by commas, ex: WC_TempAvg,WC_TempHigh,WC_PressureAvg. Default all fields.")    
@@ -320,6 +316,14 @@ def getArgs(argv=None):
     # Optional argument to enable debug mode (no execution)
     parser.add_argument('--noexecute', action='store_true', help="If set, no SQL command will be executed, only printed for debugging.")
 
+    # Range mode: one grouped query and one bulk write per chunk of days
+    parser.add_argument('-R', '--range', action='store_true',
+                        help='Aggregate the whole date range with grouped queries and a bulk upsert instead of day by day')
+    parser.add_argument('--chunk-days', dest='chunk_days', type=int, default=366,
+                        help='Number of days aggregated and written at once in --range mode (default 366)')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Number of days sent per INSERT ... ON DUPLICATE KEY UPDATE statement (default {DEFAULT_CHUNK_SIZE})')
+
     # Options supplémentaires
     parser.add_argument('-d', '--display', action="store_true",
                         help='Only display current conditions')
@@ -332,12 +336,48 @@ def getArgs(argv=None):
 # Chargement des configurations JSON
 # ------------------------------------------------------------------------------
 def load_db_config(config_path, station_key):
-    with open(config_path, 'r') as file:
-        config = json.load(file)
-        if station_key in config['dbConfigs']:
-            return config['dbConfigs'][station_key]
-        else:
-            raise ValueError(f"Station key '{station_key}' not found in configuration file.")
+    return select_stations(load_station_configs(config_path), [station_key])[station_key]
+
+# ------------------------------------------------------------------------------
+# Mise à jour d'une station
+# ------------------------------------------------------------------------------
+def UpdateStation(db_config, start_date, end_date, args, fields_to_update=None):
+    delta = timedelta(days=1)
+    wc = DayWeatherConditions(db_config)
+    print(f"Using configuration for station: {db_config['weatherStation']}")
+
+    if args.range:
+        while start_date <= end_date:
+            chunk_end = min(start_date + timedelta(days=args.chunk_days - 1), end_date)
+            print(f"== {wc.stationID}: processing data from {start_date:%Y-%m-%d} to {chunk_end:%Y-%m-%d} ==")
+
+            days = wc.GetRangeWCFromDB(start_date, chunk_end)
+            if args.display:
+                for DateDash, wcID in days.items():
+                    wc.DisplayWeatherConditions(wcID, DateDash)
+            else:
+                wc.UpsertDayWeatherConditions(days, fields=fields_to_update, noexecute=args.noexecute,
+                                               chunk_size=args.batch_size)
+
+            start_date = chunk_end + delta
+        return
+
+    # Traitement des données
+    while start_date <= end_date:
+        DateDash = start_date.strftime("%Y-%m-%d")
+
+        print(f"== {wc.stationID}: processing data for: {DateDash} ==")
+
+        wcID = wc.GetDayWCFromDB(DateDash)
+
+        if wcID is not None:
+            if args.display:
+                wc.DisplayWeatherConditions(wcID, DateDash)
+            else:
+                wc.InsertDayWeatherConditions(wcID, DateDash, fields=fields_to_update, noexecute=args.noexecute)
+
+        print(wcID)
+        start_date += delta
 
 # ------------------------------------------------------------------------------
 # Main script
@@ -345,24 +385,21 @@ def load_db_config(config_path, station_key):
 if __name__ == "__main__":
     args = getArgs()
 
-    # Déterminer la station sélectionnée
-    station_key = 'db1' if args.Villebon else 'db2'
+    # Déterminer les stations sélectionnées: -V/-B, --station, ou toutes celles du fichier
+    station_keys = list(args.stations or [])
+    if args.Villebon:
+        station_keys.append(VILLEBON_KEY)
+    if args.Bethune:
+        station_keys.append(BETHUNE_KEY)
 
     # Charger la configuration depuis le fichier JSON
-    db_config = load_db_config(args.config_path, station_key)
-
-    print(f"Using configuration for station: {db_config['weatherStation']}")
+    stations = select_stations(load_station_configs(args.config_path), station_keys)
 
     # If fields to update are specified in --fields option, convert to a list
     fields_to_update = args.fields.split(',') if args.fields else None
 
-    # Déterminer les dates
-    today = date.today()
-    yesterday = today - timedelta(days=1)
-
     start_date = args.startdate
     end_date = args.enddate
-    delta = timedelta(days=1)
 
     # Determine the current date and time
     today = datetime.combine(date.today(), datetime.min.time())  # Convert to datetime at midnight
@@ -377,24 +414,9 @@ if __name__ == "__main__":
         raise ValueError(f"Start date ({start_date}) cannot be after end date ({end_date}).")
 
     
-    print(f"Processing weather data from {start_date} to {end_date}...")
-   
-    # Traitement des données
-    while start_date <= end_date:
-        DateDash = start_date.strftime("%Y-%m-%d")
+    print(f"Processing weather data from {start_date} to {end_date} for station(s) {', '.join(stations)}...")
 
-        print(f"== Processing data for: {DateDash} ==")
-
-        # Création de l'instance DayWeatherConditions avec les configurations JSON
-        wc = DayWeatherConditions(db_config)
-
-        wcID = wc.GetDayWCFromDB(DateDash)
-
-        if wcID is not None:
-            if args.display:
-                wc.DisplayWeatherConditions(wcID, DateDash)
-            else:
-                wc.InsertDayWeatherConditions(wcID, DateDash, fields=fields_to_update, noexecute=args.noexecute)
-
-        print(wcID)
-        start_date += delta
\ No newline at end of file
+    # Every station in its own thread: a failing station does not stop the others
+    failed = run_stations(lambda key, db_config: UpdateStation(db_config, start_date, end_date, args, fields_to_update),
+                          stations)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Running daily aggregates of the realtime observations.
+
+For every station and day, DailyAccumulators keeps the count, sum, minimum
+and maximum of each WeatherConditions column feeding DayWeatherConditions,
+plus the sum and count of the solar radiation between sunrise and sunset.
+They are updated as each observation is ingested, so the DayWeatherConditions
+row of the day can be written without rescanning the WeatherConditions rows:
+
+    accumulators = DailyAccumulators('~/.cache/wc_realtime_spool.sqlite')
+    accumulators.add('IVILLE402', WC_COLUMNS, rows, solar_window)
+    wc = accumulators.day_conditions('IVILLE402', '2024-06-01')
+
+The results follow the SQL of DayWeatherConditions.DAY_AGGREGATES: values are
+first quantized to the DECIMAL scale of their WeatherConditions column, as
+MySQL stores them, then summed as decimals and rounded half away from zero, as
+MySQL ROUND does. Observations are accumulated in time order: an observation
+not later than the last one of its day (a repeated poll, a replay) is ignored.
+
+The first time a day is seen, its accumulator is seeded with the rows already
+stored for that day (seed function of add()), so that a collector started in
+the middle of the day, or a fresh spool file, never yields partial-day values.
+A day accumulated without a seed is not reported by day_conditions().
+
+The days changed by add() stay in a dirty set until clean() is called, once
+their DayWeatherConditions rows are written: a failed write is retried by the
+next drain even when no new observation of the day comes.
+"""
+import json
+import os
+import sqlite3
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+# DayWeatherConditions fields: (field, aggregate, WeatherConditions column, rounding digits or None)
+DAY_FIELDS = [
+    ('WC_TempAvg', 'avg', 'WC_temp', 1),
+    ('WC_TempHigh', 'max', 'WC_temp', None),
+    ('WC_TempLow', 'min', 'WC_temp', None),
+    ('WC_DewPointAvg', 'avg', 'WC_dewpt', 1),
+    ('WC_DewPointHigh', 'max', 'WC_dewpt', None),
+    ('WC_DewPointLow', 'min', 'WC_dewpt', None),
+    ('WC_HumidityAvg', 'avg', 'WC_humidity', 0),
+    ('WC_HumidityHigh', 'max', 'WC_humidity', None),
+    ('WC_HumidityLow', 'min', 'WC_humidity', None),
+    ('WC_PressureAvg', 'avg', 'WC_pressure', 1),
+    ('WC_PressureHigh', 'max', 'WC_pressure', 1),
+    ('WC_PressureLow', 'min', 'WC_pressure', 1),
+    ('WC_WindSpeedMax', 'max', 'WC_windSpeed', None),
+    ('WC_GustSpeedMax', 'max', 'WC_windGust', None),
+    ('WC_PrecipitationSum', 'max', 'WC_precipTotal', 1),
+]
+SOLAR_FIELD = ('WC_SolarRadiationAvg', 'avg', 'WC_solarRadiation', 1)
+
+# WeatherConditions columns accumulated
+ACCUMULATED_COLUMNS = list(dict.fromkeys(column for field, aggregate, column, digits in DAY_FIELDS))
+
+# Scale of the WeatherConditions DECIMAL (or INT) columns, see WC_InitWeatherConditionsDB.sh
+COLUMN_SCALES = {
+    'WC_temp': 1,
+    'WC_dewpt': 1,
+    'WC_humidity': 0,
+    'WC_pressure': 2,
+    'WC_windSpeed': 1,
+    'WC_windGust': 1,
+    'WC_precipTotal': 2,
+    'WC_solarRadiation': 1,
+}
+
+
+def _round(value, digits):
+    if value is None or digits is None:
+        return value
+    return value.quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP)
+
+
+def _stored(value, column):
+    # Value as stored in its WeatherConditions column (the wind speeds are floats after the *1.5 conversion)
+    return _round(_decimal(value), COLUMN_SCALES[column])
+
+
+def _decimal(value):
+    return None if value is None else Decimal(str(value))
+
+
+class DailyAccumulators:
+    """Per station-day accumulators, stored in a SQLite table."""
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS day_accumulators (
+                                station TEXT NOT NULL,
+                                day TEXT NOT NULL,
+                                last TEXT NOT NULL,
+                                state TEXT NOT NULL,
+                                PRIMARY KEY (station, day))""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS dirty_days (
+                                station TEXT NOT NULL,
+                                day TEXT NOT NULL,
+                                PRIMARY KEY (station, day))""")
+
+    def _load(self, station, day):
+        row = self._db.execute("SELECT last, state FROM day_accumulators WHERE station = ? AND day = ?",
+                               (station, day)).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, None)
+
+    def add(self, station, columns, rows, solar_window=None, seed=None):
+        """Accumulate observation rows of a station.
+
+        :param columns: WeatherConditions column names of the row values (WC_Datetime first).
+        :param rows: Observation value tuples, in time order.
+        :param solar_window: Function DateDash -> (sunrise, sunset) 'YYYY-MM-DD HH:MM:SS'
+                             local times, None to skip the solar radiation average.
+        :param seed: Function DateDash -> rows (same columns, in time order) already stored
+                     for the day, called the first time a day is seen. None leaves the
+                     new days unseeded: day_conditions() ignores them.
+        :return: Sorted list of the days whose accumulators changed, added to the dirty days.
+        """
+        index = {column: position for position, column in enumerate(columns)}
+        changed = {}
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for row in rows:
+                    observed = str(row[index['WC_Datetime']])
+                    day = observed[:10]
+                    if day in changed:
+                        last, state = changed[day]
+                    else:
+                        last, state = self._load(station, day)
+                    fresh = False
+                    if state is None or (seed is not None and not state.get('seeded')):
+                        # First sight of the day: start from the rows already stored
+                        state = {'columns': {column: [0, '0', None, None] for column in ACCUMULATED_COLUMNS},
+                                 'solar': [0, '0'], 'window': list(solar_window(day)) if solar_window else None,
+                                 'seeded': seed is not None}
+                        last = ''
+                        for stored in (seed(day) if seed is not None else []):
+                            last = self._accumulate(state, index, stored)
+                        fresh = True
+                    if observed <= last:
+                        # Already accumulated (or older than the last observation of the day)
+                        if fresh:
+                            changed[day] = (last, state)
+                        continue
+
+                    self._accumulate(state, index, row)
+                    changed[day] = (observed, state)
+
+                self._db.executemany("INSERT OR REPLACE INTO day_accumulators (station, day, last, state) VALUES (?, ?, ?, ?)",
+                                     [(station, day, last, json.dumps(state)) for day, (last, state) in changed.items()])
+                self._db.executemany("INSERT OR IGNORE INTO dirty_days (station, day) VALUES (?, ?)",
+                                     [(station, day) for day in changed])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return sorted(changed)
+
+    @staticmethod
+    def _accumulate(state, index, row):
+        # Add one observation row to the state of its day, returns its WC_Datetime
+        observed = str(row[index['WC_Datetime']])
+        for column in ACCUMULATED_COLUMNS:
+            value = _stored(row[index[column]], column)
+            if value is None:
+                continue
+            count, total, minimum, maximum = state['columns'][column]
+            state['columns'][column] = [count + 1, str(Decimal(total) + value),
+                                        str(value) if minimum is None or value < Decimal(minimum) else minimum,
+                                        str(value) if maximum is None or value > Decimal(maximum) else maximum]
+        solar = _stored(row[index['WC_solarRadiation']], 'WC_solarRadiation')
+        if state['window'] and solar is not None and state['window'][0] <= observed <= state['window'][1]:
+            state['solar'] = [state['solar'][0] + 1, str(Decimal(state['solar'][1]) + solar)]
+        return observed
+
+    def dirty_days(self, station):
+        """Sorted days of the station changed since their last clean()."""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT day FROM dirty_days WHERE station = ? ORDER BY day",
+                                                       (station,)).fetchall()]
+
+    def clean(self, station, days):
+        """Remove days from the dirty days of the station, once their aggregates are written."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("DELETE FROM dirty_days WHERE station = ? AND day = ?", [(station, day) for day in days])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def day_conditions(self, station, day):
+        """DayWeatherConditions fields of the day, None when nothing was accumulated
+        or when the accumulator of the day was not seeded with the stored rows."""
+        with self._lock:
+            last, state = self._load(station, day)
+        if state is None or not state.get('seeded'):
+            return None
+
+        wc = {}
+        for field, aggregate, column, digits in DAY_FIELDS:
+            count, total, minimum, maximum = state['columns'][column]
+            if aggregate == 'avg':
+                value = Decimal(total) / count if count else None
+            else:
+                value = _decimal(maximum if aggregate == 'max' else minimum)
+            wc[field] = _round(value, digits)
+        count, total = state['solar']
+        wc[SOLAR_FIELD[0]] = _round(Decimal(total) / count, SOLAR_FIELD[3]) if count else None
+        return wc
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def compare_conditions(live, recomputed):
+    """Fields whose live and recomputed values differ, as {field: (live, recomputed)}."""
+    differences = {}
+    for field in [entry[0] for entry in DAY_FIELDS] + [SOLAR_FIELD[0]]:
+        live_value, full_value = (live or {}).get(field), (recomputed or {}).get(field)
+        if _decimal(live_value) != _decimal(full_value):
+            differences[field] = (live_value, full_value)
+    return differences
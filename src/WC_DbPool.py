@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Shared MySQL connection pool for the weather scripts.
+
+The scripts used to open a new pymysql connection for each query or each
+day processed, paying TCP, authentication and DESCRIBE costs thousands of
+times in long backfills. A ConnectionPool keeps the connections open and
+lends them to the callers:
+
+    pool = get_pool(host, user, password, database)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(...)
+
+- Idle connections are checked with a ping (and reconnected) before reuse.
+- A connection raising pymysql OperationalError (server gone away, lost
+  connection, ...) is discarded: the next borrower gets a fresh connection.
+- table_columns() caches the DESCRIBE result of each table.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql.cursors
+
+# Pools already created, keyed by server, user, database and cursor class
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Pool of pymysql connections to one MySQL database."""
+
+    def __init__(self, host, user, password, database, max_idle=4, ping_interval=60,
+                 cursorclass=pymysql.cursors.DictCursor, autocommit=True):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.max_idle = max_idle                # Connections kept open when not borrowed
+        self.ping_interval = ping_interval      # Idle seconds after which a connection is pinged before reuse
+        self.cursorclass = cursorclass
+        self.autocommit = autocommit
+
+        self._idle = []                         # (connection, last use time)
+        self._lock = threading.Lock()
+        self._columns = {}                      # Schema cache: {table: [column names]}
+
+    def _connect(self):
+        return pymysql.connect(host=self.host,
+                               user=self.user,
+                               password=self.password,
+                               db=self.database,
+                               charset='utf8mb4',
+                               cursorclass=self.cursorclass,
+                               autocommit=self.autocommit)
+
+    def acquire(self):
+        """Borrow a healthy connection, reusing an idle one when possible."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, last_use = self._idle.pop()
+
+            if time.monotonic() - last_use < self.ping_interval:
+                return connection
+            try:
+                # Health check of a connection idle for a while
+                connection.ping(reconnect=True)
+                return connection
+            except pymysql.err.Error:
+                self._discard(connection)
+
+        return self._connect()
+
+    def release(self, connection):
+        """Give a borrowed connection back to the pool."""
+        with self._lock:
+            if len(self._idle) < self.max_idle and connection.open:
+                self._idle.append((connection, time.monotonic()))
+                return
+        self._discard(connection)
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except pymysql.err.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Context manager lending a connection.
+
+        On OperationalError the connection is dropped instead of being
+        returned, so that the next borrower reconnects.
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        except pymysql.err.OperationalError:
+            self._discard(connection)
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def table_columns(self, table, connection=None):
+        """Column names of a table, from DESCRIBE run once per pool."""
+        if table not in self._columns:
+            with (self.connection() if connection is None else _borrowed(connection)) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"DESCRIBE `{table}`")
+                    rows = cursor.fetchall()
+            self._columns[table] = [row['Field'] if isinstance(row, dict) else row[0] for row in rows]
+        return self._columns[table]
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, last_use in idle:
+            self._discard(connection)
+
+
+@contextmanager
+def _borrowed(connection):
+    # A connection already held by the caller, used as is
+    yield connection
+
+
+def get_pool(host, user, password, database, cursorclass=pymysql.cursors.DictCursor, **options):
+    """Return the pool of the database, creating it at first use."""
+    key = (host, user, password, database, cursorclass)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(host, user, password, database, cursorclass=cursorclass, **options)
+        return _pools[key]
+
+
+def close_pools():
+    """Close the idle connections of every pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Bulk upsert writer shared by the weather database scripts.
+
+The writers used to SELECT each row by its key, then run an INSERT or an
+UPDATE: two round-trips per row, and a race when two cron jobs write the
+same day. upsert_rows writes the rows with a single
+INSERT ... ON DUPLICATE KEY UPDATE run through executemany, which pymysql
+sends as one multi-row statement per chunk:
+
+    counts = upsert_rows(connection, 'DayWeatherConditions', 'WC_Date',
+                         columns, rows, update_columns=['WC_TempAvg'])
+
+- New rows get every column, existing rows only the update_columns
+  (default: every column but the key; [] keeps existing rows untouched).
+- The result gives the rows written and the affected rows reported by MySQL:
+  1 per insert, 2 per changed row and 0 per unchanged row. With
+  count_existing, the keys already present are counted beforehand (one more
+  query per chunk) to split them into inserted, updated and unchanged rows.
+"""
+
+# Rows sent in one statement by default
+DEFAULT_CHUNK_SIZE = 500
+
+
+def check_fields(fields, valid_columns):
+    """Raise ValueError if some of the fields are not columns of the table."""
+    invalid_fields = [field for field in fields if field not in valid_columns]
+    if invalid_fields:
+        raise ValueError(f"Invalid fields: {', '.join(invalid_fields)}")
+
+
+def upsert_query(table, key_column, columns, update_columns=None):
+    """Build the INSERT ... ON DUPLICATE KEY UPDATE statement of one row."""
+    if update_columns is None:
+        update_columns = [column for column in columns if column != key_column]
+    # With nothing to update, the key is assigned to itself: existing rows are left unchanged
+    assignments = [f"`{column}` = VALUES(`{column}`)" for column in update_columns] or [f"`{key_column}` = `{key_column}`"]
+    return f"""INSERT INTO `{table}` ({', '.join(f'`{column}`' for column in columns)})
+               VALUES ({', '.join(['%s'] * len(columns))})
+               ON DUPLICATE KEY UPDATE {', '.join(assignments)}"""
+
+
+def upsert_rows(connection, table, key_column, columns, rows, update_columns=None,
+                chunk_size=DEFAULT_CHUNK_SIZE, noexecute=False, count_existing=False):
+    """Insert or update the rows of a table, chunk_size rows per round-trip.
+
+    :param connection: Open pymysql connection.
+    :param table: Table name.
+    :param key_column: Unique key column of the table, which must be part of columns.
+    :param columns: Column names, in the order of the row values.
+    :param rows: Sequence of value tuples.
+    :param update_columns: Columns updated on existing rows, default all but the key.
+    :param chunk_size: Number of rows written per statement.
+    :param noexecute: Only print the statement and the values.
+    :param count_existing: Also count the 'inserted', 'updated' and 'unchanged' rows,
+                           at the cost of a SELECT COUNT(*) per chunk (not atomic
+                           with the upsert when other writers run concurrently).
+    :return: Dictionary of the 'written' and 'affected' row counts, and with
+             count_existing of the 'inserted', 'updated' and 'unchanged' ones.
+    """
+    counts = {'written': 0, 'affected': 0}
+    if count_existing:
+        counts.update(inserted=0, updated=0, unchanged=0)
+    rows = list(rows)
+    if not rows:
+        return counts
+
+    sql = upsert_query(table, key_column, columns, update_columns)
+    if noexecute:
+        # Debug mode: Print the SQL query and values instead of executing it
+        print("[DEBUG] SQL for UPSERT:", sql)
+        for row in rows:
+            print("[DEBUG] Values:", tuple(row))
+        return counts
+
+    key_index = columns.index(key_column)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            if count_existing:
+                # Keys already present, to tell the inserted rows from the others
+                keys = [row[key_index] for row in chunk]
+                cursor.execute(f"SELECT COUNT(*) AS existing FROM `{table}` WHERE `{key_column}` IN ({', '.join(['%s'] * len(keys))})",
+                               keys)
+                result = cursor.fetchone()
+                existing = int(result['existing'] if isinstance(result, dict) else result[0])
+
+            cursor.executemany(sql, chunk)
+            counts['written'] += len(chunk)
+            counts['affected'] += cursor.rowcount
+            if count_existing:
+                inserted = len(chunk) - existing
+                updated = (cursor.rowcount - inserted) // 2
+                counts['inserted'] += inserted
+                counts['updated'] += updated
+                counts['unchanged'] += existing - updated
+    connection.commit()
+
+    if count_existing:
+        print(f"{len(rows)} row(s) written to {table}: {counts['inserted']} inserted, "
+              f"{counts['updated']} updated, {counts['unchanged']} unchanged")
+    else:
+        print(f"{len(rows)} row(s) written to {table}: {counts['affected']} affected row(s)")
+    return counts
@@ -1,8 +1,15 @@
 #!/usr/bin/python3
 import json
 import argparse
+import numpy as np
 import pymysql
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from WC_NormalsQuery import check_index_usage, period_predicate
 
 # Load configuration from JSON file
 def load_config(config_path):
@@ -86,46 +93,264 @@ def create_normals_table(cursor, table_name, force_recreate):
     )'''
     cursor.execute(create_table_query)
 
-# Compute climate normals based on the cross-reference configuration only
-def compute_normals(cursor, source_table, crossref, period):
-    """
-    Generates a SQL query to compute climate normals using only the mappings 
-    from the provided cross-reference configuration.
-
-    :param cursor: Database cursor object for executing queries.
-    :param source_table: Name of the source table in the database.
-    :param crossref: Dictionary mapping destination fields to their corresponding SQL expressions.
-    :param period: Dictionary containing the start and end years for the computation.
-    :return: List of rows containing computed climate normals.
-    """
-
+# SQL query of the climate normals, from the cross-reference configuration only
+def normals_query(source_table, crossref, period):
     # Construct the SQL select clause based on the crossref configuration
     select_fields = ", ".join([f"{expr} AS {field}" for field, expr in crossref.items()])
 
-    query = f'''
+    return f'''
     SELECT DATE_FORMAT(Date, '%m-%d') AS DayOfYear, {select_fields}
     FROM {source_table}
-    WHERE YEAR(Date) BETWEEN {period['start_year']} AND {period['end_year']}
+    WHERE {period_predicate('Date', period['start_year'], period['end_year'])}
     GROUP BY DayOfYear
     '''
-    
-    cursor.execute(query)
-    return cursor.fetchall()
 
+# INSERT statement of the normals rows, with an explicit column list
+def insert_query(table_name, columns):
+    return f"INSERT INTO {table_name} ({', '.join(f'`{column}`' for column in columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+# Stream the normals from the source server into the destination table
+def transfer_normals(src_conn, dest_conn, source_table, table_name, crossref, period, explain=False,
+                     chunk_size=100, queue_size=4):
+    """
+    Pipelined copy of the computed normals: the rows are fetched from an
+    unbuffered source cursor by chunks of chunk_size and handed through a
+    queue of queue_size chunks to a writer thread, which inserts each chunk
+    with one multi-row INSERT while the next one is fetched.
+
+    :return: Dictionary of the time spent in each stage, in seconds.
+    """
+    columns = ['DayOfYear'] + list(crossref)
+    query = normals_query(source_table, crossref, period)
+    chunks = queue.Queue(maxsize=queue_size)
+    timings = {'source query': 0.0, 'source fetch': 0.0, 'queue full': 0.0,
+               'writer idle': 0.0, 'destination insert': 0.0, 'destination commit': 0.0}
+    errors = []
+    rows_written = [0]
+
+    def writer():
+        try:
+            with dest_conn.cursor() as dest_cursor:
+                sql = insert_query(table_name, columns)
+                while True:
+                    started = time.monotonic()
+                    chunk = chunks.get()
+                    timings['writer idle'] += time.monotonic() - started
+                    if chunk is None:
+                        return
+                    started = time.monotonic()
+                    dest_cursor.executemany(sql, chunk)
+                    timings['destination insert'] += time.monotonic() - started
+                    rows_written[0] += len(chunk)
+        except Exception as e:
+            errors.append(e)
+            # The reader is not blocked on a full queue: the chunks left are dropped
+            while chunks.get() is not None:
+                pass
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    total = time.monotonic()
+    try:
+        with src_conn.cursor(pymysql.cursors.SSDictCursor) as src_cursor:
+            if explain:
+                check_index_usage(src_cursor, query)
+            started = time.monotonic()
+            src_cursor.execute(query)
+            timings['source query'] = time.monotonic() - started
+            while not errors:
+                started = time.monotonic()
+                rows = src_cursor.fetchmany(chunk_size)
+                timings['source fetch'] += time.monotonic() - started
+                if not rows:
+                    break
+                started = time.monotonic()
+                chunks.put([tuple(row[column] for column in columns) for row in rows])
+                timings['queue full'] += time.monotonic() - started
+    finally:
+        chunks.put(None)
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    started = time.monotonic()
+    dest_conn.commit()
+    timings['destination commit'] = time.monotonic() - started
+    timings['total'] = time.monotonic() - total
+    print(f"{rows_written[0]} row(s) transferred to {table_name}: "
+          + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items()))
+    return timings
+
+# Recompute and upsert only the DayOfYear rows whose source days changed
+def refresh_normals(src_conn, dest_conn, source_table, table_name, crossref, period, state_file):
+    """
+    Incremental update of the normals table from the per day-of-year statistics
+    of state_file (see WC_NormalsDayStats): only the years changed since the
+    last run are read from the source table, and only the MM-DD rows whose
+    statistics changed are written.
+
+    :return: List of the DayOfYear values written or deleted.
+    """
+    from WC_DbWriter import upsert_rows
+    from WC_NormalsDayStats import DayOfYearStats, parse_crossref
+
+    parsed = parse_crossref(crossref)
+    stats = DayOfYearStats(state_file, source_table, period['start_year'], period['end_year'])
+    changed = stats.refresh(src_conn, parsed)
+
+    with dest_conn.cursor() as dest_cursor:
+        # Rows missing from the destination (new or recreated table) are written as well
+        dest_cursor.execute(f"SELECT DayOfYear FROM {table_name}")
+        existing = {row['DayOfYear'] for row in dest_cursor.fetchall()}
+        days = sorted(set(changed) | (set(stats.days()) - existing))
+
+        rows = stats.normals(parsed, days)
+        # MM-DD without any day left in the period disappear, as with a full generation
+        removed = sorted(set(days) - {row['DayOfYear'] for row in rows})
+        if removed:
+            dest_cursor.execute(f"DELETE FROM {table_name} WHERE DayOfYear IN ({', '.join(['%s'] * len(removed))})", removed)
+
+    if rows:
+        columns = ['DayOfYear'] + list(parsed)
+        upsert_rows(dest_conn, table_name, 'DayOfYear', columns, [tuple(row[column] for column in columns) for row in rows])
+    dest_conn.commit()
+
+    # Saved once the normals are committed: an interrupted run is redone next time
+    stats.save()
+    return days
+
+
+# Days of the year of the normals tables, in calendar order (February 29 included)
+DAYS_OF_YEAR = [f"{month:02d}-{day:02d}" for month in range(1, 13)
+                for day in range(1, [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month - 1] + 1)]
+
+# Prefix of the smoothed copy of a normals column
+SMOOTH_PREFIX = "Smooth"
+
+# Circular moving average over the days of the year
+def circular_moving_average(values, window):
+    """
+    Centered moving average of window days of each column of values, a
+    (366, fields) array in DAYS_OF_YEAR order, wrapping around the year end.
+    NaN (NULL) values are ignored; a window without any value gives NaN.
+    """
+    half = window // 2
+    valid = ~np.isnan(values)
+    # Running sums over the year extended by half a window on each side
+    padded_values = np.concatenate([values[-half:], values, values[:half]]) if half else values
+    padded_valid = np.concatenate([valid[-half:], valid, valid[:half]]) if half else valid
+    sums = np.cumsum(np.vstack([np.zeros((1, values.shape[1])), np.where(padded_valid, padded_values, 0.0)]), axis=0)
+    counts = np.cumsum(np.vstack([np.zeros((1, values.shape[1])), padded_valid]), axis=0)
+    window_sums = sums[window:] - sums[:-window]
+    window_counts = counts[window:] - counts[:-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(window_counts > 0, window_sums / window_counts, np.nan)
+
+# Smoothed columns of the normals table, stored next to the raw ones
+def smooth_normals(dest_conn, table_name, fields, window):
+    """
+    Adds (if needed) a Smooth<field> column for each field and fills it with the
+    circular moving average of window days of the field, computed once for the
+    366 days of the year, so that the readers of the table do not smooth the
+    normals themselves.
+    """
+    from WC_DbWriter import upsert_rows
+    from WC_NormalsQuery import table_columns
+
+    if window < 1 or window % 2 == 0 or window > len(DAYS_OF_YEAR):
+        raise ValueError(f"The smoothing window must be an odd number of days between 1 and {len(DAYS_OF_YEAR)}: {window}")
+    smooth_fields = [SMOOTH_PREFIX + field for field in fields]
+
+    with dest_conn.cursor() as dest_cursor:
+        existing = table_columns(dest_cursor, table_name)
+        for smooth_field in smooth_fields:
+            if smooth_field not in existing:
+                dest_cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN `{smooth_field}` DECIMAL(6,1) NULL")
+        dest_cursor.execute(f"SELECT DayOfYear, {', '.join(f'`{field}`' for field in fields)} FROM {table_name}")
+        rows = {row['DayOfYear']: row for row in dest_cursor.fetchall()}
+
+    values = np.full((len(DAYS_OF_YEAR), len(fields)), np.nan)
+    for position, day in enumerate(DAYS_OF_YEAR):
+        if day in rows:
+            values[position] = [np.nan if rows[day][field] is None else float(rows[day][field]) for field in fields]
+    smoothed = np.round(circular_moving_average(values, window), 1)
+
+    updates = [tuple([day] + [None if np.isnan(value) else float(value) for value in smoothed[position]])
+               for position, day in enumerate(DAYS_OF_YEAR) if day in rows]
+    upsert_rows(dest_conn, table_name, 'DayOfYear', ['DayOfYear'] + smooth_fields, updates, update_columns=smooth_fields)
+
+# Fields smoothed by default: the averages of the crossref
+def default_smooth_fields(crossref):
+    return [field for field in crossref if field.startswith("Avg")]
+
+# Name of the normals table of a period
+def period_table_name(destination_db, period):
+    return destination_db["table"].replace("<year_start>", str(period["start_year"]))\
+                                  .replace("<year_end>", str(period["end_year"]))
+
+# Write the normals rows of one period table, on its own connection
+def write_period_table(destination_db, table_name, columns, rows, force_recreate, smooth=None):
+    from WC_DbWriter import upsert_rows
+
+    dest_conn = connect_to_db(destination_db)
+    try:
+        with dest_conn.cursor() as dest_cursor:
+            create_normals_table(dest_cursor, table_name, force_recreate)
+        upsert_rows(dest_conn, table_name, 'DayOfYear', columns, [tuple(row[column] for column in columns) for row in rows])
+        if smooth:
+            smooth_normals(dest_conn, table_name, *smooth)
+        dest_conn.commit()
+    finally:
+        dest_conn.close()
+    return len(rows)
+
+# Generate the normals tables of several periods from one scan of the source table
+def generate_period_tables(src_conn, destination_db, source_table, crossref, periods, force_recreate, explain=False,
+                           smooth=None):
+    """
+    Reads the per year and MM-DD statistics of the source columns once, over
+    the years of all the periods (one GROUP BY Year, DayOfYear query), derives
+    the day-of-year normals of each period from them, and writes the period
+    tables in parallel, one connection each.
+
+    :param smooth: (fields, window) of the smoothed columns (see smooth_normals), None for none.
+    :return: Dictionary {table name: number of rows written or exception}.
+    """
+    from WC_NormalsDayStats import day_normals, grouped_day_statistics, parse_crossref, source_columns
+
+    parsed = parse_crossref(crossref)
+    with src_conn.cursor() as src_cursor:
+        years = grouped_day_statistics(src_cursor, source_table, source_columns(parsed),
+                                       min(period["start_year"] for period in periods),
+                                       max(period["end_year"] for period in periods), explain=explain)
+
+    columns = ['DayOfYear'] + list(parsed)
+    tables = {period_table_name(destination_db, period):
+              day_normals(years, parsed, year_start=period["start_year"], year_end=period["end_year"])
+              for period in periods}
+
+    def write(table_name):
+        try:
+            return write_period_table(destination_db, table_name, columns, tables[table_name], force_recreate, smooth)
+        except Exception as e:
+            print(f"Failed to write {table_name}: {e!r}")
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+        return dict(zip(tables, executor.map(write, tables)))
 
-# Insert computed data into the destination table
-def insert_normals(cursor, table_name, data):
-    if not data:
-        return
-    placeholders = ", ".join(["%s"] * len(data[0]))
-    query = f"INSERT INTO {table_name} VALUES ({placeholders})"
-    cursor.executemany(query, [tuple(row.values()) for row in data])
 
 # Main function
 def main():
     parser = argparse.ArgumentParser(description="Generate climate normals table")
     parser.add_argument("--config", required=True, help="Path to the JSON configuration file")
     parser.add_argument("--force", action="store_true", help="Force recreation of the table if it exists")
+    parser.add_argument("--explain", action="store_true", help="Print the EXPLAIN plan of the source query and warn if the Date index is not used")
+    parser.add_argument("--chunk_size", type=int, default=100, help="Number of rows fetched from the source and inserted at once (default 100)")
+    parser.add_argument("--queue_size", type=int, default=4, help="Number of chunks buffered between the source and the destination (default 4)")
+    parser.add_argument("--incremental", metavar="STATE_FILE", help="Per day-of-year statistics file of the table; only the DayOfYear rows whose source days changed since the last run are recomputed and upserted")
+    parser.add_argument("--smooth", type=int, metavar="DAYS", help="Also store the circular moving average of DAYS days (odd) of the normals in Smooth<field> columns")
+    parser.add_argument("--smooth_fields", help="Comma separated fields smoothed with --smooth (default the Avg* fields of the crossref)")
     args = parser.parse_args()
     
     config = load_config(args.config)
@@ -133,21 +358,64 @@ def main():
     
     source_db = config["source_db"]
     destination_db = config["destination_db"]
-    period = config["period"]
     crossref = config["crossref"]
-    
-    table_name = destination_db["table"].replace("<year_start>", str(period["start_year"]))\
-                                  .replace("<year_end>", str(period["end_year"]))
+
+    if args.smooth_fields and args.smooth is None:
+        parser.error("--smooth_fields needs --smooth")
+    smooth = None
+    if args.smooth is not None:
+        # The window is checked by smooth_normals
+        smooth = (args.smooth_fields.split(",") if args.smooth_fields else default_smooth_fields(crossref), args.smooth)
+
+    # Several periods: one scan of the source for all the tables
+    if "periods" in config:
+        if args.incremental:
+            parser.error("--incremental works on a single period")
+        if not config["periods"]:
+            parser.error(f"no period in the 'periods' list of {args.config}")
+        # Each period needs its own table: the name template must tell them apart
+        table_names = [period_table_name(destination_db, period) for period in config["periods"]]
+        duplicates = sorted({name for name in table_names if table_names.count(name) > 1})
+        if duplicates:
+            parser.error(f"several periods of {args.config} are written to the same table ({', '.join(duplicates)}): "
+                         f"check the periods and the <year_start>/<year_end> placeholders of the destination table")
+        src_conn = connect_to_db(source_db)
+        try:
+            results = generate_period_tables(src_conn, destination_db, source_db["table"], crossref,
+                                             config["periods"], force_recreate, args.explain, smooth)
+        finally:
+            src_conn.close()
+        for table_name, result in results.items():
+            print(f"{table_name}: " + (f"FAILED ({result!r})" if isinstance(result, Exception) else f"{result} day(s) of the year"))
+        if any(isinstance(result, Exception) for result in results.values()):
+            raise SystemExit(1)
+        return
+
+    period = config["period"]
+    table_name = period_table_name(destination_db, period)
     
     src_conn = connect_to_db(source_db)
     dest_conn = connect_to_db(destination_db)
     
     try:
-        with src_conn.cursor() as src_cursor, dest_conn.cursor() as dest_cursor:
+        if args.incremental:
+            if force_recreate and os.path.exists(args.incremental):
+                os.remove(args.incremental)
+            with dest_conn.cursor() as dest_cursor:
+                create_normals_table(dest_cursor, table_name, force_recreate)
+            days = refresh_normals(src_conn, dest_conn, source_db["table"], table_name, crossref, period, args.incremental)
+            print(f"Climate normals of {len(days)} day(s) of the year refreshed in {table_name}")
+            if smooth and days:
+                smooth_normals(dest_conn, table_name, *smooth)
+                dest_conn.commit()
+            return
+
+        with dest_conn.cursor() as dest_cursor:
             create_normals_table(dest_cursor, table_name, force_recreate)
-            data = compute_normals(src_cursor, source_db["table"], crossref, period)
-            if data:
-                insert_normals(dest_cursor, table_name, data)
+        transfer_normals(src_conn, dest_conn, source_db["table"], table_name, crossref, period,
+                         args.explain, args.chunk_size, args.queue_size)
+        if smooth:
+            smooth_normals(dest_conn, table_name, *smooth)
             dest_conn.commit()
     finally:
         src_conn.close()
@@ -3,145 +3,291 @@ import argparse
 import pymysql
 import json
 import calendar
+import numpy as np
 from collections import defaultdict
 from decimal import Decimal
 from datetime import datetime, date
 
-def calculate_average(data, column_name, precision=1):
-    values = [row[column_name] for row in data if row[column_name] is not None]
-    return round(sum(values) / len(values), precision) if values else None
-
-def find_max_with_dates(data, column_name):
-    max_value = max(entry[column_name] if entry[column_name] is not None else float('-inf') for entry in data)
-    max_entries = [{'Date': str(entry['Date']), 'Value': str(entry[column_name])} for entry in data if entry[column_name] == max_value]    
-    return max_entries
-
-def find_min_with_dates(data, column_name):
-    # Extract the minimum value using the lambda function
-    min_value = min(data, key=lambda x: x[column_name] if x[column_name] is not None else float('inf'))[column_name]
-
-    # Extract all entries with the minimum value
-    min_entries = [{'Date': str(entry['Date']), 'Value': str(entry[column_name])} for entry in data if entry[column_name] == min_value]
-
-    return min_entries
-
-def calculate_average_days_precipitation(data, precipitation_range):
-    days_precipitation_by_year = {}
-    for row in data:
-        year = row['Date'].year
-        if year not in days_precipitation_by_year:
-            days_precipitation_by_year[year] = 0
-        if row['PrecipitationSum'] is not None and precipitation_range[0] <= row['PrecipitationSum'] < precipitation_range[1]:
-            days_precipitation_by_year[year] += 1
-
-    avg_days_precipitation = round(sum(days_precipitation_by_year.values()) / len(days_precipitation_by_year))
-    return avg_days_precipitation
-
-def calculate_yearly_average_precipitation(data):
-    yearly_precipitation = {}
-
-    for row in data:
-        year = row['Date'].year
-        if year not in yearly_precipitation:
-            yearly_precipitation[year] = 0
-        
-        if row['PrecipitationSum'] is not None:
-            yearly_precipitation[year] += row['PrecipitationSum']
-
-    total_precipitation = sum(yearly_precipitation.values())
-    total_years = len(yearly_precipitation)
-
-    yearly_average_precipitation = round(total_precipitation / total_years, 1) if total_years > 0 else None
-
-    return yearly_average_precipitation
-
-def calculate_average_days_temp_avg(data, temp_avg_range):
-    days_temp_avg_by_year = {}
-    for row in data:
-        year = row['Date'].year
-        if year not in days_temp_avg_by_year:
-            days_temp_avg_by_year[year] = 0
-        if row['TempAvg'] is not None and temp_avg_range[0] <= row['TempAvg'] <= temp_avg_range[1]:
-            days_temp_avg_by_year[year] += 1
-
-    avg_days_temp_avg = round(sum(days_temp_avg_by_year.values()) / len(days_temp_avg_by_year))
-    return avg_days_temp_avg
-
-def calculate_average_days_temp_high(data, temp_high_range):
-    days_temp_high_by_year = {}
-    for row in data:
-        year = row['Date'].year
-        if year not in days_temp_high_by_year:
-            days_temp_high_by_year[year] = 0
-        if row['TempHigh'] is not None and temp_high_range[0] <= row['TempHigh'] <= temp_high_range[1]:
-            days_temp_high_by_year[year] += 1
-
-    avg_days_temp_high = round(sum(days_temp_high_by_year.values()) / len(days_temp_high_by_year))
-    return avg_days_temp_high
-
-def calculate_average_days_temp_low(data, temp_low_range):
-    days_temp_low_by_year = {}
-    for row in data:
-        year = row['Date'].year
-        if year not in days_temp_low_by_year:
-            days_temp_low_by_year[year] = 0
-        if row['TempLow'] is not None and temp_low_range[0] < row['TempLow'] <= temp_low_range[1]:
-            days_temp_low_by_year[year] += 1
-
-    avg_days_temp_low = round(sum(days_temp_low_by_year.values()) / len(days_temp_low_by_year))
-    return avg_days_temp_low
-
-def calculate_monthly_normals(data, month, column_name):
-    monthly_data = [entry[column_name] for entry in data if entry['Date'].month == month and entry[column_name] is not None]
-    return round(sum(monthly_data) / len(monthly_data), 1) if monthly_data else None
-
-def calculate_average_monthly(data, month, column_name):
-    monthly_data = [entry[column_name] for entry in data if entry['Date'].month == month and entry[column_name] is not None]
-    return round(sum(monthly_data) / len(monthly_data), 1) if monthly_data else None
-
-
-def calculate_monthly_max_min(data, month, column_name):
-    monthly_entries = [entry for entry in data if entry['Date'].month == month]
-    max_value = max(monthly_entries, key=lambda x: x[column_name] if x[column_name] is not None else float('-inf'))[column_name]
-    min_value = min(monthly_entries, key=lambda x: x[column_name] if x[column_name] is not None else float('inf'))[column_name]
-    return {'Max': max_value, 'Min': min_value}
-
-def generate_monthly_normals(data):
+from WC_NormalsQuery import check_index_usage, grouped_aggregates_query, period_predicate, table_columns
+
+# Columns of the daily table, in the order returned by "SELECT * FROM {table}"
+DAILY_COLUMNS = ['Date', 'TempAvg', 'TempHigh', 'TempLow',
+                 'DewPointAvg', 'DewPointHigh', 'DewPointLow',
+                 'HumidityAvg', 'HumidityHigh', 'HumidityLow',
+                 'PressureAvg', 'PressureHigh', 'PressureLow',
+                 'WindSpeedMax', 'GustSpeedMax', 'PrecipitationSum']
+
+# Threshold days counted per year, in the order they appear in the JSON output.
+# Each entry is (key, column, low, high, bounds) where bounds tells which ends
+# of the range are inclusive: '[]' low <= v <= high, '(]' low < v <= high,
+# '[)' low <= v < high.
+THRESHOLD_DAYS = [
+    ('Avg_Days_TempLow_minus5', 'TempLow', float('-inf'), -5, '(]'),
+    ('Avg_Days_TempLow_0', 'TempLow', float('-inf'), 0, '(]'),
+    ('Avg_Days_TempLow_0_5', 'TempLow', 0.01, 4.99, '(]'),
+    ('Avg_Days_TempLow_5_10', 'TempLow', 5, 9.99, '(]'),
+    ('Avg_Days_TempLow_10_15', 'TempLow', 10, 14.99, '(]'),
+    ('Avg_Days_TempLow_15_20', 'TempLow', 15, 19.99, '(]'),
+    ('Avg_Days_TempLow_20', 'TempLow', 20, float('inf'), '(]'),
+    ('Avg_Days_TempHigh_0', 'TempHigh', float('-inf'), 0, '[]'),
+    ('Avg_Days_TempHigh_30', 'TempHigh', 30, float('inf'), '[]'),
+    ('Avg_Days_TempHigh_0_5', 'TempHigh', 0.01, 4.99, '[]'),
+    ('Avg_Days_TempHigh_5_10', 'TempHigh', 5, 9.99, '[]'),
+    ('Avg_Days_TempHigh_10_15', 'TempHigh', 10, 14.99, '[]'),
+    ('Avg_Days_TempHigh_15_20', 'TempHigh', 15, 19.99, '[]'),
+    ('Avg_Days_TempHigh_20', 'TempHigh', 20, float('inf'), '[]'),
+    ('Avg_Days_TempAvg_0', 'TempAvg', float('-inf'), 0, '[]'),
+    ('Avg_Days_TempAvg_25', 'TempAvg', 25, float('inf'), '[]'),
+    ('Avg_Days_TempAvg_0_5', 'TempAvg', 0.01, 4.99, '[]'),
+    ('Avg_Days_TempAvg_5_10', 'TempAvg', 5, 9.99, '[]'),
+    ('Avg_Days_TempAvg_10_15', 'TempAvg', 10, 14.99, '[]'),
+    ('Avg_Days_TempAvg_15_20', 'TempAvg', 15, 19.99, '[]'),
+    ('Avg_Days_TempAvg_20', 'TempAvg', 20, float('inf'), '[]'),
+    ('Avg_Days_Precipitation_1', 'PrecipitationSum', 1, float('inf'), '[)'),
+    ('Avg_Days_Precipitation_0', 'PrecipitationSum', 0.1, float('inf'), '[)'),
+    ('Avg_Days_Precipitation_1_5', 'PrecipitationSum', 1, 4.99, '[)'),
+    ('Avg_Days_Precipitation_5_10', 'PrecipitationSum', 5, 9.99, '[)'),
+    ('Avg_Days_Precipitation_10', 'PrecipitationSum', 10, float('inf'), '[)'),
+    ('Avg_Days_Precipitation_20', 'PrecipitationSum', 20, float('inf'), '[)'),
+]
+
+
+class DailyColumns:
+    """Columnar view of a daily weather table.
+
+    Every column is loaded once into a float64 NumPy array where NULL values
+    are stored as NaN, so that the statistics below can be computed with
+    vectorized masks instead of looping over a list of dictionaries.
+    The Date column is kept as datetime64[D] with derived year/month arrays.
+    """
+
+    def __init__(self, dates, values):
+        self.dates = dates
+        self.values = values
+        self.years = dates.astype('datetime64[Y]').astype(int) + 1970
+        self.months = dates.astype('datetime64[M]').astype(int) % 12 + 1
+
+    @classmethod
+    def from_rows(cls, rows):
+        # Transpose the rows once: one tuple per column
+        columns = list(zip(*rows)) if rows else [()] * len(DAILY_COLUMNS)
+        dates = np.array(columns[0], dtype='datetime64[D]')
+        values = {name: np.array(column, dtype=float)
+                  for name, column in zip(DAILY_COLUMNS[1:], columns[1:])}
+        return cls(dates, values)
+
+    def select(self, mask):
+        return DailyColumns(self.dates[mask], {name: column[mask] for name, column in self.values.items()})
+
+    def period(self, year_start, year_end):
+        return self.select((self.years >= year_start) & (self.years <= year_end))
+
+    def __len__(self):
+        return len(self.dates)
+
+
+def _sum(values):
+    # Python's own sum() keeps the summation order (and rounding) of the
+    # original per-row implementation, so rounded results stay identical
+    return sum(values.tolist())
+
+
+class YearlyPartials:
+    """Per-year partial aggregates of a daily table.
+
+    For every year present in the data: the number of days within each
+    threshold range, the precipitation total and the extremes of the
+    temperature and precipitation columns. Any period is obtained by merging
+    the years it covers, so overlapping windows computed from the same table
+    share these aggregates instead of rescanning the daily rows.
+    """
+
+    EXTREME_COLUMNS = ['TempAvg', 'TempHigh', 'TempLow', 'PrecipitationSum']
+
+    def __init__(self, years, first_index, threshold_days, precipitation, maximum, minimum):
+        self.years = years                      # Sorted distinct years
+        self.first_index = first_index          # Row of the first appearance of each year
+        self.threshold_days = threshold_days    # {key: days per year}
+        self.precipitation = precipitation      # Precipitation total per year
+        self.maximum = maximum                  # {column: maximum per year, NaN if no value}
+        self.minimum = minimum                  # {column: minimum per year, NaN if no value}
+
+    @classmethod
+    def from_columns(cls, columns, thresholds=THRESHOLD_DAYS):
+        years, first_index, year_index = np.unique(columns.years, return_index=True, return_inverse=True)
+
+        # Rows grouped by year, keeping the row order inside each year
+        order = np.argsort(year_index, kind='stable')
+        starts = np.searchsorted(year_index[order], np.arange(len(years)))
+
+        threshold_days = {key: np.bincount(year_index, weights=in_range, minlength=len(years)).astype(int)
+                          for key, in_range in threshold_ranges(columns, thresholds).items()}
+
+        # Running sum of each year, added in row order
+        rain = np.nan_to_num(columns.values['PrecipitationSum'][order], nan=0.0)
+        precipitation = np.array([np.cumsum(segment)[-1] for segment in np.split(rain, starts[1:])]) if len(rain) else rain
+
+        maximum, minimum = {}, {}
+        for column in cls.EXTREME_COLUMNS:
+            values = columns.values[column][order]
+            if len(values):
+                # fmax/fmin ignore NaN unless the whole year is NULL
+                maximum[column] = np.fmax.reduceat(values, starts)
+                minimum[column] = np.fmin.reduceat(values, starts)
+            else:
+                maximum[column] = minimum[column] = values
+
+        return cls(years, first_index, threshold_days, precipitation, maximum, minimum)
+
+    def period(self, year_start, year_end):
+        keep = (self.years >= year_start) & (self.years <= year_end)
+        return YearlyPartials(self.years[keep], self.first_index[keep],
+                              {key: days[keep] for key, days in self.threshold_days.items()},
+                              self.precipitation[keep],
+                              {column: values[keep] for column, values in self.maximum.items()},
+                              {column: values[keep] for column, values in self.minimum.items()})
+
+    def average_threshold_days(self):
+        return {key: round(int(days.sum()) / len(self.years)) for key, days in self.threshold_days.items()}
+
+    def yearly_average_precipitation(self):
+        total_years = len(self.years)
+        # Years are summed in order of first appearance in the daily rows
+        yearly_precipitation = self.precipitation[np.argsort(self.first_index)]
+        return round(_sum(yearly_precipitation) / total_years, 1) if total_years > 0 else None
+
+    def max(self, column):
+        values = self.maximum[column]
+        valid = ~np.isnan(values)
+        return values[valid].max() if valid.any() else np.nan
+
+    def min(self, column):
+        values = self.minimum[column]
+        valid = ~np.isnan(values)
+        return values[valid].min() if valid.any() else np.nan
+
+
+def calculate_average(values, precision=1):
+    values = values[~np.isnan(values)]
+    return round(_sum(values) / len(values), precision) if len(values) else None
+
+
+def find_max_with_dates(dates, values, max_value):
+    if np.isnan(max_value):
+        return []
+    selected = values == max_value
+    return [{'Date': str(day), 'Value': str(float(value))} for day, value in zip(dates[selected], values[selected])]
+
+
+def find_min_with_dates(dates, values, min_value):
+    if np.isnan(min_value):
+        # No value at all: every (NULL) entry is reported
+        return [{'Date': str(day), 'Value': 'None'} for day in dates]
+    selected = values == min_value
+    return [{'Date': str(day), 'Value': str(float(value))} for day, value in zip(dates[selected], values[selected])]
+
+
+def threshold_ranges(columns, thresholds=THRESHOLD_DAYS):
+    """Tell, for every threshold of the list, which days fall within its range.
+
+    All the ranges of a given column are evaluated at once by broadcasting the
+    column against the arrays of low and high bounds.
+    Returns a dictionary {key: boolean array of the days}, in thresholds order.
+    """
+    ranges = {}
+    for column in dict.fromkeys(entry[1] for entry in thresholds):
+        entries = [entry for entry in thresholds if entry[1] == column]
+        values = columns.values[column][:, np.newaxis]
+        low = np.array([entry[2] for entry in entries], dtype=float)
+        high = np.array([entry[3] for entry in entries], dtype=float)
+        low_inclusive = np.array([entry[4][0] == '[' for entry in entries])
+        high_inclusive = np.array([entry[4][1] == ']' for entry in entries])
+        # NaN compares False everywhere, so NULL values are never counted
+        in_range = (np.where(low_inclusive, values >= low, values > low)
+                    & np.where(high_inclusive, values <= high, values < high))
+        for index, entry in enumerate(entries):
+            ranges[entry[0]] = in_range[:, index]
+    return {entry[0]: ranges[entry[0]] for entry in thresholds}
+
+
+def calculate_monthly_max_min(values):
+    valid = values[~np.isnan(values)]
+    if not len(valid):
+        return {'Max': None, 'Min': None}
+    return {'Max': float(valid.max()), 'Min': float(valid.min())}
+
+
+def generate_monthly_normals(columns):
     monthly_normals = defaultdict(dict)
 
-    # Grouping data by month
-    data_by_month = defaultdict(list)
-    for entry in data:
-        data_by_month[entry['Date'].month].append(entry)
-
     for month in range(1, 13):  # January to December
-        # Average temperature of the month
-        monthly_normals[calendar.month_name[month]]['Avg_TempAvg'] = calculate_monthly_normals(data, month, 'TempAvg')
-
-        # Average temperature of daily Maximal temperatures of the month
-        monthly_normals[calendar.month_name[month]]['Avg_TempHigh'] = calculate_monthly_normals(data, month, 'TempHigh')
-
-        # Average temperature of daily Minimal temperatures of the month
-        monthly_normals[calendar.month_name[month]]['Avg_TempLow'] = calculate_monthly_normals(data, month, 'TempLow')
-
-        # Highest temperature of the month with the date
-        monthly_normals[calendar.month_name[month]]['Max_TempHigh'] = calculate_monthly_max_min(data, month, 'TempHigh')
+        month_columns = columns.select(columns.months == month)
+        normals = monthly_normals[calendar.month_name[month]]
 
-        # Lowest temperature of the month with the date
-        monthly_normals[calendar.month_name[month]]['Min_TempLow'] = calculate_monthly_max_min(data, month, 'TempLow')
+        # Average temperature of the month, of daily Maximal and Minimal temperatures
+        normals['Avg_TempAvg'] = calculate_average(month_columns.values['TempAvg'], precision=1)
+        normals['Avg_TempHigh'] = calculate_average(month_columns.values['TempHigh'], precision=1)
+        normals['Avg_TempLow'] = calculate_average(month_columns.values['TempLow'], precision=1)
 
-        # Total precipitation of the month
-        total_monthly_precipitation = sum(entry['PrecipitationSum'] for entry in data_by_month[month] if entry['PrecipitationSum'] is not None)
-        total_years = len(set(entry['Date'].year for entry in data_by_month[month]))
+        # Highest and lowest temperatures of the month
+        normals['Max_TempHigh'] = calculate_monthly_max_min(month_columns.values['TempHigh'])
+        normals['Min_TempLow'] = calculate_monthly_max_min(month_columns.values['TempLow'])
 
         # Average monthly precipitation
-        monthly_normals[calendar.month_name[month]]['Avg_Monthly_Precipitation'] = round(total_monthly_precipitation / total_years, 1) if total_years > 0 else None
+        precipitation = month_columns.values['PrecipitationSum']
+        total_years = len(np.unique(month_columns.years))
+        total_monthly_precipitation = _sum(precipitation[~np.isnan(precipitation)])
+        normals['Avg_Monthly_Precipitation'] = round(total_monthly_precipitation / total_years, 1) if total_years > 0 else None
 
         # Number of days with Precipitations >= 1mm
-        total_days_precipitation_1 = sum(1 for entry in data_by_month[month] if entry['PrecipitationSum'] >= 1)
-        monthly_normals[calendar.month_name[month]]['Avg_Days_Precipitation_1'] = round(total_days_precipitation_1 / total_years)
+        total_days_precipitation_1 = int(np.count_nonzero(precipitation >= 1))
+        normals['Avg_Days_Precipitation_1'] = round(total_days_precipitation_1 / total_years) if total_years > 0 else None
 
     return monthly_normals
+
+
+def compute_climate_stats(columns, partials=None):
+    """Compute the overall climate statistics of a period from its daily columns.
+
+    :param columns: DailyColumns of the period.
+    :param partials: YearlyPartials of the same period, computed from the columns if not given.
+    """
+    if not len(columns):
+        raise ValueError("No daily data found for the reference period")
+    if partials is None:
+        partials = YearlyPartials.from_columns(columns)
+
+    values = columns.values
+    climate_stats = {}
+
+    # Average temperature of TempAvg, TempHigh, TempLow
+    climate_stats['Avg_TempAvg'] = calculate_average(values['TempAvg'], precision=1)
+    climate_stats['Avg_TempHigh'] = calculate_average(values['TempHigh'], precision=1)
+    climate_stats['Avg_TempLow'] = calculate_average(values['TempLow'], precision=1)
+
+    # Calculating yearly average precipitation for the specified period
+    climate_stats['Yearly_Avg_Precipitation'] = partials.yearly_average_precipitation()
+
+    # Maximal daily precipitation(s) with the dates
+    climate_stats['Max_Daily_Precipitation'] = find_max_with_dates(columns.dates, values['PrecipitationSum'], partials.max('PrecipitationSum'))
+
+    # Average daily precipitations of the period
+    climate_stats['Avg_Daily_Precipitation'] = calculate_average(values['PrecipitationSum'], precision=1)
+
+    # Maximal(s) and Minimal(s) temperatures with the dates
+    climate_stats['Max_TempHigh'] = find_max_with_dates(columns.dates, values['TempHigh'], partials.max('TempHigh'))
+    climate_stats['Max_TempLow'] = find_max_with_dates(columns.dates, values['TempLow'], partials.max('TempLow'))
+    climate_stats['Min_TempLow'] = find_min_with_dates(columns.dates, values['TempLow'], partials.min('TempLow'))
+    climate_stats['Min_TempHigh'] = find_min_with_dates(columns.dates, values['TempHigh'], partials.min('TempHigh'))
+    climate_stats['Max_TempAvg'] = find_max_with_dates(columns.dates, values['TempAvg'], partials.max('TempAvg'))
+    climate_stats['Min_TempAvg'] = find_min_with_dates(columns.dates, values['TempAvg'], partials.min('TempAvg'))
+
+    # Annual average number of days within each threshold range
+    climate_stats.update(partials.average_threshold_days())
+
+    return climate_stats
+
+
 def write_monthly_normals_to_json(monthly_normals, filename):
     with open(filename, 'r') as json_file:
         try:
@@ -207,209 +353,239 @@ def write_to_json(data, filename):
         json.dump({'_comments': comments, **data}, json_file, indent=4)
 
 
-def generate_climate_stats(year_start, year_end, host, user, password, database, table, output_file):
+def fetch_daily_rows(host, user, password, database, table, year_start=None, year_end=None, explain=False):
     # Establishing a connection to the MySQL database
     connection = pymysql.connect(host=host, user=user, password=password, database=database)
 
     try:
         # Creating a cursor to execute SQL queries
         with connection.cursor() as cursor:
-            # Executing the query to retrieve meteorological data
+            # Executing the query to retrieve meteorological data,
+            # restricted to the years of the reference period(s) with an index friendly range
             query = f"SELECT * FROM {table}"
+            if year_start is not None:
+                date_column = table_columns(cursor, table)[0]
+                query += f" WHERE {period_predicate(date_column, year_start, year_end)}"
+            if explain:
+                check_index_usage(cursor, query)
             cursor.execute(query)
 
             # Fetching all rows
-            data = cursor.fetchall()
+            return cursor.fetchall()
 
     finally:
         # Closing the database connection
         connection.close()
 
-    # Converting fetched data to a list of dictionaries
-    data = [
-        {
-            'Date': row[0],
-            'TempAvg': float(row[1]) if row[1] is not None else None,
-            'TempHigh': float(row[2]) if row[2] is not None else None,
-            'TempLow': float(row[3]) if row[3] is not None else None,
-            'DewPointAvg': float(row[4]) if row[4] is not None else None,
-            'DewPointHigh': float(row[5]) if row[5] is not None else None,
-            'DewPointLow': float(row[6]) if row[6] is not None else None,
-            'HumidityAvg': int(row[7]) if row[7] is not None else None,
-            'HumidityHigh': int(row[8]) if row[8] is not None else None,
-            'HumidityLow': int(row[9]) if row[9] is not None else None,
-            'PressureAvg': float(row[10]) if row[10] is not None else None,
-            'PressureHigh': float(row[11]) if row[11] is not None else None,
-            'PressureLow': float(row[12]) if row[12] is not None else None,
-            'WindSpeedMax': float(row[13]) if row[13] is not None else None,
-            'GustSpeedMax': float(row[14]) if row[14] is not None else None,
-            'PrecipitationSum': float(row[15]) if row[15] is not None else None,
-        }
-        for row in data
-    ]
-
-    # Filtering data for the reference period
-    data = [
-        {
-            'Date': row['Date'],
-            'TempAvg': row['TempAvg'],
-            'TempHigh': row['TempHigh'],
-            'TempLow': row['TempLow'],
-            'DewPointAvg': row['DewPointAvg'],
-            'DewPointHigh': row['DewPointHigh'],
-            'DewPointLow': row['DewPointLow'],
-            'HumidityAvg': row['HumidityAvg'],
-            'HumidityHigh': row['HumidityHigh'],
-            'HumidityLow': row['HumidityLow'],
-            'PressureAvg': row['PressureAvg'],
-            'PressureHigh': row['PressureHigh'],
-            'PressureLow': row['PressureLow'],
-            'WindSpeedMax': row['WindSpeedMax'],
-            'GustSpeedMax': row['GustSpeedMax'],
-            'PrecipitationSum': row['PrecipitationSum'],
-        }
-        for row in data
-        if row['Date'].year >= year_start and row['Date'].year <= year_end
-    ]
-
-    # Calculating climate statistics over the entire period
-    climate_stats = {}
 
-    # Average temperature of TempAvg, TempHigh, TempLow
-    climate_stats['Avg_TempAvg'] = calculate_average(data, 'TempAvg', precision=1)
-    climate_stats['Avg_TempHigh'] = calculate_average(data, 'TempHigh', precision=1)
-    climate_stats['Avg_TempLow'] = calculate_average(data, 'TempLow', precision=1)
+def write_normals(climate_stats, monthly_normals, output_file):
+    # Displaying the overall climate statistics
+    print(climate_stats)
 
-    # Calculating yearly average precipitation for the specified period
-    climate_stats['Yearly_Avg_Precipitation'] = calculate_yearly_average_precipitation(data)
+    # Writing the climate statistics and the monthly normals to the JSON file at once
+    write_to_json({**climate_stats, **monthly_normals}, output_file)
 
 
-    # Maximal daily precipitation(s) with the dates
-    climate_stats['Max_Daily_Precipitation'] = find_max_with_dates(data, 'PrecipitationSum')
+def write_climate_stats(columns, partials, output_file):
+    # Calculating climate statistics over the entire period, then monthly normals
+    climate_stats = compute_climate_stats(columns, partials)
+    monthly_normals = generate_monthly_normals(columns)
 
-    # Average daily precipitations of the period
-    #climate_stats['Avg_Daily_Precipitation'] = climate_stats['Sum_Precipitation'] / len(data)
-    climate_stats['Avg_Daily_Precipitation'] = calculate_average(data, 'PrecipitationSum', precision=1)
+    write_normals(climate_stats, monthly_normals, output_file)
 
-    # Maximal(s) temperature of TempHigh with the dates
-    climate_stats['Max_TempHigh'] = find_max_with_dates(data, 'TempHigh')
 
-    # Maximal(s) temperature of TempLow with the dates
-    climate_stats['Max_TempLow'] = find_max_with_dates(data, 'TempLow')
+def generate_climate_stats(year_start, year_end, host, user, password, database, table, output_file, explain=False):
+    data = fetch_daily_rows(host, user, password, database, table, year_start, year_end, explain)
 
-    # Minimal(s) temperature of TempLow with the dates
-    climate_stats['Min_TempLow'] = find_min_with_dates(data, 'TempLow')
+    # Loading each column once, then keeping the rows of the reference period
+    columns = DailyColumns.from_rows(data).period(year_start, year_end)
 
-    # Minimal(s) temperature of TempHigh with the dates
-    climate_stats['Min_TempHigh'] = find_min_with_dates(data, 'TempHigh')
+    # Constructing the default output file name
+    if not output_file:
+        output_file = f"StatsNormals_{year_start}_{year_end}.json"
 
-    # Maximal(s) temperature of TempAvg with the dates
-    climate_stats['Max_TempAvg'] = find_max_with_dates(data, 'TempAvg')
+    write_climate_stats(columns, None, output_file)
 
-    # Minimal(s) temperature of TempAvg with the dates
-    climate_stats['Min_TempAvg'] = find_min_with_dates(data, 'TempAvg')
 
-    # Number of days with TempLow <= -5° by year
-    climate_stats['Avg_Days_TempLow_minus5'] = calculate_average_days_temp_low(data, (float('-inf'), -5))
-    
-    # Number of days with TempLow <= 0 by year
-    climate_stats['Avg_Days_TempLow_0'] = calculate_average_days_temp_low(data, (float('-inf'), 0))
+def sliding_periods(year_start, year_end, step, length=30):
+    """List the (start, end) periods of `length` years, starting every `step` years
+    from year_start, that end no later than year_end."""
+    return [(start, start + length - 1) for start in range(year_start, year_end - length + 2, step)]
 
-    # Number of days with TempLow > 0 and < 5 by year
-    climate_stats['Avg_Days_TempLow_0_5'] = calculate_average_days_temp_low(data, (0.01, 4.99))
 
-    # Number of days with TempLow >= 5 and < 10 by year
-    climate_stats['Avg_Days_TempLow_5_10'] = calculate_average_days_temp_low(data, (5, 9.99))
+def normals_file_name(year_start, year_end, station=None):
+    prefix = f"StatsNormals_{station}" if station else "StatsNormals"
+    return f"{prefix}_{year_start}_{year_end}.json"
 
-    # Number of days with TempLow >= 10 and < 15 by year
-    climate_stats['Avg_Days_TempLow_10_15'] = calculate_average_days_temp_low(data, (10, 14.99))
 
-    # Number of days with TempLow >= 15 and < 20 by year
-    climate_stats['Avg_Days_TempLow_15_20'] = calculate_average_days_temp_low(data, (15, 19.99))
+def generate_climate_stats_cached(periods, cache_file, host, user, password, database, table, station=None):
+    """Generate the StatsNormals JSON file of every period from the per-year summaries cache.
 
-    # Number of days with TempLow >= 20 by year
-    climate_stats['Avg_Days_TempLow_20'] = calculate_average_days_temp_low(data, (20, float('inf')))
+    Only the years whose daily rows changed since the last run are read from
+    the table; the periods are then merged from the cached years. Detecting
+    the changes still scans (server side) the rows of the years of the periods.
+    Averages are summed year by year, so they may differ from a full
+    computation in the last digit on exact rounding ties.
+    """
+    from WC_NormalsCache import open_refreshed_cache
 
-    # Number of days with TempHigh <= 0 by year
-    climate_stats['Avg_Days_TempHigh_0'] = calculate_average_days_temp_high(data, (float('-inf'), 0))
+    cache = open_refreshed_cache(cache_file, host, user, password, database, table,
+                                 min(period[0] for period in periods), max(period[1] for period in periods))
 
-    # Number of days with TempHigh >= 30 by year
-    climate_stats['Avg_Days_TempHigh_30'] = calculate_average_days_temp_high(data, (30, float('inf')))
+    for year_start, year_end in periods:
+        output_file = normals_file_name(year_start, year_end, station)
+        write_normals(cache.climate_stats(year_start, year_end), cache.monthly_normals(year_start, year_end), output_file)
+        print(f"Climate statistics {year_start}-{year_end} stored in {output_file}")
 
-    # Number of days with TempHigh > 0 and < 5 by year
-    climate_stats['Avg_Days_TempHigh_0_5'] = calculate_average_days_temp_high(data, (0.01, 4.99))
 
-    # Number of days with TempHigh >= 5 and < 10 by year
-    climate_stats['Avg_Days_TempHigh_5_10'] = calculate_average_days_temp_high(data, (5, 9.99))
+def generate_climate_stats_batch(periods, host, user, password, database, table, station=None, explain=False):
+    """Generate the StatsNormals JSON file of every period with a single read of the table.
 
-    # Number of days with TempHigh >= 10 and < 15 by year
-    climate_stats['Avg_Days_TempHigh_10_15'] = calculate_average_days_temp_high(data, (10, 14.99))
+    The daily columns and their per-year partial aggregates are built once;
+    each period then only merges the years it covers.
 
-    # Number of days with TempHigh >= 15 and < 20 by year
-    climate_stats['Avg_Days_TempHigh_15_20'] = calculate_average_days_temp_high(data, (15, 19.99))
+    :param periods: List of (year_start, year_end) tuples.
+    :param station: Station name inserted in the output file names, if any.
+    """
+    data = fetch_daily_rows(host, user, password, database, table,
+                            min(period[0] for period in periods), max(period[1] for period in periods), explain)
 
-    # Number of days with TempHigh >= 20 by year
-    climate_stats['Avg_Days_TempHigh_20'] = calculate_average_days_temp_high(data, (20, float('inf')))
+    all_columns = DailyColumns.from_rows(data)
+    all_partials = YearlyPartials.from_columns(all_columns)
 
-      # Number of days with TempAvg <= 0 by year
-    climate_stats['Avg_Days_TempAvg_0'] = calculate_average_days_temp_avg(data, (float('-inf'), 0))
+    for year_start, year_end in periods:
+        output_file = normals_file_name(year_start, year_end, station)
 
-    # Number of days with TempAvg >= 25 by year
-    climate_stats['Avg_Days_TempAvg_25'] = calculate_average_days_temp_avg(data, (25, float('inf')))
+        write_climate_stats(all_columns.period(year_start, year_end),
+                            all_partials.period(year_start, year_end),
+                            output_file)
+        print(f"Climate statistics {year_start}-{year_end} stored in {output_file}")
 
-    # Number of days with TempAvg > 0 and < 5 by year
-    climate_stats['Avg_Days_TempAvg_0_5'] = calculate_average_days_temp_avg(data, (0.01, 4.99))
 
-    # Number of days with TempAvg >= 5 and < 10 by year
-    climate_stats['Avg_Days_TempAvg_5_10'] = calculate_average_days_temp_avg(data, (5, 9.99))
+def generate_climate_stats_pushdown(periods, host, user, password, database, table, station=None, explain=False):
+    """Generate the StatsNormals JSON file of every period from aggregates computed by MySQL.
+
+    A single grouped query returns one summary row per (year, month) of the
+    periods; only the dates of the extremes are then looked up, with index
+    range queries. Averages are summed by MySQL, so they may differ from a
+    full computation in the last digit on exact rounding ties.
+    """
+    from WC_NormalsCache import AVERAGE_COLUMNS, summarize_grouped_rows, merge_climate_stats, merge_monthly_normals
+
+    connection = pymysql.connect(host=host, user=user, password=password, database=database,
+                                 cursorclass=pymysql.cursors.DictCursor)
+    try:
+        with connection.cursor() as cursor:
+            # Table column names, by position of the logical columns
+            columns = dict(zip(DAILY_COLUMNS, table_columns(cursor, table)))
+            date_column = columns['Date']
+
+            # Days with precipitation >= 1mm are also needed per month
+            thresholds = THRESHOLD_DAYS + [('Days_Precipitation_1', 'PrecipitationSum', 1, float('inf'), '[)')]
+            query = grouped_aggregates_query(table, columns, AVERAGE_COLUMNS, thresholds,
+                                             min(period[0] for period in periods), max(period[1] for period in periods))
+            if explain:
+                check_index_usage(cursor, query)
+            cursor.execute(query)
+            summaries = summarize_grouped_rows(cursor.fetchall())
+
+            for year_start, year_end in periods:
+                def find_dates(column, value):
+                    condition = f"`{columns[column]}` IS NULL" if value is None else f"`{columns[column]}` = %s"
+                    cursor.execute(f"""SELECT `{date_column}` FROM {table}
+                                       WHERE {period_predicate(date_column, year_start, year_end)} AND {condition}
+                                       ORDER BY `{date_column}`""", None if value is None else (value,))
+                    return [str(row[date_column]) for row in cursor.fetchall()]
+
+                period_summaries = [summaries[year] for year in sorted(summaries) if year_start <= year <= year_end]
+                if not period_summaries:
+                    raise ValueError(f"No daily data found for the reference period {year_start}-{year_end}")
+
+                output_file = normals_file_name(year_start, year_end, station)
+                write_normals(merge_climate_stats(period_summaries, find_dates), merge_monthly_normals(period_summaries), output_file)
+                print(f"Climate statistics {year_start}-{year_end} stored in {output_file}")
+    finally:
+        connection.close()
 
-    # Number of days with TempAvg >= 10 and < 15 by year
-    climate_stats['Avg_Days_TempAvg_10_15'] = calculate_average_days_temp_avg(data, (10, 14.99))
 
-    # Number of days with TempAvg >= 15 and < 20 by year
-    climate_stats['Avg_Days_TempAvg_15_20'] = calculate_average_days_temp_avg(data, (15, 19.99))
+def stream_year_summaries(host, user, password, database, table, year_start, year_end, chunk_size=1000):
+    """Read the daily rows of the period through an unbuffered server-side cursor
+    and yield (year, summary) as soon as each year is complete.
 
-    # Number of days with TempAvg >= 20 by year
-    climate_stats['Avg_Days_TempAvg_20'] = calculate_average_days_temp_avg(data, (20, float('inf')))
+    Only the rows of the current year are held in memory, whatever the length
+    of the station history.
+    """
+    from WC_NormalsCache import summarize_year
 
-    # Number of days with PrecipitationSum >= 1 by year
-    climate_stats['Avg_Days_Precipitation_1'] = calculate_average_days_precipitation(data, (1, float('inf')))
+    connection = pymysql.connect(host=host, user=user, password=password, database=database,
+                                 cursorclass=pymysql.cursors.SSCursor)
+    try:
+        with connection.cursor() as cursor:
+            date_column = table_columns(cursor, table)[0]
+            cursor.execute(f"""SELECT * FROM {table}
+                               WHERE {period_predicate(date_column, year_start, year_end)}
+                               ORDER BY `{date_column}`""")
+
+            year, year_rows = None, []
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    if row[0].year != year:
+                        if year_rows:
+                            yield year, summarize_year(DailyColumns.from_rows(year_rows))
+                        year, year_rows = row[0].year, []
+                    year_rows.append(row)
+            if year_rows:
+                yield year, summarize_year(DailyColumns.from_rows(year_rows))
+    finally:
+        connection.close()
 
-    # Number of days with PrecipitationSum > 0 by year
-    climate_stats['Avg_Days_Precipitation_0'] = calculate_average_days_precipitation(data, (0.1, float('inf')))
 
-    # Number of days with PrecipitationSum >= 1 and < 5 by year
-    climate_stats['Avg_Days_Precipitation_1_5'] = calculate_average_days_precipitation(data, (1, 4.99))
+def generate_climate_stats_streaming(periods, host, user, password, database, table, station=None, chunk_size=1000):
+    """Generate the StatsNormals JSON file of every period in constant memory.
 
-    # Number of days with PrecipitationSum >= 5 and < 10 by year
-    climate_stats['Avg_Days_Precipitation_5_10'] = calculate_average_days_precipitation(data, (5, 9.99))
+    The daily rows are streamed once and folded year by year into summaries,
+    which are then merged per period. Averages are summed year by year, so
+    they may differ from a full computation in the last digit on exact rounding ties.
+    """
+    from WC_NormalsCache import merge_climate_stats, merge_monthly_normals
 
-    # Number of days with PrecipitationSum >= 10 by year
-    climate_stats['Avg_Days_Precipitation_10'] = calculate_average_days_precipitation(data, (10, float('inf')))
-    
-    # Number of days with PrecipitationSum >= 20 by year
-    climate_stats['Avg_Days_Precipitation_20'] = calculate_average_days_precipitation(data, (20, float('inf')))
+    summaries = dict(stream_year_summaries(host, user, password, database, table,
+                                           min(period[0] for period in periods), max(period[1] for period in periods),
+                                           chunk_size))
 
-    # Displaying the overall climate statistics
-    print(climate_stats)
+    for year_start, year_end in periods:
+        period_summaries = [summaries[year] for year in sorted(summaries) if year_start <= year <= year_end]
+        if not period_summaries:
+            raise ValueError(f"No daily data found for the reference period {year_start}-{year_end}")
 
-    # Constructing the default output file name
-    if not output_file:
-        output_file = f"StatsNormals_{year_start}_{year_end}.json"
+        output_file = normals_file_name(year_start, year_end, station)
+        write_normals(merge_climate_stats(period_summaries), merge_monthly_normals(period_summaries), output_file)
+        print(f"Climate statistics {year_start}-{year_end} stored in {output_file}")
 
-    # Writing the climate statistics to a JSON file
-    write_to_json(climate_stats, output_file)
 
-    # Generating and writing monthly normals to the same JSON file
-    monthly_normals = generate_monthly_normals(data)
-    write_monthly_normals_to_json(monthly_normals, output_file)
+# ------------------------------------------------------------
+# Check if the format of the period given in Arguments is valid
+# ------------------------------------------------------------
+def valid_period_type(arg_period_str):
+    """custom argparse *period* type, "YYYY-YYYY", for user periods given from the command line"""
+    try:
+        year_start, year_end = (int(year) for year in arg_period_str.split('-'))
+    except ValueError:
+        msg = "Given Period ({0}) not valid! Expected format, YYYY-YYYY !".format(arg_period_str)
+        raise argparse.ArgumentTypeError(msg)
+    if year_start > year_end:
+        raise argparse.ArgumentTypeError(f"Given Period ({arg_period_str}) not valid! Start year is after end year !")
+    return (year_start, year_end)
 
 
 if __name__ == "__main__":
     # Configuring Argparse to handle arguments
     parser = argparse.ArgumentParser(description="Script to generate overall climate statistics for a specified period.")
-    parser.add_argument("year_start", type=int, help="Starting year of the reference period")
-    parser.add_argument("year_end", type=int, help="Ending year of the reference period")
+    parser.add_argument("year_start", type=int, nargs='?', help="Starting year of the reference period")
+    parser.add_argument("year_end", type=int, nargs='?', help="Ending year of the reference period")
     parser.add_argument("--host", type=str, help="MySQL database host", required=True)
     parser.add_argument("--user", type=str, help="MySQL database user", required=True)
     parser.add_argument("--password", type=str, help="MySQL database password", required=True)
@@ -417,8 +593,58 @@ if __name__ == "__main__":
     parser.add_argument("--table", type=str, help="Table name", required=True)
     parser.add_argument("--output_file", type=str, help="Output JSON file name", default="")
 
+    # Batch mode: several periods computed from a single read of the table
+    batch = parser.add_mutually_exclusive_group()
+    batch.add_argument("--periods", type=valid_period_type, nargs='+', metavar='YYYY-YYYY',
+                       help="List of reference periods, ex: 1961-1990 1971-2000 1981-2010")
+    batch.add_argument("--sliding", type=int, nargs=3, metavar=('START', 'END', 'STEP'),
+                       help="Sliding periods of --length years starting every STEP years from START up to END")
+    parser.add_argument("--length", type=int, default=30, help="Length in years of the sliding periods (default 30)")
+    parser.add_argument("--station", type=str, help="Station name used in batch output file names: StatsNormals_<station>_<start>_<end>.json")
+
+    # Computation mode, default the daily rows read at once
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--cache", type=str, help="Per-year summaries cache file of the table; only the years changed since the last run are read")
+    mode.add_argument("--pushdown", action="store_true", help="Compute the aggregates in MySQL (GROUP BY year, month) instead of reading the daily rows")
+    mode.add_argument("--stream", action="store_true", help="Stream the daily rows with a server-side cursor and aggregate them year by year in constant memory")
+    parser.add_argument("--explain", action="store_true", help="Print the EXPLAIN plan of the data query and warn if the date index is not used")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Number of rows fetched at once in --stream mode (default 1000)")
+    parser.add_argument("--store", type=str, help="Also add the generated StatsNormals to this binary normals store (see WC_NormalsStore)")
+
     # Parsing arguments
     args = parser.parse_args()
 
-    # Calling the function with the specified years and connection details
-    generate_climate_stats(args.year_start, args.year_end, args.host, args.user, args.password, args.database, args.table, args.output_file)
\ No newline at end of file
+    periods = None
+    if args.periods or args.sliding:
+        periods = args.periods if args.periods else sliding_periods(*args.sliding, length=args.length)
+    elif args.year_start is None or args.year_end is None:
+        parser.error("year_start and year_end are required unless --periods or --sliding is given")
+    if args.output_file and (periods or args.cache or args.pushdown or args.stream):
+        # Those modes name their files StatsNormals[_<station>]_<start>_<end>.json
+        parser.error("--output_file cannot be combined with --periods, --sliding, --cache, --pushdown or --stream")
+
+    if args.cache:
+        generate_climate_stats_cached(periods or [(args.year_start, args.year_end)], args.cache, args.host, args.user, args.password, args.database, args.table, args.station)
+    elif args.pushdown:
+        generate_climate_stats_pushdown(periods or [(args.year_start, args.year_end)], args.host, args.user, args.password, args.database, args.table, args.station, args.explain)
+    elif args.stream:
+        generate_climate_stats_streaming(periods or [(args.year_start, args.year_end)], args.host, args.user, args.password, args.database, args.table, args.station, args.chunk_size)
+    elif periods:
+        generate_climate_stats_batch(periods, args.host, args.user, args.password, args.database, args.table, args.station, args.explain)
+    else:
+        # Calling the function with the specified years and connection details
+        generate_climate_stats(args.year_start, args.year_end, args.host, args.user, args.password, args.database, args.table, args.output_file, args.explain)
+
+    if args.store:
+        from WC_NormalsStore import update_store
+
+        station = args.station or ''
+        if periods:
+            output_files = {(station, year_start, year_end): normals_file_name(year_start, year_end, args.station)
+                            for year_start, year_end in periods}
+        elif args.cache or args.pushdown or args.stream:
+            output_files = {(station, args.year_start, args.year_end): normals_file_name(args.year_start, args.year_end, args.station)}
+        else:
+            output_files = {(station, args.year_start, args.year_end): args.output_file or f"StatsNormals_{args.year_start}_{args.year_end}.json"}
+        update_store(args.store, output_files)
+        print(f"Climate statistics added to the normals store {args.store}")
@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+"""Persistent per-year summaries of a daily weather table.
+
+The cache keeps, for every year of a station table, everything the
+StatsNormals JSON needs: threshold-day counts, sums and counts, extremes with
+their dates and per-month aggregates. A normal over year_start..year_end is
+then obtained by merging the cached years, without reading the daily rows.
+
+Each cached year carries a fingerprint (row count and XOR of the rows CRC32)
+computed by MySQL. On refresh, only the years whose fingerprint changed are
+fetched again, so adding one day of data re-reads a single year. Change
+detection is still an O(rows) server-side scan hashing every row, restricted
+to the years of the requested periods with a range-scannable date predicate:
+it avoids transferring and summarizing the unchanged years, not reading them.
+"""
+import json
+import os
+import calendar
+import numpy as np
+import pymysql
+
+from WC_GenNormalsStats import DailyColumns, THRESHOLD_DAYS, YearlyPartials
+from WC_NormalsQuery import period_predicate, table_columns
+
+CACHE_VERSION = 1
+
+# Columns whose averages are part of the normals
+AVERAGE_COLUMNS = ['TempAvg', 'TempHigh', 'TempLow', 'PrecipitationSum']
+
+
+def _extreme(dates, values, function):
+    # Extreme value of the year with its dates; with no value at all, the
+    # dates of every (NULL) entry are kept, as find_min_with_dates reports them
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return [None, [str(day) for day in dates]]
+    extreme = function(values[valid])
+    return [float(extreme), [str(day) for day in dates[values == extreme]]]
+
+
+def summarize_year(columns):
+    """Build the summary of one year from its DailyColumns."""
+    partials = YearlyPartials.from_columns(columns)
+    summary = {
+        'threshold_days': {key: int(days[0]) for key, days in partials.threshold_days.items()},
+        'precipitation': float(partials.precipitation[0]),
+        'sum': {}, 'count': {}, 'max': {}, 'min': {},
+        'months': {},
+    }
+    for column in AVERAGE_COLUMNS:
+        values = columns.values[column]
+        valid = values[~np.isnan(values)]
+        summary['sum'][column] = sum(valid.tolist())
+        summary['count'][column] = len(valid)
+    for column in YearlyPartials.EXTREME_COLUMNS:
+        summary['max'][column] = _extreme(columns.dates, columns.values[column], np.max)
+        summary['min'][column] = _extreme(columns.dates, columns.values[column], np.min)
+
+    for month in np.unique(columns.months):
+        month_columns = columns.select(columns.months == month)
+        month_summary = {'sum': {}, 'count': {}}
+        for column in ['TempAvg', 'TempHigh', 'TempLow']:
+            values = month_columns.values[column]
+            valid = values[~np.isnan(values)]
+            month_summary['sum'][column] = sum(valid.tolist())
+            month_summary['count'][column] = len(valid)
+        for column in ['TempHigh', 'TempLow']:
+            values = month_columns.values[column]
+            valid = values[~np.isnan(values)]
+            month_summary[column] = [float(valid.max()), float(valid.min())] if len(valid) else [None, None]
+        rain = month_columns.values['PrecipitationSum']
+        month_summary['precipitation'] = sum(rain[~np.isnan(rain)].tolist())
+        month_summary['days_precipitation_1'] = int(np.count_nonzero(rain >= 1))
+        summary['months'][str(int(month))] = month_summary
+
+    return summary
+
+
+class NormalsCache:
+    """Per-year summaries of one daily table, stored in a JSON file."""
+
+    def __init__(self, filename, table):
+        self.filename = filename
+        self.table = table
+        self.years = {}
+
+        if os.path.exists(filename):
+            with open(filename, 'r') as cache_file:
+                content = json.load(cache_file)
+            # A cache built for another table or layout is simply rebuilt
+            if content.get('version') == CACHE_VERSION and content.get('table') == table:
+                self.years = {int(year): entry for year, entry in content['years'].items()}
+
+    def save(self):
+        content = {'version': CACHE_VERSION, 'table': self.table,
+                   'years': {str(year): self.years[year] for year in sorted(self.years)}}
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'w') as cache_file:
+            json.dump(content, cache_file)
+        os.replace(temporary, self.filename)
+
+    def refresh(self, connection, year_start=None, year_end=None):
+        """Bring the cache up to date with the table, re-reading only the changed years.
+
+        The fingerprints are computed by a server-side scan of the rows of
+        year_start..year_end (default the whole table); the cached years out
+        of that range are kept as they are.
+        Returns the list of years that were (re)computed.
+        """
+        with connection.cursor() as cursor:
+            # Column names are taken from the table itself: the date is the first one
+            names = table_columns(cursor, self.table)
+            date_column = names[0]
+            row_image = ", ".join(f"IFNULL(`{name}`, '\\\\N')" for name in names)
+
+            checked = lambda year: (year_start is None or year >= year_start) and (year_end is None or year <= year_end)
+            where = ""
+            if year_start is not None and year_end is not None:
+                where = f"WHERE {period_predicate(date_column, year_start, year_end)}"
+
+            cursor.execute(f"""SELECT YEAR(`{date_column}`), COUNT(*), BIT_XOR(CRC32(CONCAT_WS('|', {row_image})))
+                               FROM {self.table}
+                               {where}
+                               GROUP BY YEAR(`{date_column}`)""")
+            fingerprints = {int(year): [int(count), int(crc)] for year, count, crc in cursor.fetchall()}
+
+            # Years removed from the table are dropped, changed or new ones re-read
+            for year in [year for year in self.years if checked(year) and year not in fingerprints]:
+                del self.years[year]
+            changed = sorted(year for year, fingerprint in fingerprints.items()
+                             if self.years.get(year, {}).get('fingerprint') != fingerprint)
+
+            for year in changed:
+                cursor.execute(f"SELECT * FROM {self.table} WHERE {period_predicate(date_column, year, year)}")
+                columns = DailyColumns.from_rows(cursor.fetchall())
+                self.years[year] = {'fingerprint': fingerprints[year], 'summary': summarize_year(columns)}
+
+        return changed
+
+    def summaries(self, year_start, year_end):
+        summaries = [self.years[year]['summary'] for year in sorted(self.years) if year_start <= year <= year_end]
+        if not summaries:
+            raise ValueError(f"No daily data found for the reference period {year_start}-{year_end}")
+        return summaries
+
+    def climate_stats(self, year_start, year_end):
+        """Overall climate statistics of the period, merged from the cached years."""
+        return merge_climate_stats(self.summaries(year_start, year_end))
+
+    def monthly_normals(self, year_start, year_end):
+        """Monthly normals of the period, merged from the cached years."""
+        return merge_monthly_normals(self.summaries(year_start, year_end))
+
+
+def summarize_grouped_rows(rows):
+    """Build the year summaries from the (year, month) rows of grouped_aggregates_query.
+
+    MySQL only returns the extreme values, so their dates are left to None;
+    merge_climate_stats looks them up through its find_dates function.
+    Returns a dictionary {year: summary}.
+    """
+    summaries = {}
+    for row in rows:
+        summary = summaries.setdefault(int(row['Year']), {
+            'threshold_days': {key: 0 for key, column, low, high, bounds in THRESHOLD_DAYS},
+            'precipitation': 0.0,
+            'sum': {column: 0.0 for column in AVERAGE_COLUMNS},
+            'count': {column: 0 for column in AVERAGE_COLUMNS},
+            'max': {column: [None, None] for column in YearlyPartials.EXTREME_COLUMNS},
+            'min': {column: [None, None] for column in YearlyPartials.EXTREME_COLUMNS},
+            'months': {},
+        })
+
+        def value(field):
+            return float(row[field]) if row[field] is not None else None
+
+        for key in summary['threshold_days']:
+            summary['threshold_days'][key] += int(row[key])
+        summary['precipitation'] += value('PrecipitationSum_Sum') or 0.0
+        for column in AVERAGE_COLUMNS:
+            summary['sum'][column] += value(f"{column}_Sum") or 0.0
+            summary['count'][column] += int(row[f"{column}_Count"])
+        for column in YearlyPartials.EXTREME_COLUMNS:
+            for kind, field, function in (('max', f"{column}_Max", max), ('min', f"{column}_Min", min)):
+                candidates = [v for v in (summary[kind][column][0], value(field)) if v is not None]
+                summary[kind][column][0] = function(candidates) if candidates else None
+
+        summary['months'][str(int(row['Month']))] = {
+            'sum': {column: value(f"{column}_Sum") or 0.0 for column in ['TempAvg', 'TempHigh', 'TempLow']},
+            'count': {column: int(row[f"{column}_Count"]) for column in ['TempAvg', 'TempHigh', 'TempLow']},
+            'TempHigh': [value('TempHigh_Max'), value('TempHigh_Min')],
+            'TempLow': [value('TempLow_Max'), value('TempLow_Min')],
+            'precipitation': value('PrecipitationSum_Sum') or 0.0,
+            'days_precipitation_1': int(row['Days_Precipitation_1']),
+        }
+    return summaries
+
+
+def merge_climate_stats(summaries, find_dates=None):
+    """Overall climate statistics of a period from the summaries of its years.
+
+    :param summaries: List of year summaries (see summarize_year).
+    :param find_dates: Function (column, value) returning the dates of the
+                       period where column equals value (NULL for None), used
+                       when the summaries do not carry the dates of their extremes.
+    """
+    total_years = len(summaries)
+
+    def average(column):
+        count = sum(summary['count'][column] for summary in summaries)
+        return round(sum(summary['sum'][column] for summary in summaries) / count, 1) if count else None
+
+    def extreme(kind, column, function):
+        entries = [summary[kind][column] for summary in summaries]
+        values = [value for value, dates in entries if value is not None]
+        best = function(values) if values else None
+        if best is None and kind == 'max':
+            return []
+        if any(dates is None for value, dates in entries):
+            dates = find_dates(column, best)
+        else:
+            dates = [day for value, days in entries if value == best for day in days]
+        # Without any value, every (NULL) entry is reported as find_min_with_dates does
+        return [{'Date': day, 'Value': str(best)} for day in dates]
+
+    climate_stats = {}
+    climate_stats['Avg_TempAvg'] = average('TempAvg')
+    climate_stats['Avg_TempHigh'] = average('TempHigh')
+    climate_stats['Avg_TempLow'] = average('TempLow')
+    climate_stats['Yearly_Avg_Precipitation'] = round(sum(summary['precipitation'] for summary in summaries) / total_years, 1)
+    climate_stats['Max_Daily_Precipitation'] = extreme('max', 'PrecipitationSum', max)
+    climate_stats['Avg_Daily_Precipitation'] = average('PrecipitationSum')
+    climate_stats['Max_TempHigh'] = extreme('max', 'TempHigh', max)
+    climate_stats['Max_TempLow'] = extreme('max', 'TempLow', max)
+    climate_stats['Min_TempLow'] = extreme('min', 'TempLow', min)
+    climate_stats['Min_TempHigh'] = extreme('min', 'TempHigh', min)
+    climate_stats['Max_TempAvg'] = extreme('max', 'TempAvg', max)
+    climate_stats['Min_TempAvg'] = extreme('min', 'TempAvg', min)
+    for key, column, low, high, bounds in THRESHOLD_DAYS:
+        climate_stats[key] = round(sum(summary['threshold_days'][key] for summary in summaries) / total_years)
+
+    return climate_stats
+
+
+def merge_monthly_normals(summaries):
+    """Monthly normals of a period from the summaries of its years."""
+    monthly_normals = {}
+
+    for month in range(1, 13):  # January to December
+        months = [summary['months'][str(month)] for summary in summaries if str(month) in summary['months']]
+        total_years = len(months)
+
+        def average(column):
+            count = sum(entry['count'][column] for entry in months)
+            return round(sum(entry['sum'][column] for entry in months) / count, 1) if count else None
+
+        def max_min(column):
+            maxima = [entry[column][0] for entry in months if entry[column][0] is not None]
+            minima = [entry[column][1] for entry in months if entry[column][1] is not None]
+            return {'Max': max(maxima) if maxima else None, 'Min': min(minima) if minima else None}
+
+        normals = monthly_normals[calendar.month_name[month]] = {}
+        normals['Avg_TempAvg'] = average('TempAvg')
+        normals['Avg_TempHigh'] = average('TempHigh')
+        normals['Avg_TempLow'] = average('TempLow')
+        normals['Max_TempHigh'] = max_min('TempHigh')
+        normals['Min_TempLow'] = max_min('TempLow')
+        normals['Avg_Monthly_Precipitation'] = round(sum(entry['precipitation'] for entry in months) / total_years, 1) if total_years > 0 else None
+        normals['Avg_Days_Precipitation_1'] = round(sum(entry['days_precipitation_1'] for entry in months) / total_years) if total_years > 0 else None
+
+    return monthly_normals
+
+
+def open_refreshed_cache(filename, host, user, password, database, table, year_start=None, year_end=None):
+    """Load the cache file and bring the years year_start..year_end (default all) up to date with the table."""
+    cache = NormalsCache(filename, table)
+    connection = pymysql.connect(host=host, user=user, password=password, database=database)
+    try:
+        changed = cache.refresh(connection, year_start, year_end)
+    finally:
+        connection.close()
+    cache.save()
+    print(f"Normals cache {filename}: {len(changed)} year(s) recomputed {changed}")
+    return cache
@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+"""Per day-of-year sufficient statistics of a daily table, for incremental normals.
+
+The climate_normals_<start>_<end> tables hold one row per MM-DD, each field
+being a crossref expression such as ROUND(AVG(MaxTemp), 1) over the days of
+the period. Those aggregates are rebuilt from, for every year and MM-DD,
+the COUNT, SUM, MIN and MAX of each source column:
+
+    stats = DayOfYearStats('normals_1991_2020.state.json', 'DayWeatherConditions', 1991, 2020)
+    changed = stats.refresh(connection, parse_crossref(crossref))
+    rows = stats.normals(parse_crossref(crossref), changed)
+    stats.save()
+
+As in WC_NormalsCache, each year carries a MySQL fingerprint (row count and
+XOR of the rows CRC32): a refresh re-reads the grouped statistics of the
+changed years only, and reports the MM-DD whose statistics moved. After the
+nightly daily update, that is a single year and a single MM-DD. The parsed
+crossref is kept in the state: when an expression changed (ROUND digits,
+aggregate, new field), every MM-DD is reported.
+
+grouped_day_statistics reads the same statistics for a range of years in a
+single grouped query, and day_normals derives the normals of any period
+within it: several normals tables come from one scan of the source.
+
+The aggregates follow MySQL on DECIMAL columns: AVG is the exact quotient
+rounded to 4 more decimals than the column (div_precision_increment), ROUND
+rounds half away from zero.
+"""
+import json
+import os
+import re
+from decimal import Decimal, ROUND_HALF_UP
+
+from WC_NormalsQuery import check_index_usage, period_predicate, table_columns
+
+STATE_VERSION = 2
+
+# Default div_precision_increment of MySQL
+DIV_PRECISION_INCREMENT = 4
+
+AGGREGATES = ('AVG', 'SUM', 'MIN', 'MAX', 'COUNT')
+
+_ROUND = re.compile(r"^ROUND\s*\((.*?)(?:,\s*(\d+)\s*)?\)$", re.IGNORECASE | re.DOTALL)
+_AGGREGATE = re.compile(r"^(AVG|SUM|MIN|MAX|COUNT)\s*\(\s*`?(\w+)`?\s*\)$", re.IGNORECASE)
+
+
+def parse_crossref(crossref):
+    """Decompose the crossref expressions into {field: (aggregate, column, digits)}.
+
+    digits is None for an expression not wrapped in ROUND. Raises ValueError
+    for an expression that cannot be rebuilt from COUNT/SUM/MIN/MAX.
+    """
+    parsed = {}
+    for field, expression in crossref.items():
+        expression = expression.strip()
+        digits = None
+        rounded = _ROUND.match(expression)
+        if rounded:
+            expression, digits = rounded.group(1).strip(), int(rounded.group(2) or 0)
+        aggregate = _AGGREGATE.match(expression)
+        if not aggregate:
+            raise ValueError(f"Crossref expression of {field} ({crossref[field]}) is not [ROUND(]AVG|SUM|MIN|MAX|COUNT(column)[, n)]: "
+                             f"use a full generation instead of the incremental mode")
+        parsed[field] = (aggregate.group(1).upper(), aggregate.group(2), digits)
+    return parsed
+
+
+def source_columns(parsed):
+    """Source columns used by the parsed crossref, in order of appearance."""
+    return list(dict.fromkeys(column for aggregate, column, digits in parsed.values()))
+
+
+def _dump(value):
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def _load(value):
+    return Decimal(value) if isinstance(value, str) else value
+
+
+def _round(value, digits):
+    if value is None or digits is None:
+        return value
+    if isinstance(value, Decimal):
+        return value.quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP)
+    return round(value, digits)
+
+
+def _scale(value):
+    return -value.as_tuple().exponent if isinstance(value, Decimal) else 0
+
+
+def merge_statistics(entries):
+    """Merge [count, sum, min, max] statistics (None when no value)."""
+    count, total, minimum, maximum = 0, None, None, None
+    for entry_count, entry_sum, entry_min, entry_max in entries:
+        if not entry_count:
+            continue
+        count += entry_count
+        total = entry_sum if total is None else total + entry_sum
+        minimum = entry_min if minimum is None or entry_min < minimum else minimum
+        maximum = entry_max if maximum is None or entry_max > maximum else maximum
+    return count, total, minimum, maximum
+
+
+def aggregate_value(aggregate, statistics, digits):
+    """Value of a crossref aggregate from merged statistics."""
+    count, total, minimum, maximum = statistics
+    if aggregate == 'COUNT':
+        return count
+    if aggregate == 'MIN':
+        value = minimum
+    elif aggregate == 'MAX':
+        value = maximum
+    elif aggregate == 'SUM':
+        value = total
+    elif not count:
+        value = None
+    elif isinstance(total, Decimal):
+        value = (total / count).quantize(Decimal(1).scaleb(-(_scale(total) + DIV_PRECISION_INCREMENT)), rounding=ROUND_HALF_UP)
+    else:
+        value = total / count
+    return _round(value, digits)
+
+
+def _dicts(cursor):
+    names = [description[0] for description in cursor.description]
+    return [row if isinstance(row, dict) else dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def grouped_day_statistics(cursor, table, columns, year_start, year_end, date_column='Date', explain=False):
+    """Statistics of the columns per year and MM-DD, from one grouped query.
+
+    :return: {year: {MM-DD: {column: [count, sum, min, max]}}}
+    """
+    fields = ", ".join(f"COUNT(`{column}`) AS `{column}_Count`, SUM(`{column}`) AS `{column}_Sum`, "
+                       f"MIN(`{column}`) AS `{column}_Min`, MAX(`{column}`) AS `{column}_Max`"
+                       for column in columns)
+    query = f"""SELECT YEAR(`{date_column}`) AS Year, DATE_FORMAT(`{date_column}`, '%%m-%%d') AS DayOfYear, {fields}
+                FROM {table}
+                WHERE {period_predicate(date_column, year_start, year_end)}
+                GROUP BY Year, DayOfYear"""
+    if explain:
+        check_index_usage(cursor, query, ())
+    cursor.execute(query, ())
+    years = {}
+    for row in _dicts(cursor):
+        years.setdefault(int(row['Year']), {})[row['DayOfYear']] = {
+            column: [int(row[f"{column}_Count"]), row[f"{column}_Sum"], row[f"{column}_Min"], row[f"{column}_Max"]]
+            for column in columns}
+    return years
+
+
+def day_normals(years, parsed, days=None, year_start=None, year_end=None):
+    """Normals rows {'DayOfYear': MM-DD, field: value, ...} from per-year statistics.
+
+    :param years: {year: {MM-DD: {column: [count, sum, min, max]}}}, see grouped_day_statistics.
+    :param parsed: Crossref parsed by parse_crossref.
+    :param days: MM-DD to compute, default all. Those without any row in the
+                 period are left out, as GROUP BY does.
+    :param year_start, year_end: Years of the period, default all the years given.
+    """
+    selected = [years[year] for year in sorted(years)
+                if (year_start is None or year >= year_start) and (year_end is None or year <= year_end)]
+    if days is None:
+        days = sorted({day for year_days in selected for day in year_days})
+    columns = source_columns(parsed)
+    rows = []
+    for day in days:
+        entries = [year_days[day] for year_days in selected if day in year_days]
+        if not entries:
+            continue
+        merged = {column: merge_statistics(entry[column] for entry in entries) for column in columns}
+        row = {'DayOfYear': day}
+        for field, (aggregate, column, digits) in parsed.items():
+            row[field] = aggregate_value(aggregate, merged[column], digits)
+        rows.append(row)
+    return rows
+
+
+class DayOfYearStats:
+    """Per year and MM-DD statistics of the source columns, stored in a JSON file."""
+
+    def __init__(self, filename, table, year_start, year_end, date_column='Date'):
+        self.filename = filename
+        self.table = table
+        self.year_start = int(year_start)
+        self.year_end = int(year_end)
+        self.date_column = date_column
+        self.columns = []
+        self.crossref = {}
+        self.years = {}
+
+        if os.path.exists(filename):
+            with open(filename, 'r') as state_file:
+                content = json.load(state_file)
+            # A state built for another table or period is simply rebuilt
+            if (content.get('version') == STATE_VERSION and content.get('table') == table
+                    and content.get('period') == [self.year_start, self.year_end]):
+                self.columns = content['columns']
+                self.crossref = {field: tuple(expression) for field, expression in content['crossref'].items()}
+                self.years = {int(year): {'fingerprint': entry['fingerprint'],
+                                          'days': {day: {column: [_load(value) for value in statistics]
+                                                         for column, statistics in columns.items()}
+                                                   for day, columns in entry['days'].items()}}
+                              for year, entry in content['years'].items()}
+
+    def save(self):
+        content = {'version': STATE_VERSION, 'table': self.table, 'period': [self.year_start, self.year_end],
+                   'columns': self.columns, 'crossref': self.crossref,
+                   'years': {str(year): {'fingerprint': entry['fingerprint'],
+                                         'days': {day: {column: [_dump(value) for value in statistics]
+                                                        for column, statistics in columns.items()}
+                                                  for day, columns in entry['days'].items()}}
+                             for year, entry in sorted(self.years.items())}}
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'w') as state_file:
+            json.dump(content, state_file)
+        os.replace(temporary, self.filename)
+
+    def days(self):
+        """MM-DD having at least one row in the period."""
+        return sorted({day for entry in self.years.values() for day in entry['days']})
+
+    def refresh(self, connection, parsed):
+        """Bring the statistics up to date with the table, re-reading only the changed years.
+
+        :param parsed: Crossref parsed by parse_crossref.
+        Returns the sorted list of the MM-DD whose statistics changed, or of
+        all the MM-DD when the crossref changed since the last refresh.
+        """
+        columns = source_columns(parsed)
+        if sorted(columns) != sorted(self.columns):
+            # Other source columns: everything is read again
+            self.columns, self.years = list(columns), {}
+        # Another expression over the same columns changes the normals of every day
+        crossref_changed = dict(parsed) != self.crossref
+        self.crossref = dict(parsed)
+
+        with connection.cursor() as cursor:
+            names = table_columns(cursor, self.table)
+            row_image = ", ".join(f"IFNULL(`{name}`, '\\\\N')" for name in names)
+            cursor.execute(f"""SELECT YEAR(`{self.date_column}`) AS Year, COUNT(*) AS Days,
+                                      BIT_XOR(CRC32(CONCAT_WS('|', {row_image}))) AS Crc
+                               FROM {self.table}
+                               WHERE {period_predicate(self.date_column, self.year_start, self.year_end)}
+                               GROUP BY YEAR(`{self.date_column}`)""")
+            fingerprints = {int(row['Year']): [int(row['Days']), int(row['Crc'])] for row in _dicts(cursor)}
+
+            changed_days = set()
+            for year in set(self.years) - set(fingerprints):
+                changed_days.update(self.years.pop(year)['days'])
+
+            for year in sorted(fingerprints):
+                if self.years.get(year, {}).get('fingerprint') == fingerprints[year]:
+                    continue
+                days = grouped_day_statistics(cursor, self.table, self.columns, year, year,
+                                              self.date_column).get(year, {})
+
+                previous = self.years.get(year, {}).get('days', {})
+                changed_days.update(day for day in set(days) | set(previous) if days.get(day) != previous.get(day))
+                self.years[year] = {'fingerprint': fingerprints[year], 'days': days}
+
+        if crossref_changed:
+            changed_days.update(self.days())
+        return sorted(changed_days)
+
+    def normals(self, parsed, days):
+        """Normals rows {'DayOfYear': MM-DD, field: value, ...} of the given MM-DD.
+
+        MM-DD without any row in the period are left out, as GROUP BY does.
+        """
+        return day_normals({year: entry['days'] for year, entry in self.years.items()}, parsed, days)
+
+
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""SQL building blocks shared by the normals tools.
+
+- period_predicate turns a year_start..year_end period into a sargable
+  `Date >= 'YYYY-01-01' AND Date < 'YYYY-01-01'` range, which MySQL can
+  resolve on the primary key of the date column, unlike YEAR(Date) BETWEEN.
+- grouped_aggregates_query pushes the COUNT/SUM/MIN/MAX and threshold-day
+  aggregates down to MySQL, grouped by year and month, so that a 30 years
+  period returns 360 summary rows instead of ~11000 daily rows.
+- check_index_usage runs EXPLAIN on a query and reports full table scans.
+"""
+from datetime import date
+
+
+def period_range(year_start, year_end):
+    """First day of the period and first day after it, as 'YYYY-MM-DD' strings."""
+    return date(int(year_start), 1, 1).isoformat(), date(int(year_end) + 1, 1, 1).isoformat()
+
+
+def period_predicate(date_column, year_start, year_end):
+    """Index friendly WHERE predicate selecting the years year_start..year_end."""
+    first_day, day_after = period_range(year_start, year_end)
+    return f"`{date_column}` >= '{first_day}' AND `{date_column}` < '{day_after}'"
+
+
+def table_columns(cursor, table):
+    """Names of the columns of the table, in table order."""
+    cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+    # Consume the (empty) result, as unbuffered cursors require before the next query
+    cursor.fetchall()
+    return [description[0] for description in cursor.description]
+
+
+def threshold_condition(column, low, high, bounds):
+    """SQL condition of a threshold range (see THRESHOLD_DAYS for the bounds notation)."""
+    conditions = []
+    if low != float('-inf'):
+        conditions.append(f"`{column}` {'>=' if bounds[0] == '[' else '>'} {low}")
+    if high != float('inf'):
+        conditions.append(f"`{column}` {'<=' if bounds[1] == ']' else '<'} {high}")
+    return " AND ".join(conditions) if conditions else f"`{column}` IS NOT NULL"
+
+
+def grouped_aggregates_query(table, columns, aggregate_columns, thresholds, year_start, year_end):
+    """Build the query returning one summary row per (year, month) of the period.
+
+    :param table: Daily table name.
+    :param columns: Dictionary mapping the logical column names (DAILY_COLUMNS) to the table column names.
+    :param aggregate_columns: Logical columns whose COUNT, SUM, MIN and MAX are returned.
+    :param thresholds: List of (key, column, low, high, bounds) threshold ranges counted per group.
+    :return: The SQL query. Row fields are Year, Month, Days, then <column>_Count,
+             <column>_Sum, <column>_Min, <column>_Max for each aggregate column,
+             then one count per threshold key.
+    """
+    date_column = columns['Date']
+    fields = [f"YEAR(`{date_column}`) AS Year", f"MONTH(`{date_column}`) AS Month", "COUNT(*) AS Days"]
+    for name in aggregate_columns:
+        column = columns[name]
+        fields += [f"COUNT(`{column}`) AS {name}_Count", f"SUM(`{column}`) AS {name}_Sum",
+                   f"MIN(`{column}`) AS {name}_Min", f"MAX(`{column}`) AS {name}_Max"]
+    for key, name, low, high, bounds in thresholds:
+        fields.append(f"COUNT(CASE WHEN {threshold_condition(columns[name], low, high, bounds)} THEN 1 END) AS {key}")
+
+    return f"""SELECT {', '.join(fields)}
+               FROM {table}
+               WHERE {period_predicate(date_column, year_start, year_end)}
+               GROUP BY YEAR(`{date_column}`), MONTH(`{date_column}`)
+               ORDER BY Year, Month"""
+
+
+def explain(cursor, query, params=None):
+    """EXPLAIN the query and return the plan as a list of dictionaries."""
+    cursor.execute(f"EXPLAIN {query}", params)
+    names = [description[0] for description in cursor.description]
+    return [row if isinstance(row, dict) else dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def check_index_usage(cursor, query, params=None):
+    """Check with EXPLAIN that every table access of the query uses an index.
+
+    Prints the plan and a warning for each full table scan (access type ALL or
+    no key). Returns True when an index is used everywhere.
+    """
+    uses_index = True
+    for step in explain(cursor, query, params):
+        print(f"EXPLAIN table={step.get('table')} type={step.get('type')} key={step.get('key')} rows={step.get('rows')}")
+        if step.get('table') and (step.get('type') == 'ALL' or step.get('key') is None):
+            print(f"WARNING: full scan of {step.get('table')}, the date range predicate does not use an index")
+            uses_index = False
+    return uses_index
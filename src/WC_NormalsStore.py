@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Compact binary store of the StatsNormals of every station and period.
+
+The StatsNormals_<station>_<start>_<end>.json files stay the reference output;
+this store gathers them in a single versioned file that is memory-mapped and
+read one metric at a time, instead of parsing every JSON file:
+
+    with NormalsStore('normals.bin') as store:
+        store.value('LilleLesquin', 1991, 2020, 'July_Avg_TempHigh')
+        store.metric('Avg_TempAvg')          # {(station, start, end): value}
+
+Metric names are the DisplayNormalsJson flattened keys (January_Max_TempHigh_Max).
+Layout, little-endian:
+
+    header     HEADER, fixed size
+    series     n_series SERIES entries (station, year start, year end), sorted
+    metrics    n_metrics METRIC entries (name, kind), sorted by name
+    cells      n_metrics x n_series CELL entries, metric-major: the cells of a
+               metric over all the series are contiguous
+    dates      uint32 YYYYMMDD dates of the records (Max_TempHigh, ...)
+
+A cell holds the value (NaN when missing) and, for a record metric, the
+position and number of its dates. The file is rewritten as a whole and
+replaced atomically: readers keep a consistent mapping.
+"""
+import argparse
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+import struct
+
+from DisplayNormalsJson import flatten_dict
+
+MAGIC = b'WCNORMLS'
+STORE_VERSION = 1
+
+# magic, version, reserved, n_series, n_metrics, n_dates, offsets of series, metrics, cells and dates
+HEADER = struct.Struct('<8sHHIIIQQQQ')
+SERIES = struct.Struct('<32sHH')
+METRIC = struct.Struct('<48sB7x')
+CELL = struct.Struct('<dII')
+DATE = struct.Struct('<I')
+
+# Metric kinds
+FLOAT, INTEGER, RECORDS = 0, 1, 2
+
+_FILE_NAME = re.compile(r"^StatsNormals(?:_(.+?))?_(\d{4})[_-](\d{4})\.json$")
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _encode(text, size):
+    encoded = text.encode('utf-8')
+    if len(encoded) > size:
+        raise ValueError(f"'{text}' is longer than {size} bytes")
+    return encoded
+
+
+def _decode(raw):
+    return raw.rstrip(b'\0').decode('utf-8')
+
+
+def station_period(filename):
+    """(station, year start, year end) of a StatsNormals file name, station '' when none."""
+    match = _FILE_NAME.match(os.path.basename(filename))
+    if not match:
+        raise ValueError(f"{filename} is not a StatsNormals_<station>_<start>_<end>.json file")
+    return match.group(1) or '', int(match.group(2)), int(match.group(3))
+
+
+def flatten_normals(stats):
+    """Flattened metrics of a StatsNormals content, without the comments."""
+    return flatten_dict({key: value for key, value in stats.items() if key != '_comments'})
+
+
+def _kind(values):
+    if any(isinstance(value, list) for value in values):
+        return RECORDS
+    if all(value is None or isinstance(value, int) for value in values):
+        return INTEGER
+    return FLOAT
+
+
+def write_store(filename, entries):
+    """Write the store of entries {(station, year start, year end): flattened metrics}."""
+    series = sorted(entries)
+    names = sorted({name for metrics in entries.values() for name in metrics})
+    kinds = [_kind([entries[key].get(name) for key in series]) for name in names]
+
+    cells, dates = [], []
+    for name, kind in zip(names, kinds):
+        for key in series:
+            value = entries[key].get(name)
+            if kind == RECORDS:
+                records = value or []
+                cells.append((float(records[0]['Value']) if records else math.nan, len(dates), len(records)))
+                dates.extend(int(record['Date'].replace('-', '')) for record in records)
+            else:
+                cells.append((math.nan if value is None else float(value), 0, 0))
+
+    series_offset = HEADER.size
+    metrics_offset = series_offset + len(series) * SERIES.size
+    cells_offset = _align(metrics_offset + len(names) * METRIC.size)
+    dates_offset = cells_offset + len(cells) * CELL.size
+
+    buffer = bytearray(dates_offset + len(dates) * DATE.size)
+    HEADER.pack_into(buffer, 0, MAGIC, STORE_VERSION, 0, len(series), len(names), len(dates),
+                     series_offset, metrics_offset, cells_offset, dates_offset)
+    for position, (station, year_start, year_end) in enumerate(series):
+        SERIES.pack_into(buffer, series_offset + position * SERIES.size, _encode(station, 32), year_start, year_end)
+    for position, (name, kind) in enumerate(zip(names, kinds)):
+        METRIC.pack_into(buffer, metrics_offset + position * METRIC.size, _encode(name, 48), kind)
+    for position, cell in enumerate(cells):
+        CELL.pack_into(buffer, cells_offset + position * CELL.size, *cell)
+    for position, date in enumerate(dates):
+        DATE.pack_into(buffer, dates_offset + position * DATE.size, date)
+
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as store_file:
+        store_file.write(buffer)
+    os.replace(temporary, filename)
+
+
+class NormalsStore:
+    """Memory-mapped reader of a normals store file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as store_file:
+            self._map = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, reserved, self._n_series, self._n_metrics, self._n_dates,
+         self._series_offset, self._metrics_offset, self._cells_offset, self._dates_offset) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{filename} is not a normals store")
+        if version != STORE_VERSION:
+            self.close()
+            raise ValueError(f"{filename}: normals store version {version} not supported (expected {STORE_VERSION})")
+
+        # Only the two small sorted tables are decoded, the cells are read on demand
+        self._series = [SERIES.unpack_from(self._map, self._series_offset + position * SERIES.size)
+                        for position in range(self._n_series)]
+        self._series = [(_decode(station), year_start, year_end) for station, year_start, year_end in self._series]
+        self._metrics = [METRIC.unpack_from(self._map, self._metrics_offset + position * METRIC.size)
+                         for position in range(self._n_metrics)]
+        self._names = [_decode(name) for name, kind in self._metrics]
+        self._kinds = [kind for name, kind in self._metrics]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def series(self):
+        """Sorted list of the (station, year start, year end) of the store."""
+        return list(self._series)
+
+    def metrics(self):
+        """Sorted list of the metric names of the store."""
+        return list(self._names)
+
+    def _position(self, table, key, what):
+        position = bisect.bisect_left(table, key)
+        if position == len(table) or table[position] != key:
+            raise KeyError(f"{what} {key} not found in {self.filename}")
+        return position
+
+    def _cell(self, metric_position, series_position):
+        value, first, count = CELL.unpack_from(self._map, self._cells_offset
+                                               + (metric_position * self._n_series + series_position) * CELL.size)
+        kind = self._kinds[metric_position]
+        if kind == RECORDS:
+            if not count:
+                return None
+            return [{'Date': f"{date // 10000:04d}-{date // 100 % 100:02d}-{date % 100:02d}", 'Value': str(value)}
+                    for date, in (DATE.unpack_from(self._map, self._dates_offset + (first + position) * DATE.size)
+                                  for position in range(count))]
+        if math.isnan(value):
+            return None
+        return int(value) if kind == INTEGER else value
+
+    def value(self, station, year_start, year_end, metric):
+        """Value of a metric for a station and period, as in the JSON file (None when missing)."""
+        return self._cell(self._position(self._names, metric, 'Metric'),
+                          self._position(self._series, (station, int(year_start), int(year_end)), 'Station period'))
+
+    def metric(self, metric):
+        """Values of a metric for every station and period, {(station, year start, year end): value}."""
+        metric_position = self._position(self._names, metric, 'Metric')
+        return {key: self._cell(metric_position, position) for position, key in enumerate(self._series)}
+
+    def normals(self, station, year_start, year_end):
+        """All the flattened metrics of a station and period."""
+        series_position = self._position(self._series, (station, int(year_start), int(year_end)), 'Station period')
+        return {name: self._cell(position, series_position) for position, name in enumerate(self._names)}
+
+
+def read_store(filename):
+    """All the entries of a store, {(station, year start, year end): flattened metrics}."""
+    if not os.path.exists(filename):
+        return {}
+    with NormalsStore(filename) as store:
+        return {key: {name: value for name, value in store.normals(*key).items() if value is not None}
+                for key in store.series()}
+
+
+def update_store(filename, normals_files):
+    """Add (or replace) StatsNormals JSON files in the store.
+
+    :param normals_files: {(station, year start, year end): JSON file name}, see station_period.
+    :return: Sorted list of the (station, year start, year end) of the store.
+    """
+    entries = read_store(filename)
+    for key, normals_file in normals_files.items():
+        with open(normals_file, 'r') as json_file:
+            entries[key] = flatten_normals(json.load(json_file))
+    write_store(filename, entries)
+    return sorted(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the binary store of the StatsNormals JSON files.")
+    parser.add_argument("store", type=str, help="Normals store file")
+    parser.add_argument("--add", type=str, nargs='+', metavar='JSON', help="StatsNormals_<station>_<start>_<end>.json files to add to the store")
+    parser.add_argument("--metric", type=str, help="Print the values of a metric, ex: Avg_TempAvg, July_Avg_TempHigh")
+    parser.add_argument("--station", type=str, help="Station of the --metric values")
+    parser.add_argument("--list", action="store_true", help="List the stations, periods and metrics of the store")
+    args = parser.parse_args()
+
+    if args.add:
+        series = update_store(args.store, {station_period(normals_file): normals_file for normals_file in args.add})
+        print(f"{len(args.add)} file(s) added to {args.store}, {len(series)} station period(s) stored")
+
+    if args.metric or args.list:
+        with NormalsStore(args.store) as store:
+            if args.list:
+                for station, year_start, year_end in store.series():
+                    print(f"{station or '-'} {year_start}-{year_end}")
+                print(", ".join(store.metrics()))
+            if args.metric:
+                for (station, year_start, year_end), value in store.metric(args.metric).items():
+                    if args.station is None or station == args.station:
+                        print(f"{station or '-'} {year_start}-{year_end}: {value}")
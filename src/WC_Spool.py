@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Local write-ahead spool of the realtime observations.
+
+The realtime collector appends every observation to a SQLite database in WAL
+mode before anything else; a drainer then replays the spooled rows to MySQL
+in bulk and removes them once committed there:
+
+    spool = ObservationSpool('~/.cache/wc_realtime_spool.sqlite')
+    spool.append('IVILLE402', [row])
+    spool.drain({'IVILLE402': write_rows})
+
+- An append is a local SQLite transaction: ingest does not wait for MySQL, and
+  nothing is lost while the database is down (maintenance, backup-sync).
+  Appends made concurrently (pollers of several stations) are group committed:
+  one transaction, hence one fsync, covers all of them.
+- The rows of a drain batch are removed only after the writer returned, so a
+  failed or interrupted drain is replayed later. Writers must be idempotent
+  (INSERT ... ON DUPLICATE KEY UPDATE on WC_Datetime).
+- Several processes may share the spool file: SQLite serializes the writers.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_SPOOL_FILE = os.path.join('~', '.cache', 'wc_realtime_spool.sqlite')
+
+
+class _Commit:
+    """Rows of the appends grouped into one spool transaction."""
+
+    def __init__(self):
+        self.entries = []
+        self.done = False
+        self.error = None
+
+
+class ObservationSpool:
+    """Append-only SQLite spool of observation rows, per station."""
+
+    def __init__(self, filename=DEFAULT_SPOOL_FILE):
+        self.filename = os.path.expanduser(filename)
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Group commit of the appends: the commit being filled, and whether another one is being written
+        self._group = threading.Condition()
+        self._commit = _Commit()
+        self._committing = False
+        self._db = sqlite3.connect(self.filename, timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL: appends are sequential writes, readers (drainer) do not block the collector
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS spool (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                station TEXT NOT NULL,
+                                spooled REAL NOT NULL,
+                                row TEXT NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS spool_station ON spool (station, id)")
+
+    def append(self, station, rows):
+        """Durably store rows of a station, returning once they are committed.
+
+        The rows of the appends waiting while a commit is written are
+        committed together by the next one, in one transaction (one fsync).
+        """
+        spooled = time.time()
+        with self._group:
+            commit = self._commit
+            commit.entries.extend((station, spooled, json.dumps(list(row))) for row in rows)
+            while not commit.done:
+                if self._committing:
+                    self._group.wait()
+                    continue
+                # No commit running: this append writes the rows queued so far, its own included
+                self._committing = True
+                self._commit = _Commit()
+                self._group.release()
+                try:
+                    self._write(commit.entries)
+                except BaseException as e:
+                    commit.error = e
+                finally:
+                    self._group.acquire()
+                    commit.done = True
+                    self._committing = False
+                    self._group.notify_all()
+        if commit.error is not None:
+            raise commit.error
+
+    def _write(self, entries):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("INSERT INTO spool (station, spooled, row) VALUES (?, ?, ?)", entries)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def pending(self, station=None, limit=1000):
+        """Oldest spooled entries, as (id, station, spooled time, row) tuples."""
+        with self._lock:
+            if station is None:
+                cursor = self._db.execute("SELECT id, station, spooled, row FROM spool ORDER BY id LIMIT ?", (limit,))
+            else:
+                cursor = self._db.execute("SELECT id, station, spooled, row FROM spool WHERE station = ? ORDER BY id LIMIT ?",
+                                          (station, limit))
+            return [(id, station, spooled, tuple(json.loads(row))) for id, station, spooled, row in cursor.fetchall()]
+
+    def count(self, station=None):
+        with self._lock:
+            if station is None:
+                return self._db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM spool WHERE station = ?", (station,)).fetchone()[0]
+
+    def remove(self, ids):
+        """Remove the entries of a drained batch, in one transaction (one fsync)."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("DELETE FROM spool WHERE id = ?", [(id,) for id in ids])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def drain(self, writers, batch_size=1000, failed=None):
+        """Replay the spooled rows with writers {station: function(rows)}.
+
+        Each station is drained independently: a station whose writer fails
+        keeps its rows for the next drain while the others go on, and is
+        added to the failed set when one is given.
+        Returns {station: list of the spooled times of the rows written}.
+        """
+        drained = {}
+        for station, write in writers.items():
+            while True:
+                entries = self.pending(station, batch_size)
+                if not entries:
+                    break
+                try:
+                    write([row for id, station_name, spooled, row in entries])
+                except Exception as e:
+                    print(f"{station}: drain failed, {self.count(station)} observation(s) left in the spool: {e!r}")
+                    if failed is not None:
+                        failed.add(station)
+                    break
+                self.remove([id for id, station_name, spooled, row in entries])
+                drained.setdefault(station, []).extend(spooled for id, station_name, spooled, row in entries)
+                if len(entries) < batch_size:
+                    break
+        return drained
+
+    def close(self):
+        with self._lock:
+            self._db.close()
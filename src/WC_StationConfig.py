@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Weather stations of the JSON configuration file, and their concurrent processing.
+
+The configuration holds one entry per station under "dbConfigs":
+
+    {"dbConfigs": {"db1": {"weatherStation": "IVILLE402", "host": ..., "database": ...,
+                           "username": ..., "password": ..., "tablewc": ..., "tabledwc": ...,
+                           "latitude": ..., "longitude": ..., "timezone": ...},
+                   "db2": {...}}}
+
+run_stations processes every selected station in its own thread: a station
+failing (WU or database down) is reported without stopping the others, so
+adding a station only means adding an entry to the file.
+"""
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Historical -V/-B command line options and their station keys
+VILLEBON_KEY = 'db1'
+BETHUNE_KEY = 'db2'
+
+
+def load_station_configs(config_path):
+    """All the station configurations of the file, as {station key: config}."""
+    with open(config_path, 'r') as file:
+        return json.load(file)['dbConfigs']
+
+
+def select_stations(configs, keys=None):
+    """Configurations of the given station keys, or of every station when keys is empty."""
+    if not keys:
+        return dict(configs)
+    unknown = [key for key in keys if key not in configs]
+    if unknown:
+        raise ValueError(f"Station key(s) {', '.join(unknown)} not found in configuration file.")
+    return {key: configs[key] for key in keys}
+
+
+def run_stations(function, stations, workers=None):
+    """Call function(key, config) for every station concurrently.
+
+    Returns {station key: exception} for the stations that failed.
+    """
+    def isolated(key):
+        try:
+            function(key, stations[key])
+            return None
+        except Exception as e:
+            print(f"Station {key} ({stations[key].get('weatherStation')}) failed: {e!r}")
+            traceback.print_exc()
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers or max(1, len(stations))) as executor:
+        results = dict(zip(stations, executor.map(isolated, stations)))
+    return {key: error for key, error in results.items() if error is not None}
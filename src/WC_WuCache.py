@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""On-disk cache of the Weather Underground API responses.
+
+Entries are keyed by station, endpoint and date; the file name is the
+SHA-256 of that key and the content the gzip compressed JSON answer with its
+expiry time:
+
+    cache = ResponseCache('~/.cache/wu_responses')
+    body = cache.get(('ILEDEFRA131', 'history/daily', '20240101'))
+    cache.put(('ILEDEFRA131', 'history/daily', '20240101'), body, ttl=None)
+
+- ttl=None stores an immutable entry (the history of a past day never changes),
+  a number of seconds an entry expiring after that delay (current observations).
+- The cache is bounded to max_bytes of compressed files: the least recently
+  used entries are evicted first (file modification time, touched on each hit).
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'wu_responses')
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+class ResponseCache:
+    """Size-bounded LRU store of compressed API responses."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        # Current size of the store, maintained on put and eviction
+        self._size = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.json.gz'))
+
+    def _path(self, key):
+        digest = hashlib.sha256('|'.join(str(part) for part in key).encode('utf8')).hexdigest()
+        return os.path.join(self.directory, digest + '.json.gz')
+
+    def get(self, key):
+        """Return the cached response text, or None when absent or expired."""
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf8') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError, EOFError):
+            return None
+        if entry['expires'] is not None and entry['expires'] < time.time():
+            self._remove(path)
+            return None
+        try:
+            # Most recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return entry['body']
+
+    def put(self, key, body, ttl=None):
+        """Store a response text, immutable when ttl is None."""
+        path = self._path(key)
+        entry = {'key': [str(part) for part in key], 'expires': None if ttl is None else time.time() + ttl, 'body': body}
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(temporary, 'wt', encoding='utf8') as entry_file:
+            json.dump(entry, entry_file)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temporary, path)
+            self._size += os.path.getsize(path) - previous
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _remove(self, path):
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def _evict(self):
+        # Least recently used entries first, down to 90% of the bound
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith('.json.gz')),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                self._size -= size
+            except OSError:
+                pass
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Weather Underground (api.weather.com) HTTP access shared by the collectors.
+
+- TokenBucket limits the request rate of all the threads sharing it.
+- fetch_json gets a JSON document, retrying with exponential backoff on
+  HTTP 429 and 5xx answers (honouring Retry-After) and on network errors.
+- HttpSession keeps one HTTP(S) connection open per thread and host, for
+  long running collectors polling the same endpoints.
+- fetch_cached_json serves the answer from a WC_WuCache.ResponseCache when
+  it holds it, and stores the fresh answers there otherwise.
+- fetch_all runs a fetch function over many items from a pool of worker
+  threads and feeds the results into a bounded queue, so that a single
+  consumer (the database writer) applies backpressure to the fetch stage.
+"""
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.parse
+import urllib.request, urllib.error
+
+from easydict import EasyDict as edict
+
+# HTTP codes worth retrying: rate limited or server side failures
+RETRY_CODES = {429, 500, 502, 503, 504}
+
+# Lifetime in seconds of a cached answer without observations (station offline, day not published yet)
+EMPTY_TTL = 600
+
+
+class TokenBucket:
+    """Token bucket rate limiter: rate tokens per second, bursts up to capacity."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class HttpSession:
+    """Persistent (keep-alive) HTTP connections, one per thread, scheme and host.
+
+    Each thread has its own connections: concurrent pollers of stations on the
+    same host do not wait for each other's requests.
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._connections = {}      # {(thread id, scheme, host): connection}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """GET the url and return the body, raising urllib.error.HTTPError on HTTP errors."""
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        key = (threading.get_ident(), parts.scheme, parts.netloc)
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is None:
+                connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+                connection = self._connections[key] = connection_class(parts.netloc, timeout=self.timeout)
+        try:
+            connection.request('GET', path, headers={'Accept-Encoding': 'identity'})
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            # Connection closed by the server meanwhile: reopened by the next request
+            connection.close()
+            raise
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return body
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections = {}
+
+
+def fetch_json(url, limiter=None, retries=4, backoff=1.0, timeout=30, session=None):
+    """GET a JSON document and return it as an EasyDict.
+
+    Returns {} for an empty answer or when the request still fails after the
+    retries (errors are printed, as the collectors always did). With a
+    session, the request goes through its persistent connection.
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        delay = backoff * 2 ** attempt
+        try:
+            if session is not None:
+                mystr = session.get(url).decode("utf8")
+            else:
+                with urllib.request.urlopen(url, timeout=timeout) as fp:
+                    mystr = fp.read().decode("utf8")
+            # used edict ==> Very useful when exploiting parsed JSON content !
+            return edict(json.loads(mystr)) if mystr else {}
+        except urllib.error.HTTPError as e:
+            # Return code error (e.g. 404, 501, ...)
+            print('HTTPError: {} ({})'.format(e.code, url))
+            if e.code not in RETRY_CODES:
+                return {}
+            retry_after = e.headers.get('Retry-After') if e.headers else None
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+        except urllib.error.URLError as e:
+            # Not an HTTP-specific error (e.g. connection refused)
+            print('URLError: {} ({})'.format(e.reason, url))
+        except (http.client.HTTPException, OSError) as e:
+            # Timeout or connection reset while reading the answer
+            print('Error: {} ({})'.format(e, url))
+
+        if attempt < retries:
+            time.sleep(delay)
+    return {}
+
+
+def fetch_cached_json(url, cache=None, key=None, ttl=None, limiter=None, session=None, empty_ttl=EMPTY_TTL):
+    """fetch_json through a response cache (see WC_WuCache.ResponseCache).
+
+    :param key: Cache key of the answer, e.g. (station, endpoint, date).
+    :param ttl: Lifetime of the cached answer in seconds, None if immutable.
+    :param empty_ttl: Lifetime of an answer without observations, which may
+                      still be published later: never cached as immutable.
+    """
+    if cache is not None:
+        body = cache.get(key)
+        if body is not None:
+            return edict(json.loads(body)) if body else {}
+
+    result = fetch_json(url, limiter=limiter, session=session)
+    # Failed or empty answers are not cached, they are asked again next time
+    if cache is not None and result:
+        if not result.get('observations'):
+            ttl = empty_ttl if ttl is None else min(ttl, empty_ttl)
+        cache.put(key, json.dumps(result), ttl)
+    return result
+
+
+# End of the results of one worker thread
+_DONE = object()
+
+
+def fetch_all(items, fetch, workers=4, queue_size=64):
+    """Run fetch(item) for every item from worker threads.
+
+    Yields (item, result) in completion order. Results go through a queue of
+    queue_size entries: workers wait when the consumer falls behind.
+    """
+    items_queue = queue.Queue()
+    for item in items:
+        items_queue.put(item)
+    results = queue.Queue(maxsize=queue_size)
+
+    def worker():
+        try:
+            while True:
+                try:
+                    item = items_queue.get_nowait()
+                except queue.Empty:
+                    break
+                results.put((item, fetch(item)))
+        except Exception as e:
+            # Raised again on the consumer side
+            results.put(e)
+        finally:
+            results.put(_DONE)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+
+    running = len(threads)
+    while running:
+        result = results.get()
+        if result is _DONE:
+            running -= 1
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            yield result
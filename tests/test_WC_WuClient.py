@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""WC_WuClient against a local http.server standing in for api.weather.com."""
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from WC_WuClient import HttpSession, TokenBucket, fetch_all, fetch_json
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    """Answers each path with the scripted status codes, then 200 with a JSON body."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.scripts = {}       # {path: [(status, headers), ...]} answered before the 200
+        self.requests = {}      # {path: [request time, ...]}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.delay = 0          # Seconds spent on each answer
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.setdefault(self.path, []).append(time.monotonic())
+            script = server.scripts.get(self.path)
+            status, headers = script.pop(0) if script else (200, {})
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            body = json.dumps({'observations': [{'path': self.path}]}).encode('utf8') if status == 200 else b''
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WuClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandIn()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retries_rate_limited_and_server_errors(self):
+        self.server.scripts['/history'] = [(429, {}), (503, {}), (500, {})]
+        started = time.monotonic()
+        result = fetch_json(self.server.url('/history'), retries=4, backoff=0.05)
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(result['observations'][0]['path'], '/history')
+        self.assertEqual(len(self.server.requests['/history']), 4)
+        # Exponential backoff: 0.05 + 0.1 + 0.2 seconds between the attempts
+        self.assertGreaterEqual(elapsed, 0.35)
+
+    def test_retry_after_is_honoured(self):
+        self.server.scripts['/current'] = [(429, {'Retry-After': '1'})]
+        result = fetch_json(self.server.url('/current'), retries=1, backoff=0.01)
+
+        self.assertTrue(result)
+        first, second = self.server.requests['/current']
+        self.assertGreaterEqual(second - first, 1)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.scripts['/missing'] = [(404, {}), (404, {})]
+        self.assertEqual(fetch_json(self.server.url('/missing'), retries=4, backoff=0.01), {})
+        self.assertEqual(len(self.server.requests['/missing']), 1)
+
+    def test_gives_up_after_the_retries(self):
+        self.server.scripts['/down'] = [(502, {})] * 10
+        self.assertEqual(fetch_json(self.server.url('/down'), retries=2, backoff=0.01), {})
+        self.assertEqual(len(self.server.requests['/down']), 3)
+
+    def test_session_retries(self):
+        self.server.scripts['/session'] = [(503, {})]
+        session = HttpSession(timeout=5)
+        try:
+            result = fetch_json(self.server.url('/session'), retries=2, backoff=0.01, session=session)
+        finally:
+            session.close()
+        self.assertTrue(result)
+        self.assertEqual(len(self.server.requests['/session']), 2)
+
+    def test_session_threads_do_not_wait_for_each_other(self):
+        self.server.delay = 0.3
+        session = HttpSession(timeout=5)
+        try:
+            threads = [threading.Thread(target=session.get, args=(self.server.url(f'/station/{station}'),))
+                       for station in ('IBTHUN1', 'IVILLE402')]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            session.close()
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    def test_rate_limit(self):
+        limiter = TokenBucket(rate=20, capacity=1)
+        for day in range(6):
+            fetch_json(self.server.url(f'/day/{day}'), limiter=limiter)
+
+        times = sorted(moment for path, moments in self.server.requests.items() for moment in moments)
+        # One burst token, then one request every 1/20 s
+        self.assertGreaterEqual(times[-1] - times[0], 5 / 20 * 0.9)
+
+    def test_fetch_all_yields_every_item_under_the_worker_limit(self):
+        self.server.delay = 0.02
+        items = list(range(40))
+        results = dict(fetch_all(items, lambda item: fetch_json(self.server.url(f'/item/{item}')),
+                                 workers=4, queue_size=2))
+
+        self.assertEqual(sorted(results), items)
+        for item, result in results.items():
+            self.assertEqual(result['observations'][0]['path'], f'/item/{item}')
+        self.assertLessEqual(self.server.max_in_flight, 4)
+        self.assertGreater(self.server.max_in_flight, 1)
+
+    def test_fetch_all_raises_the_fetch_errors(self):
+        def fetch(item):
+            if item == 3:
+                raise ValueError(item)
+            return item
+
+        with self.assertRaises(ValueError):
+            list(fetch_all(range(10), fetch, workers=2))
+
+
+if __name__ == '__main__':
+    unittest.main()